@@ -0,0 +1,121 @@
+package Checkpoint_stamp;
+
+use strict;
+use warnings;
+use Carp;
+use Digest::MD5;
+
+## Checkpoint (.ok) files for outputs built from an input file, such as an index of a bam.
+##
+## The checkpoint records the input file's size and mtime (size <tab> mtime), so the output
+## is reused only while the input is unchanged, and rebuilt once the input is regenerated.
+##
+## Aligner indexes built from several files instead record a build signature of them all
+## (get_build_signature), written to the index's build.ok once the build completes.
+
+
+####
+sub write_checkpoint {
+    my ($checkpoint_file, $input_file) = @_;
+
+    my @stat = stat($input_file) or confess "Error, cannot stat $input_file";
+
+    open(my $ofh, ">$checkpoint_file.tmp.$$") or confess "Error, cannot write to $checkpoint_file.tmp.$$";
+    print $ofh join("\t", $stat[7], $stat[9]) . "\n";
+    close $ofh;
+
+    rename("$checkpoint_file.tmp.$$", $checkpoint_file) or confess "Error, cannot rename $checkpoint_file.tmp.$$ to $checkpoint_file";
+
+    return;
+}
+
+
+####
+sub is_checkpoint_current {
+    my ($checkpoint_file, $input_file) = @_;
+
+    unless (-s $checkpoint_file) {
+        return(0);
+    }
+
+    open(my $fh, $checkpoint_file) or confess "Error, cannot open file: $checkpoint_file";
+    my $line = <$fh>;
+    close $fh;
+
+    chomp $line;
+    my ($size, $mtime) = split(/\t/, $line);
+    my @stat = stat($input_file) or confess "Error, cannot stat $input_file";
+
+    if (defined($mtime) && $size == $stat[7] && $mtime == $stat[9]) {
+        return(1);
+    }
+    else {
+        # input was replaced since the checkpoint was written
+        return(0);
+    }
+}
+
+
+####
+sub get_build_signature {
+    my ($stat_files_aref, $content_files_aref) = @_;
+
+    ## large files (ie. the genome) by path, size, and mtime, and the small ones (ie. the fusion contigs
+    ## and annotations) by content, since each run may be given its own copy of them.
+
+    my $md5 = Digest::MD5->new();
+
+    foreach my $file (@$stat_files_aref) {
+        my @stat = stat($file) or confess "Error, cannot stat $file";
+        $md5->add(join("\t", $file, $stat[7], $stat[9]) . "\n");
+    }
+
+    foreach my $file (@$content_files_aref) {
+        if ($file) {
+            open(my $fh, $file) or confess "Error, cannot open file: $file";
+            binmode($fh);
+            $md5->addfile($fh);
+            close $fh;
+        }
+        $md5->add("\n");
+    }
+
+    return(substr($md5->hexdigest(), 0, 12));
+}
+
+
+####
+sub write_build_signature {
+    my ($build_ok_file, $build_signature) = @_;
+
+    open(my $ofh, ">$build_ok_file.tmp.$$") or confess "Error, cannot write to $build_ok_file.tmp.$$";
+    print $ofh "$build_signature\n";
+    close $ofh;
+
+    rename("$build_ok_file.tmp.$$", $build_ok_file) or confess "Error, cannot rename $build_ok_file.tmp.$$ to $build_ok_file";
+
+    return;
+}
+
+
+####
+sub get_recorded_build_signature {
+    my ($build_ok_file) = @_;
+
+    unless (-e $build_ok_file) {
+        return("");
+    }
+
+    open(my $fh, $build_ok_file) or confess "Error, cannot open file: $build_ok_file";
+    my $build_signature = <$fh>;
+    close $fh;
+
+    # built before the signature was recorded, leaving an empty build.ok
+    $build_signature = "" unless defined $build_signature;
+    chomp $build_signature;
+
+    return($build_signature);
+}
+
+
+1; #EOM
@@ -0,0 +1,38 @@
+package Contigs_bed;
+
+use strict;
+use warnings;
+use Carp;
+
+## Bed regions spanning each contig of a fasta file in full, for restricting alignments to those
+## contigs (ie. samtools view -L) once aligned against the genome along with them.
+
+
+####
+sub write_contigs_bed {
+    my ($fasta_file, $bed_file) = @_;
+
+    open(my $fh, $fasta_file) or confess "Error, cannot open file: $fasta_file";
+    open(my $ofh, ">$bed_file") or confess "Error, cannot write to $bed_file";
+    my $contig;
+    my $contig_len = 0;
+    while (<$fh>) {
+        chomp;
+        if (/^>(\S+)/) {
+            print $ofh join("\t", $contig, 0, $contig_len) . "\n" if defined $contig;
+            $contig = $1;
+            $contig_len = 0;
+        }
+        else {
+            $contig_len += length($_);
+        }
+    }
+    print $ofh join("\t", $contig, 0, $contig_len) . "\n" if defined $contig;
+    close $ofh;
+    close $fh;
+
+    return;
+}
+
+
+1; #EOM
@@ -0,0 +1,205 @@
+#!/usr/local/bin/perl -w
+
+# random access to subsequences of a fasta file via its samtools-style .fai index,
+# so only the requested regions are ever read into memory.
+package Fasta_faidx_reader;
+
+use strict;
+use warnings;
+use Carp;
+
+sub new {
+    my ($packagename, $fastaFile) = @_;
+
+    unless ($fastaFile) {
+        confess "Error, need fasta filename as parameter";
+    }
+    if ($fastaFile =~ /\.gz$/) {
+        confess "Error, random access requires an uncompressed fasta file: $fastaFile";
+    }
+
+    my $self = { fastaFile => $fastaFile,
+                 fileHandle => undef,
+                 _pid => undef,
+                 faidx => {},  # acc => [length, offset, line_bases, line_width]
+    };
+
+    bless ($self, $packagename);
+
+    my $fai_file = "$fastaFile.fai";
+    unless (-s $fai_file) {
+        &write_faidx_file($fastaFile, $fai_file);
+    }
+    $self->_parse_faidx_file($fai_file);
+
+    $self->_open();
+
+    return ($self);
+}
+
+
+####
+sub _open {
+    my ($self) = @_;
+
+    open (my $filehandle, $self->{fastaFile}) or confess "Error: Couldn't open $self->{fastaFile}";
+    $self->{fileHandle} = $filehandle;
+    $self->{_pid} = $$;
+
+    return;
+}
+
+
+####
+sub _parse_faidx_file {
+    my ($self, $fai_file) = @_;
+
+    open (my $fh, $fai_file) or confess "Error, cannot open file $fai_file";
+    while (<$fh>) {
+        chomp;
+        my ($acc, $length, $offset, $line_bases, $line_width) = split(/\t/);
+        $self->{faidx}->{$acc} = [$length, $offset, $line_bases, $line_width];
+    }
+    close $fh;
+
+    return;
+}
+
+
+####
+sub has_accession {
+    my ($self, $acc) = @_;
+
+    return(exists $self->{faidx}->{$acc});
+}
+
+
+####
+sub get_seq_length {
+    my ($self, $acc) = @_;
+
+    my $faidx_info = $self->{faidx}->{$acc} or confess "Error, no sequence $acc in $self->{fastaFile}";
+
+    return($faidx_info->[0]);
+}
+
+
+#### get_subseq() returns the sequence for the 1-based inclusive range, truncated at the sequence end.
+sub get_subseq {
+    my ($self, $acc, $lend, $rend) = @_;
+
+    my $faidx_info = $self->{faidx}->{$acc} or confess "Error, no sequence $acc in $self->{fastaFile}";
+    my ($length, $offset, $line_bases, $line_width) = @$faidx_info;
+
+    if ($lend < 1) {
+        $lend = 1;
+    }
+    if ($rend > $length) {
+        $rend = $length;
+    }
+    if ($rend < $lend) {
+        return("");
+    }
+
+    my $start_byte = $self->_get_byte_offset($faidx_info, $lend - 1);
+    my $end_byte = $self->_get_byte_offset($faidx_info, $rend - 1) + 1;
+
+    if ($self->{_pid} != $$) {
+        # forked: the file position is shared with the parent, so seek on a handle of our own
+        $self->_open();
+    }
+
+    my $filehandle = $self->{fileHandle};
+    seek($filehandle, $start_byte, 0) or confess "Error, cannot seek to $start_byte in $self->{fastaFile}";
+
+    my $seq = "";
+    my $num_bytes = $end_byte - $start_byte;
+    while ($num_bytes > 0) {
+        my $num_read = read($filehandle, $seq, $num_bytes, length($seq));
+        unless ($num_read) {
+            confess "Error, truncated read of $acc:$lend-$rend from $self->{fastaFile}";
+        }
+        $num_bytes -= $num_read;
+    }
+    $seq =~ s/\s//g;
+
+    return($seq);
+}
+
+
+####
+sub _get_byte_offset {
+    my ($self, $faidx_info, $pos) = @_;
+
+    my ($length, $offset, $line_bases, $line_width) = @$faidx_info;
+
+    return($offset + int($pos / $line_bases) * $line_width + $pos % $line_bases);
+}
+
+
+#### finish() closes the open filehandle to the fasta file.
+sub finish {
+    my $self = shift;
+    my $filehandle = $self->{fileHandle};
+    close $filehandle;
+    $self->{fileHandle} = undef;
+}
+
+
+#### write_faidx_file() writes the samtools-compatible index, streaming through the fasta file once.
+sub write_faidx_file {
+    my ($fastaFile, $fai_file) = @_;
+
+    print STDERR "-indexing $fastaFile\n";
+
+    open (my $fh, $fastaFile) or confess "Error: Couldn't open $fastaFile";
+    open (my $ofh, ">$fai_file.tmp") or confess "Error, cannot write to $fai_file.tmp";
+
+    my ($acc, $length, $offset, $line_bases, $line_width);
+    my $short_line_seen = 0;
+
+    my $write_record = sub {
+        if (defined $acc) {
+            print $ofh join("\t", $acc, $length, $offset, $line_bases || 0, $line_width || 0) . "\n";
+        }
+    };
+
+    my $pos = 0;
+    while (my $line = <$fh>) {
+        my $line_len = length($line);
+        if ($line =~ /^>(\S+)/) {
+            &$write_record();
+            ($acc, $length, $offset, $line_bases, $line_width) = ($1, 0, $pos + $line_len, undef, undef);
+            $short_line_seen = 0;
+        }
+        else {
+            my $bases = $line;
+            $bases =~ s/\s+$//;
+            my $num_bases = length($bases);
+
+            unless (defined $line_bases) {
+                ($line_bases, $line_width) = ($num_bases, $line_len);
+            }
+            elsif ($num_bases > $line_bases || ($short_line_seen && $num_bases > 0)) {
+                # only the final line of a sequence may be shorter
+                confess "Error, $fastaFile has sequence lines of differing lengths in $acc, cannot index it for random access";
+            }
+            if ($num_bases < $line_bases) {
+                $short_line_seen = 1;
+            }
+            $length += $num_bases;
+        }
+        $pos += $line_len;
+    }
+    &$write_record();
+
+    close $ofh;
+    close $fh;
+
+    rename("$fai_file.tmp", $fai_file) or confess "Error, cannot rename $fai_file.tmp to $fai_file";
+
+    return;
+}
+
+
+1; #EOM
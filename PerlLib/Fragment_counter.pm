@@ -0,0 +1,237 @@
+package Fragment_counter;
+
+use strict;
+use warnings;
+use Carp;
+use File::Basename;
+
+## Counts the fragments (reads, or read pairs via the left fastq) in fastq files.
+##
+## Each count is cached in a <fastq>.fragcount sidecar (size <tab> mtime <tab> num_frags),
+## valid as long as the fastq size and mtime are unchanged, so it is counted just once
+## and reused by any later run.
+
+
+####
+sub get_num_total_frags {
+    my ($fq_file, $CPU) = @_;
+
+    $CPU ||= 1;
+
+    my $num_frags = 0;
+    foreach my $fq (split(/,/, $fq_file)) {
+        my $count = &get_cached_frag_count($fq);
+        unless (defined $count) {
+            $count = &count_fastq_records($fq, $CPU);
+            &write_frag_count_sidecar($fq, $count);
+        }
+        $num_frags += $count;
+    }
+
+    return($num_frags);
+}
+
+
+####
+sub get_num_frags_per_fastq {
+    my ($fq_files_aref, $CPU) = @_;
+
+    ## counts the fastqs in a single parallel scan, up to CPU at a time.
+    ## returns hash:  fq_file => num_frags
+
+    $CPU ||= 1;
+
+    my %fq_to_num_frags;
+    my @uncounted_fq_files;
+    foreach my $fq_file (@$fq_files_aref) {
+        if (exists $fq_to_num_frags{$fq_file}) { next; }
+        my $count = &get_cached_frag_count($fq_file);
+        if (defined $count) {
+            $fq_to_num_frags{$fq_file} = $count;
+        }
+        else {
+            $fq_to_num_frags{$fq_file} = undef;
+            push (@uncounted_fq_files, $fq_file);
+        }
+    }
+
+    while (@uncounted_fq_files) {
+        my @batch_fq_files = splice(@uncounted_fq_files, 0, $CPU);
+
+        my %fq_to_fh;
+        foreach my $fq_file (@batch_fq_files) {
+            my $pid = open(my $fh, "-|");
+            unless (defined $pid) {
+                confess "Error, cannot fork";
+            }
+            if ($pid == 0) {
+                print &count_fastq_records($fq_file, 1) . "\n";
+                exit(0);
+            }
+            $fq_to_fh{$fq_file} = $fh;
+        }
+
+        foreach my $fq_file (@batch_fq_files) {
+            my $fh = $fq_to_fh{$fq_file};
+            my $count = <$fh>;
+            close $fh;
+            if ($? || ! defined($count)) {
+                confess "Error, counting frags in $fq_file failed";
+            }
+            chomp $count;
+            $fq_to_num_frags{$fq_file} = $count;
+            &write_frag_count_sidecar($fq_file, $count);
+        }
+    }
+
+    return(%fq_to_num_frags);
+}
+
+
+####
+sub get_sidecar_filename {
+    my ($fq_file) = @_;
+
+    return("$fq_file.fragcount");
+}
+
+
+####
+sub get_cached_frag_count {
+    my ($fq_file) = @_;
+
+    my $sidecar_file = &get_sidecar_filename($fq_file);
+    unless (-s $sidecar_file) {
+        return(undef);
+    }
+
+    open(my $fh, $sidecar_file) or confess "Error, cannot open file: $sidecar_file";
+    my $line = <$fh>;
+    close $fh;
+
+    chomp $line;
+    my ($size, $mtime, $num_frags) = split(/\t/, $line);
+    my @stat = stat($fq_file) or confess "Error, cannot stat $fq_file";
+
+    if (defined($num_frags) && $size == $stat[7] && $mtime == $stat[9]) {
+        return($num_frags);
+    }
+    else {
+        # fastq was replaced since counted
+        return(undef);
+    }
+}
+
+
+####
+sub write_frag_count_sidecar {
+    my ($fq_file, $num_frags) = @_;
+
+    my $sidecar_file = &get_sidecar_filename($fq_file);
+    unless (-w dirname($sidecar_file)) {
+        print STDERR "-warning, cannot write $sidecar_file, frag count not cached\n";
+        return;
+    }
+
+    my @stat = stat($fq_file) or confess "Error, cannot stat $fq_file";
+
+    open(my $ofh, ">$sidecar_file.tmp.$$") or confess "Error, cannot write to $sidecar_file.tmp.$$";
+    print $ofh join("\t", $stat[7], $stat[9], $num_frags) . "\n";
+    close $ofh;
+    rename("$sidecar_file.tmp.$$", $sidecar_file) or confess "Error, cannot rename $sidecar_file.tmp.$$ to $sidecar_file";
+
+    return;
+}
+
+
+####
+sub get_num_input_reads_from_STAR_log {
+    my ($star_log_final_out) = @_;
+
+    open(my $fh, $star_log_final_out) or confess "Error, cannot open file: $star_log_final_out";
+    while (<$fh>) {
+        if (/Number of input reads\s*\|\s*(\d+)/) {
+            close $fh;
+            return($1);
+        }
+    }
+    close $fh;
+
+    confess "Error, cannot find the number of input reads in $star_log_final_out";
+}
+
+
+####
+sub count_fastq_records {
+    my ($fq_file, $CPU) = @_;
+
+    print STDERR "-counting frags in $fq_file\n";
+
+    my $cmd;
+    if ($fq_file =~ /\.gz$/) {
+        # pipefail, so a truncated or corrupt gzip fails the count rather than being cached short
+        $cmd = "bash -c 'set -o pipefail; " . &get_decompress_cmd($fq_file, $CPU) . " | wc -l'";
+    }
+    else {
+        $cmd = "wc -l < $fq_file";
+    }
+
+    my $num_lines = `$cmd`;
+    if ($?) {
+        confess "Error, cmd: $cmd died with ret $?";
+    }
+
+    chomp $num_lines;
+    $num_lines =~ /^\s*(\d+)/ or confess "Error, cannot extract line count from [$num_lines]";
+    $num_lines = $1;
+
+    return($num_lines / 4);
+}
+
+
+####
+sub get_decompress_cmd {
+    my ($gz_file, $CPU) = @_;
+
+    if ($CPU > 1) {
+        if (&is_bgzf($gz_file) && &have_program("bgzip")) {
+            # independent blocks, decompressed in parallel
+            return("bgzip -dc -@ $CPU $gz_file");
+        }
+        elsif (&have_program("pigz")) {
+            # a plain gzip stream can't be split, but pigz offloads reading, writing and checksums to other threads
+            return("pigz -dc -p $CPU $gz_file");
+        }
+    }
+
+    return("gzip -dc $gz_file");
+}
+
+
+####
+sub is_bgzf {
+    my ($gz_file) = @_;
+
+    open(my $fh, "<:raw", $gz_file) or confess "Error, cannot open file: $gz_file";
+    my $num_read = read($fh, my $header, 16);
+    close $fh;
+
+    # gzip magic, FEXTRA flag, and the 'BC' extra subfield
+    return( ($num_read == 16
+             && substr($header, 0, 2) eq "\x1f\x8b"
+             && (ord(substr($header, 3, 1)) & 4)
+             && substr($header, 12, 2) eq "BC") ? 1 : 0);
+}
+
+
+####
+sub have_program {
+    my ($prog) = @_;
+
+    my $path = `which $prog 2>/dev/null`;
+
+    return( ($path =~ /\w/) ? 1 : 0);
+}
+
+
+1; #EOM
@@ -0,0 +1,127 @@
+package Read_name_dict;
+
+use strict;
+use warnings;
+use Carp;
+
+## Interns read names as integer ids, so the fusion tables between coalescing the evidence and
+## writing the final report carry short id lists instead of the full read names.
+##
+## A read list entry keeps its sample prefix and mate suffix as text around the id:
+##
+##      &sample@read_name/1   <=>   &sample@17/1
+##
+## so the stages that strip the mate suffix, or count reads per sample, work the same on either form.
+##
+## The dictionary file lists the read names one per line, with the line number (from 0) as the id.
+
+
+####
+sub new {
+    my ($packagename, $dict_file) = @_;
+
+    my $self = { read_names => [],
+                 read_name_to_id => {},
+    };
+
+    bless ($self, $packagename);
+
+    if ($dict_file) {
+        $self->_load_dict_file($dict_file);
+    }
+
+    return($self);
+}
+
+
+####
+sub _load_dict_file {
+    my ($self, $dict_file) = @_;
+
+    my $read_names_aref = $self->{read_names};
+
+    open (my $fh, $dict_file) or confess "Error, cannot open file $dict_file";
+    while (my $read_name = <$fh>) {
+        chomp $read_name;
+        push (@$read_names_aref, $read_name);
+    }
+    close $fh;
+
+    return;
+}
+
+
+####
+sub encode_read_list {
+    my ($self, $read_list) = @_;
+
+    if ($read_list eq "." || $read_list eq "") {
+        return($read_list);
+    }
+
+    my $read_name_to_id_href = $self->{read_name_to_id};
+    my $read_names_aref = $self->{read_names};
+
+    my @encoded_reads;
+    foreach my $read (split(/,/, $read_list)) {
+        $read =~ /^(\&[^\@]+\@)?(.+?)(\/[12])?$/ or confess "Error, cannot parse read name [$read]";
+        my ($sample_prefix, $read_name, $mate_suffix) = ($1 || "", $2, $3 || "");
+
+        my $read_id = $read_name_to_id_href->{$read_name};
+        unless (defined $read_id) {
+            $read_id = scalar(@$read_names_aref);
+            push (@$read_names_aref, $read_name);
+            $read_name_to_id_href->{$read_name} = $read_id;
+        }
+
+        push (@encoded_reads, "${sample_prefix}${read_id}${mate_suffix}");
+    }
+
+    return(join(",", @encoded_reads));
+}
+
+
+####
+sub decode_read_list {
+    my ($self, $read_list) = @_;
+
+    if ($read_list eq "." || $read_list eq "") {
+        return($read_list);
+    }
+
+    my $read_names_aref = $self->{read_names};
+
+    my @decoded_reads;
+    foreach my $read (split(/,/, $read_list)) {
+        $read =~ /^(\&[^\@]+\@)?(\d+)(\/[12])?$/ or confess "Error, cannot parse read id [$read]";
+        my ($sample_prefix, $read_id, $mate_suffix) = ($1 || "", $2, $3 || "");
+
+        my $read_name = $read_names_aref->[$read_id];
+        unless (defined $read_name) {
+            confess "Error, no read name for id $read_id";
+        }
+
+        push (@decoded_reads, "${sample_prefix}${read_name}${mate_suffix}");
+    }
+
+    return(join(",", @decoded_reads));
+}
+
+
+####
+sub write_dict_file {
+    my ($self, $dict_file) = @_;
+
+    open (my $ofh, ">$dict_file.tmp") or confess "Error, cannot write to $dict_file.tmp";
+    foreach my $read_name (@{$self->{read_names}}) {
+        print $ofh "$read_name\n";
+    }
+    close $ofh;
+
+    rename("$dict_file.tmp", $dict_file) or confess "Error, cannot rename $dict_file.tmp to $dict_file";
+
+    return;
+}
+
+
+1; #EOM
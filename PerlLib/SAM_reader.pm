@@ -5,18 +5,42 @@ use warnings;
 use Carp;
 
 use SAM_entry;
+use File::Temp qw(tempfile);
+use File::Basename;
+use Cwd;
+
+my $UTILDIR = Cwd::abs_path(dirname(__FILE__) . "/../util");
+
+## optional filters.  For bam input they're pushed down to samtools so that discarded records never reach perl.
+## SAM text may lack the header samtools needs to resolve the regions, so it's filtered here instead:
+##
+##   new SAM_reader($filename, { regions => [ 'contig', 'contig:start-end', ... ],
+##                               require_flags => int,  # samtools view -f
+##                               exclude_flags => int,  # samtools view -F
+##                               min_mapq => int,       # samtools view -q
+##                               threads => int,        # samtools view -@
+##                             } );
 
 sub new {
 	my $packagename = shift;
 	my $filename = shift; 
+	my $opts_href = shift || {};
 
 	unless ($filename) {
 		confess "Error, need SAM filename as parameter";
 	}
 	
 	my $self = { filename => $filename,
+				 regions => $opts_href->{regions},
+				 require_flags => $opts_href->{require_flags} || 0,
+				 exclude_flags => $opts_href->{exclude_flags} || 0,
+				 min_mapq => $opts_href->{min_mapq} || 0,
+				 threads => $opts_href->{threads} || 1,
 				 _next => undef,
 				 _fh =>  undef,
+				 _regions_bed => undef,
+				 _perl_filters => 0,
+				 _contig_to_ranges => undef,
 	};
 
 	bless ($self, $packagename);
@@ -27,15 +51,59 @@ sub new {
 }
 
 
+####
+sub new_for_read_names {
+	my ($packagename, $bam_file, $read_names_aref) = @_;
+
+    ## reads just the alignments of the given reads, seeking to them via the bam's read-name index
+    ## (see index_bam_read_names.py) if it has one, otherwise the whole file.
+
+    unless ($bam_file =~ /\.bam$/ && -s "$bam_file.rni") {
+        return($packagename->new($bam_file));
+    }
+
+    my %read_names;
+    foreach my $read_name (@$read_names_aref) {
+        my $bam_read_name = $read_name;
+        $bam_read_name =~ s/^\&[^\@]+\@//; # read group encoding isn't part of the bam read name
+        $read_names{$bam_read_name} = 1;
+    }
+
+    my $read_names_file = "$bam_file.rni.query." . $$;
+    open(my $ofh, ">$read_names_file") or confess "Error, cannot write to $read_names_file";
+    foreach my $read_name (sort keys %read_names) {
+        print $ofh "$read_name\n";
+    }
+    close $ofh;
+
+    my $retrieved_sam_file = "$read_names_file.sam";
+    my $cmd = "$UTILDIR/retrieve_reads_by_name.py --bam $bam_file --read_names $read_names_file > $retrieved_sam_file";
+    my $ret = system($cmd);
+    if ($ret) {
+        confess "Error, cmd: $cmd died with ret $ret";
+    }
+    unlink($read_names_file);
+
+    my $self = $packagename->new($retrieved_sam_file);
+    unlink($retrieved_sam_file); # already opened
+
+    return($self);
+}
+
+
 ####
 sub _init {
 	my ($self) = @_;
     
     if ($self->{filename} =~ /\.bam$/) {
-        open ($self->{_fh}, "samtools view $self->{filename} |") or confess "Error, cannot open file " . $self->{filename};
+        my $cmd = $self->_get_samtools_view_cmd();
+        open ($self->{_fh}, "$cmd |") or confess "Error, cannot open file " . $self->{filename};
     }
     else {
         open ($self->{_fh}, $self->{filename}) or confess "Error, cannot open file " . $self->{filename};
+        if ($self->_has_filters()) {
+            $self->_init_perl_filters();
+        }
     }
     
 	$self->_advance();
@@ -44,21 +112,146 @@ sub _init {
 }
 
 ####
-sub _advance {
+sub _has_filters {
 	my ($self) = @_;
 
-	my $fh = $self->{_fh};
+	return( (defined $self->{regions} || $self->{require_flags} || $self->{exclude_flags} || $self->{min_mapq}) ? 1 : 0);
+}
+
+####
+sub _init_perl_filters {
+	my ($self) = @_;
+
+	$self->{_perl_filters} = 1;
+
+	if (defined $self->{regions}) {
+		my %contig_to_ranges;
+		foreach my $region (@{$self->{regions}}) {
+			if ($region =~ /^(.+):(\d+)-(\d+)$/) {
+				push (@{$contig_to_ranges{$1}}, [$2, $3]);
+			}
+			else {
+				# whole contig
+				$contig_to_ranges{$region} = [];
+			}
+		}
+		$self->{_contig_to_ranges} = \%contig_to_ranges;
+	}
+
+	return;
+}
+
+####
+sub _passes_perl_filters {
+	my ($self, $sam_entry) = @_;
+
+	my $flag = $sam_entry->get_flag();
+	if ( ($flag & $self->{require_flags}) != $self->{require_flags}) {
+		return(0);
+	}
+	if ($flag & $self->{exclude_flags}) {
+		return(0);
+	}
+	if ($self->{min_mapq} && $sam_entry->get_mapping_quality() < $self->{min_mapq}) {
+		return(0);
+	}
+
+	if (my $contig_to_ranges_href = $self->{_contig_to_ranges}) {
+		my $ranges_aref = $contig_to_ranges_href->{$sam_entry->get_scaffold_name()};
+		unless ($ranges_aref) {
+			return(0);
+		}
+		if (@$ranges_aref) {
+			my ($lend, $rend) = $sam_entry->get_genome_span();
+			unless (grep { $lend <= $_->[1] && $rend >= $_->[0] } @$ranges_aref) {
+				return(0);
+			}
+		}
+	}
+
+	return(1);
+}
+
+####
+sub _get_samtools_view_cmd {
+	my ($self) = @_;
+
+	my $filename = $self->{filename};
 
-	my $next_line = <$fh>;
-	while (defined ($next_line) && ($next_line =~ /^\@/ || $next_line !~ /\w/)) {  ## skip over sam headers
-		$next_line = <$fh>;
+	my $cmd = "samtools view";
+	if ($self->{threads} > 1) {
+		$cmd .= " -@ $self->{threads}";
+	}
+	if ($self->{require_flags}) {
+		$cmd .= " -f $self->{require_flags}";
+	}
+	if ($self->{exclude_flags}) {
+		$cmd .= " -F $self->{exclude_flags}";
+	}
+	if ($self->{min_mapq}) {
+		$cmd .= " -q $self->{min_mapq}";
 	}
 	
-	if ($next_line) {
-		$self->{_next} = new SAM_entry($next_line);
+	if (defined $self->{regions}) {
+		my @regions = @{$self->{regions}};
+		
+		if ($filename =~ /\.bam$/ && (-s "$filename.bai" || -s "$filename.csi")) {
+			# random access to just the regions
+			unless (@regions) {
+				# nothing to fetch
+				return("true");
+			}
+			$cmd .= " $filename " . join(" ", map { "'$_'" } @regions);
+			return($cmd);
+		}
+		else {
+			# no index, so the regions are filtered while streaming through.
+			$cmd .= " -L " . $self->_write_regions_bed(@regions);
+		}
 	}
-	else {
-		$self->{_next} = undef;
+	
+	$cmd .= " $filename";
+	
+	return($cmd);
+}
+
+####
+sub _write_regions_bed {
+	my ($self, @regions) = @_;
+
+	my ($ofh, $bed_file) = tempfile("SAM_reader.XXXXXX", SUFFIX => ".bed", TMPDIR => 1, UNLINK => 1);
+	foreach my $region (@regions) {
+		if ($region =~ /^(.+):(\d+)-(\d+)$/) {
+			print $ofh join("\t", $1, $2 - 1, $3) . "\n";
+		}
+		else {
+			# whole contig, htslib's max coordinate
+			print $ofh join("\t", $region, 0, 2**31 - 1) . "\n";
+		}
+	}
+	close $ofh;
+
+	$self->{_regions_bed} = $bed_file;
+
+	return($bed_file);
+}
+
+####
+sub _advance {
+	my ($self) = @_;
+
+	my $fh = $self->{_fh};
+
+	$self->{_next} = undef;
+
+	while (my $next_line = <$fh>) {
+		if ($next_line =~ /^\@/ || $next_line !~ /\w/) { next; } ## skip over sam headers
+
+		my $sam_entry = new SAM_entry($next_line);
+		if ($self->{_perl_filters} && ! $self->_passes_perl_filters($sam_entry)) { next; }
+
+		$self->{_next} = $sam_entry;
+		last;
 	}
 	
 	return;
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Read-name index for a bam file:  sorted 64-bit read name hashes mapped to the BGZF virtual
+offsets of their alignment records, so that a few named reads can be retrieved by seeking
+instead of streaming the whole bam.
+
+The index file (bam.rni) is a fixed-width binary table that is memory-mapped for lookups.
+"""
+
+import os, sys, re
+import logging
+import hashlib
+import mmap
+import struct
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"FIRNI\x01\x00\x00"
+RECORD = struct.Struct("<QQ")  # read name hash, bgzf virtual offset
+
+
+def get_index_filename(bam_file):
+    return bam_file + ".rni"
+
+
+def get_core_read_name(read_name):
+    # as SAM_entry::get_core_read_name()
+    return re.sub("/\\d$", "", read_name)
+
+
+def get_read_name_hash(read_name):
+    core_read_name = get_core_read_name(read_name)
+    return int.from_bytes(
+        hashlib.blake2b(core_read_name.encode(), digest_size=8).digest(), "little"
+    )
+
+
+def write_index(index_filename, read_name_offset_pairs, sort_buffer_size="2G"):
+    """
+    Writes the index from (read_name, virtual_offset) pairs, sorting externally so
+    memory stays bounded for deep libraries.
+    """
+
+    tmp_sorted_filename = index_filename + ".sorted.tmp"
+    tmpdir = os.path.dirname(os.path.abspath(index_filename))
+
+    with open(tmp_sorted_filename, "wt") as ofh:
+        sort_proc = subprocess.Popen(
+            ["sort", "-T", tmpdir, "-S", sort_buffer_size],
+            stdin=subprocess.PIPE,
+            stdout=ofh,
+            universal_newlines=True,
+            env=dict(os.environ, LC_ALL="C"),
+        )
+        for read_name, virtual_offset in read_name_offset_pairs:
+            # fixed-width hex, so the lexical sort is also the numeric sort
+            sort_proc.stdin.write(
+                "{:016x}\t{:016x}\n".format(get_read_name_hash(read_name), virtual_offset)
+            )
+        sort_proc.stdin.close()
+        if sort_proc.wait():
+            raise RuntimeError("Error, sorting read name hashes for {} failed".format(index_filename))
+
+    num_records = 0
+    with open(tmp_sorted_filename, "rt") as fh, open(index_filename + ".tmp", "wb") as ofh:
+        ofh.write(MAGIC)
+        ofh.write(struct.pack("<Q", 0))  # num_records, set below
+        for line in fh:
+            name_hash, virtual_offset = line.split("\t")
+            ofh.write(RECORD.pack(int(name_hash, 16), int(virtual_offset, 16)))
+            num_records += 1
+        ofh.seek(len(MAGIC))
+        ofh.write(struct.pack("<Q", num_records))
+
+    os.remove(tmp_sorted_filename)
+    os.rename(index_filename + ".tmp", index_filename)
+
+    return num_records
+
+
+class BamReadNameIndex:
+    def __init__(self, index_filename):
+
+        self._fh = open(index_filename, "rb")
+        if os.path.getsize(index_filename) == len(MAGIC) + 8:
+            # no records, and an empty file cannot be mapped
+            self._mmap = self._fh.read()
+        else:
+            self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[0 : len(MAGIC)] != MAGIC:
+            raise RuntimeError("Error, {} is not a bam read name index".format(index_filename))
+
+        self._num_records = struct.unpack_from("<Q", self._mmap, len(MAGIC))[0]
+        self._records_start = len(MAGIC) + 8
+
+    def __len__(self):
+        return self._num_records
+
+    def _get_hash(self, i):
+        return struct.unpack_from("<Q", self._mmap, self._records_start + i * RECORD.size)[0]
+
+    def get_virtual_offsets(self, read_name):
+        """
+        virtual offsets of all alignment records for the read (either mate).
+        Hash collisions are possible, so callers confirm the read name of each record.
+        """
+
+        name_hash = get_read_name_hash(read_name)
+
+        # lower bound
+        lo, hi = 0, self._num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get_hash(mid) < name_hash:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        virtual_offsets = list()
+        i = lo
+        while i < self._num_records:
+            record_hash, virtual_offset = RECORD.unpack_from(
+                self._mmap, self._records_start + i * RECORD.size
+            )
+            if record_hash != name_hash:
+                break
+            virtual_offsets.append(virtual_offset)
+            i += 1
+
+        return virtual_offsets
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._fh.close()
+
+
+def build_bam_read_name_index(bam_file, index_filename=None):
+
+    import pysam
+
+    if index_filename is None:
+        index_filename = get_index_filename(bam_file)
+
+    def get_read_name_offset_pairs():
+        with pysam.AlignmentFile(bam_file, "rb") as bamreader:
+            while True:
+                virtual_offset = bamreader.tell()
+                try:
+                    read = next(bamreader)
+                except StopIteration:
+                    break
+                yield (read.query_name, virtual_offset)
+
+    num_records = write_index(index_filename, get_read_name_offset_pairs())
+
+    logger.info("-indexed {} alignment records by read name in {}".format(num_records, index_filename))
+
+    return index_filename
+
+
+def fetch_reads_by_name(bam_file, read_names, index_filename=None):
+    """
+    yields the pysam alignment records for the named reads (both mates), in bam order
+    """
+
+    import pysam
+
+    if index_filename is None:
+        index_filename = get_index_filename(bam_file)
+
+    core_read_names = set([get_core_read_name(read_name) for read_name in read_names])
+
+    read_name_index = BamReadNameIndex(index_filename)
+    virtual_offsets = set()
+    for core_read_name in core_read_names:
+        virtual_offsets.update(read_name_index.get_virtual_offsets(core_read_name))
+    read_name_index.close()
+
+    with pysam.AlignmentFile(bam_file, "rb") as bamreader:
+        for virtual_offset in sorted(virtual_offsets):
+            bamreader.seek(virtual_offset)
+            read = next(bamreader)
+            if get_core_read_name(read.query_name) in core_read_names:
+                yield read
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import os, sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_batch_manifest(batch_manifest, check_files=True):
+    """
+    Parses a FusionInspector --batch_manifest (format: sample(tab)/path/left.fq(tab)/path/right.fq)
+
+    Returns list of (sample_name, left_fq, right_fq) tuples, right_fq being "" for single-end reads.
+    """
+
+    batch_samples = []
+    sample_names = set()
+
+    with open(batch_manifest, "rt") as fh:
+        for line in fh:
+            line = line.rstrip()
+            if not line or line[0] == "#":
+                continue
+            vals = line.split("\t")
+            if len(vals) < 2:
+                raise RuntimeError(
+                    "Error, batch manifest line lacks sample(tab)left.fq: {}".format(line)
+                )
+            sample_name = vals[0]
+            if sample_name in sample_names:
+                raise RuntimeError(
+                    "Error, sample {} listed more than once in {}".format(
+                        sample_name, batch_manifest
+                    )
+                )
+            sample_names.add(sample_name)
+
+            left_fq = os.path.abspath(vals[1])
+            right_fq = os.path.abspath(vals[2]) if len(vals) > 2 and vals[2] else ""
+
+            if check_files:
+                for fq_filename in [left_fq] + ([right_fq] if right_fq else []):
+                    if not os.path.exists(fq_filename):
+                        raise RuntimeError("Error, cannot locate file: {}".format(fq_filename))
+
+            batch_samples.append((sample_name, left_fq, right_fq))
+
+    if not batch_samples:
+        raise RuntimeError("Error, no samples listed in {}".format(batch_manifest))
+
+    return batch_samples
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import os, sys
+import logging
+import hashlib
+import json
+import fcntl
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ContigCache(object):
+    """
+    Persistent cache of fusion contigs and the aligner indexes built from them, shared across runs.
+
+    Each entry lives in cache_dir/<key>/ where the key is a digest of everything the contigs depend on.
+    Concurrent runs coordinate through lockf()s on cache_dir/<key>.lock: an entry is built under an exclusive
+    lock, and held under a shared lock while in use so that eviction (least recently used first, by total size)
+    never removes an entry out from under a running job.  These are POSIX record locks rather than flock()s, as
+    only they convert between exclusive and shared atomically, leaving no window for an eviction in between.
+    """
+
+    METADATA_FILE = "entry.json"
+    LAST_USED_FILE = "last_used"
+
+
+    def __init__(self, cache_dir):
+
+        cache_dir = os.path.abspath(cache_dir)
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._cache_dir = cache_dir
+        self._lock_fhs = dict()
+
+
+    @staticmethod
+    def make_key(key_info):
+        """
+        key_info: json-serializable dict of everything the cached contents depend on.
+        """
+        return hashlib.sha256(json.dumps(key_info, sort_keys=True).encode("utf-8")).hexdigest()[0:24]
+
+
+    def get_entry_dir(self, key):
+        return os.path.join(self._cache_dir, key)
+
+
+    def _get_lock_file(self, key):
+        return os.path.join(self._cache_dir, key + ".lock")
+
+
+    def lock(self, key, exclusive=False):
+        """
+        Blocks until the lock is obtained.  Relocking a key held by this object converts the lock type atomically.
+        """
+
+        if key not in self._lock_fhs:
+            # readable too, as a shared record lock requires
+            self._lock_fhs[key] = open(self._get_lock_file(key), "a+")
+
+        logger.info("Obtaining {} lock on contig cache entry: {}".format("exclusive" if exclusive else "shared", key))
+        fcntl.lockf(self._lock_fhs[key], fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        return
+
+
+    def unlock(self, key):
+
+        if key in self._lock_fhs:
+            fcntl.lockf(self._lock_fhs[key], fcntl.LOCK_UN)
+            self._lock_fhs[key].close()
+            del self._lock_fhs[key]
+
+        return
+
+
+    def open_entry(self, key, key_info):
+        """
+        Creates the entry dir (if needed), records its metadata and marks it as just used.  Call while holding the lock.
+        """
+
+        entry_dir = self.get_entry_dir(key)
+        if not os.path.exists(entry_dir):
+            os.makedirs(entry_dir)
+
+        metadata_file = os.path.join(entry_dir, ContigCache.METADATA_FILE)
+        if not os.path.exists(metadata_file):
+            with open(metadata_file, "wt") as ofh:
+                json.dump(key_info, ofh, indent=2, sort_keys=True)
+
+        self.touch(key)
+
+        return entry_dir
+
+
+    def touch(self, key):
+
+        with open(os.path.join(self.get_entry_dir(key), ContigCache.LAST_USED_FILE), "wt") as ofh:
+            ofh.write("{}\n".format(time.time()))
+
+        return
+
+
+    def _get_entries(self):
+
+        entries = list()
+        for key in os.listdir(self._cache_dir):
+            entry_dir = os.path.join(self._cache_dir, key)
+            last_used_file = os.path.join(entry_dir, ContigCache.LAST_USED_FILE)
+            if os.path.isdir(entry_dir) and os.path.exists(last_used_file):
+                entries.append( (os.path.getmtime(last_used_file), key, _get_dir_size(entry_dir)) )
+
+        return entries
+
+
+    def evict(self, max_size):
+        """
+        Removes the least recently used entries until the cache fits within max_size bytes.
+        Entries locked by any run (including this one) are left alone.
+        """
+
+        entries = self._get_entries()
+        total_size = sum([ entry_size for (last_used, key, entry_size) in entries ])
+
+        for last_used, key, entry_size in sorted(entries):
+
+            if total_size <= max_size:
+                break
+
+            # record locks are per process, so this run's own entries must be skipped explicitly
+            # (and their lock files never opened and closed here, which would release the locks)
+            if key in self._lock_fhs:
+                continue
+
+            with open(self._get_lock_file(key), "a+") as lock_fh:
+                try:
+                    fcntl.lockf(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    logger.info("Contig cache entry {} is in use, not evicting it.".format(key))
+                    continue
+
+                # move it aside first so a partially deleted entry is never visible under its key
+                evicting_dir = os.path.join(self._cache_dir, ".evicting.{}.{}".format(key, os.getpid()))
+                os.rename(self.get_entry_dir(key), evicting_dir)
+                fcntl.lockf(lock_fh, fcntl.LOCK_UN)
+
+            shutil.rmtree(evicting_dir, ignore_errors=True)
+            total_size -= entry_size
+            logger.info("Evicted contig cache entry {} ({:.1f} MB)".format(key, entry_size / 1024**2))
+
+        return
+
+
+def _get_dir_size(dirname):
+
+    total_size = 0
+    for root, dirs, files in os.walk(dirname):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            if not os.path.islink(filepath):
+                total_size += os.path.getsize(filepath)
+
+    return total_size
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+EM estimates of each fusion isoform's share of the junction reads and spanning frags it
+shares with other isoforms, as in PerlLib/FusionEM.pm.
+
+Reads are grouped into compatibility classes (the set of isoforms a read supports), held as a
+sparse class-by-isoform incidence matrix of integer indices, so each EM round is a few NumPy
+gathers and bincounts.  Rounds are accelerated with SQUAREM (Varadhan and Roland, 2008), with
+a fall back to the plain EM step whenever the extrapolation leaves the simplex or lowers the
+likelihood.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FusionEM(object):
+
+    MAX_ROUNDS = 1000
+    TOLERANCE = 1e-10  # max change in any isoform's expression fraction
+
+    def __init__(self):
+
+        self._fusion_names = list()
+        self._fusion_name_to_idx = dict()
+        self._junction_reads = list()  # per isoform, set of read names
+        self._spanning_frags = list()
+
+        self._est_J = None
+        self._est_S = None
+
+    def add_fusion_transcript(self, fusion_name, junction_reads, spanning_frags):
+
+        if fusion_name in self._fusion_name_to_idx:
+            idx = self._fusion_name_to_idx[fusion_name]
+        else:
+            idx = len(self._fusion_names)
+            self._fusion_name_to_idx[fusion_name] = idx
+            self._fusion_names.append(fusion_name)
+            self._junction_reads.append(set())
+            self._spanning_frags.append(set())
+
+        self._junction_reads[idx].update(junction_reads)
+        self._spanning_frags[idx].update(spanning_frags)
+
+    def get_fusion_estimated_J_S(self, fusion_name):
+
+        if fusion_name not in self._fusion_name_to_idx:
+            raise KeyError("Error, no fusion found for {}".format(fusion_name))
+
+        idx = self._fusion_name_to_idx[fusion_name]
+
+        return (self._est_J[idx], self._est_S[idx])
+
+    def run(self):
+
+        num_isoforms = len(self._fusion_names)
+
+        (class_counts, member_class, member_isoform, member_J_counts) = self._build_compatibility_classes()
+
+        if len(class_counts) == 0:
+            self._est_J = np.zeros(num_isoforms)
+            self._est_S = np.zeros(num_isoforms)
+            return
+
+        total_counts = class_counts.sum()
+        member_class_counts = class_counts[member_class]
+
+        def class_expr_sums(expr):
+            return np.bincount(member_class, weights=expr[member_isoform], minlength=len(class_counts))
+
+        def em_step(expr):
+            # assign each class's reads in proportion to its isoforms' expression, then renormalize
+            rel_expr = expr[member_isoform] / class_expr_sums(expr)[member_class]
+            isoform_counts = np.bincount(member_isoform, weights=member_class_counts * rel_expr, minlength=num_isoforms)
+            return isoform_counts / total_counts
+
+        def log_likelihood(expr):
+            # log(L) ~ sum_e ( c_e * log(sum_t_e) ), as in the kallisto paper
+            return float(np.sum(class_counts * np.log(class_expr_sums(expr))))
+
+        ## initialize with each class's reads split evenly among its isoforms
+        class_sizes = np.bincount(member_class, minlength=len(class_counts))
+        expr = np.bincount(member_isoform, weights=member_class_counts / class_sizes[member_class], minlength=num_isoforms) / total_counts
+
+        loglikelihood = log_likelihood(expr)
+        logger.info("EM: Starting log likelihood: %f", loglikelihood)
+
+        num_em_steps = 0
+        for round_num in range(1, self.MAX_ROUNDS + 1):
+
+            expr_1 = em_step(expr)
+            expr_2 = em_step(expr_1)
+            num_em_steps += 2
+
+            r = expr_1 - expr
+            v = expr_2 - expr_1 - r
+
+            r_norm = np.linalg.norm(r)
+            v_norm = np.linalg.norm(v)
+
+            next_expr = expr_2
+            next_loglikelihood = log_likelihood(expr_2)
+
+            if v_norm > 0:
+                alpha = min(-r_norm / v_norm, -1.0)
+                if alpha < -1.0:
+                    extrapolated_expr = expr - 2 * alpha * r + alpha * alpha * v
+                    if np.all(extrapolated_expr > 0):
+                        # an em step from the extrapolation keeps it stable
+                        extrapolated_expr = em_step(extrapolated_expr)
+                        num_em_steps += 1
+                        extrapolated_loglikelihood = log_likelihood(extrapolated_expr)
+                        if extrapolated_loglikelihood >= next_loglikelihood:
+                            next_expr = extrapolated_expr
+                            next_loglikelihood = extrapolated_loglikelihood
+
+            delta = np.max(np.abs(next_expr - expr))
+
+            expr = next_expr
+            loglikelihood = next_loglikelihood
+
+            logger.debug("EM: Round [%d] log likelihood: %f", round_num, loglikelihood)
+
+            if delta < self.TOLERANCE:
+                break
+
+        logger.info(
+            "EM: converged to log likelihood %f after %d rounds (%d em steps)", loglikelihood, round_num, num_em_steps
+        )
+
+        ## fractionally assign reads according to the fusion expression estimates
+        rel_expr = expr[member_isoform] / class_expr_sums(expr)[member_class]
+
+        self._est_J = np.bincount(member_isoform, weights=rel_expr * member_J_counts, minlength=num_isoforms)
+        self._est_S = np.bincount(
+            member_isoform, weights=rel_expr * (member_class_counts - member_J_counts), minlength=num_isoforms
+        )
+
+    def _build_compatibility_classes(self):
+        """
+        returns numpy arrays:
+             class_counts:  number of reads in each class
+          and per (class, isoform) member of the sparse incidence matrix:
+             member_class, member_isoform:  its indices
+             member_J_counts:  how many of the class's reads are junction reads of that isoform
+        """
+
+        read_to_isoforms = dict()
+        for idx in range(len(self._fusion_names)):
+            for read_name in self._junction_reads[idx] | self._spanning_frags[idx]:
+                read_to_isoforms.setdefault(read_name, list()).append(idx)
+
+        isoforms_to_class = dict()
+        class_counts = list()
+        member_J_counts = dict()  # (class, isoform) => num junction reads
+        for read_name, isoforms in read_to_isoforms.items():
+            isoforms = tuple(isoforms)  # ascending, as added
+            class_idx = isoforms_to_class.get(isoforms)
+            if class_idx is None:
+                class_idx = len(class_counts)
+                isoforms_to_class[isoforms] = class_idx
+                class_counts.append(0)
+            class_counts[class_idx] += 1
+
+            for idx in isoforms:
+                if read_name in self._junction_reads[idx]:
+                    member_J_counts[(class_idx, idx)] = member_J_counts.get((class_idx, idx), 0) + 1
+
+        member_class = list()
+        member_isoform = list()
+        for isoforms, class_idx in isoforms_to_class.items():
+            member_class.extend([class_idx] * len(isoforms))
+            member_isoform.extend(isoforms)
+
+        return (
+            np.array(class_counts, dtype=float),
+            np.array(member_class, dtype=np.int64),
+            np.array(member_isoform, dtype=np.int64),
+            np.array([member_J_counts.get(member, 0) for member in zip(member_class, member_isoform)], dtype=float),
+        )
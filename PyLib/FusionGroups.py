@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def split_fusion_pair(fusion_pair):
+    """
+    returns (geneA, geneB) of a geneA--geneB (or geneA::geneB) fusion pair
+    """
+
+    m = re.match("^(\\S+?)(--|::)(\\S+)$", fusion_pair)
+    if not m:
+        raise RuntimeError("Error, cannot parse {} as a fusion-gene candidate".format(fusion_pair))
+
+    return (m.group(1), m.group(3))
+
+
+def get_gene_connected_fusion_groups(fusion_pairs):
+    """
+    Groups fusion pairs sharing a gene (union-find), so that gene promiscuity and reads multimapping among
+    a gene's fusion contigs are all seen within a single shard.  Groups are ordered by first appearance.
+    """
+
+    parent = dict()
+
+    def find(gene):
+        while parent[gene] != gene:
+            parent[gene] = parent[parent[gene]]
+            gene = parent[gene]
+        return gene
+
+    for fusion_pair in fusion_pairs:
+        geneA, geneB = split_fusion_pair(fusion_pair)
+        parent.setdefault(geneA, geneA)
+        parent.setdefault(geneB, geneB)
+        rootA, rootB = find(geneA), find(geneB)
+        if rootA != rootB:
+            parent[rootB] = rootA
+
+    groups = dict()
+    group_order = list()
+    for fusion_pair in fusion_pairs:
+        root = find(split_fusion_pair(fusion_pair)[0])
+        if root not in groups:
+            groups[root] = list()
+            group_order.append(root)
+        groups[root].append(fusion_pair)
+
+    return [ groups[root] for root in group_order ]
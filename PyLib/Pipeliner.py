@@ -10,26 +10,386 @@ import subprocess
 import shlex
 import shutil
 import time
+import re
+import hashlib
+import json
 from inspect import getframeinfo, stack
 import threading
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 logger = logging.getLogger(__name__)
 
 
 def run_cmd(cmd, ignore_error=False):
 
+    ret, rusage = run_cmd_with_rusage(cmd, ignore_error)
+
+    return ret
+
+
+def run_cmd_with_rusage(cmd, ignore_error=False):
+    """
+    Runs the command, returning (exit value, resource usage) with the resource usage of the
+    child process and its descendants as reported by os.wait4()
+    """
+
     logger.info("Running: " + cmd)
-    try:
-        subprocess.check_call(cmd, shell=True)
-    except subprocess.CalledProcessError as e:
+
+    proc = subprocess.Popen(cmd, shell=True)
+    pid, status, rusage = os.wait4(proc.pid, 0)
+
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    proc.returncode = returncode # already reaped, so Popen must not wait on it.
+
+    if returncode != 0:
+        e = subprocess.CalledProcessError(returncode, cmd)
         logger.error("Error: {}, exit val: {}".format(str(e), e.returncode))
 
         if ignore_error:
-            return e.returncode  # caller decides how to handle the error.
+            return e.returncode, rusage  # caller decides how to handle the error.
         else:
             raise e
 
-    return 0 # all good.
+    return 0, rusage # all good.
+
+
+#####################
+## Resource profiling
+#####################
+
+PROFILE_FIELDS = ["stage", "exit_status", "wall_seconds", "user_cpu_seconds", "sys_cpu_seconds",
+                  "max_rss_kb", "block_input_ops", "block_output_ops", "cmd"]
+
+
+def _make_profile_record(stage, cmd, wall_seconds, exit_status, rusage):
+
+    return { "stage": stage,
+             "exit_status": exit_status,
+             "wall_seconds": round(wall_seconds, 3),
+             "user_cpu_seconds": round(rusage.ru_utime, 3),
+             "sys_cpu_seconds": round(rusage.ru_stime, 3),
+             "max_rss_kb": rusage.ru_maxrss,
+             "block_input_ops": rusage.ru_inblock,
+             "block_output_ops": rusage.ru_oublock,
+             "cmd": cmd }
+
+
+def write_profile(profile_dir, profile_records):
+    """
+    Merges the profile records into pipeline_profile.json and pipeline_profile.tsv in profile_dir,
+    replacing earlier records for the same stage (ie. from a previous, resumed run).
+
+    Returns the merged list of records.
+    """
+
+    json_filename = os.path.join(profile_dir, "pipeline_profile.json")
+
+    merged_records = list()
+    if os.path.exists(json_filename):
+        with open(json_filename, "rt") as fh:
+            merged_records = json.load(fh)
+
+    new_stages = set([ record["stage"] for record in profile_records ])
+    merged_records = [ record for record in merged_records if record["stage"] not in new_stages ] + list(profile_records)
+
+    with open(json_filename, "wt") as ofh:
+        json.dump(merged_records, ofh, indent=2)
+
+    with open(os.path.join(profile_dir, "pipeline_profile.tsv"), "wt") as ofh:
+        ofh.write("\t".join(PROFILE_FIELDS) + "\n")
+        for record in merged_records:
+            ofh.write("\t".join([ str(record[field]) for field in PROFILE_FIELDS ]) + "\n")
+
+    return merged_records
+
+
+def format_profile_report(profile_records):
+    """
+    Summary of the profiled stages ranked by wall-clock time.
+    """
+
+    total_wall = sum([ record["wall_seconds"] for record in profile_records ]) or 1
+
+    lines = [ "{:>5}  {:>10}  {:>6}  {:>10}  {:>10}  {:>12}  {}".format(
+        "rank", "wall(s)", "%wall", "cpu(s)", "maxRSS(MB)", "blk_in/out", "stage") ]
+
+    ranked_records = sorted(profile_records, key=lambda record: record["wall_seconds"], reverse=True)
+    for rank, record in enumerate(ranked_records, 1):
+        lines.append("{:>5}  {:>10.1f}  {:>6.1f}  {:>10.1f}  {:>10.1f}  {:>12}  {}".format(
+            rank,
+            record["wall_seconds"],
+            100 * record["wall_seconds"] / total_wall,
+            record["user_cpu_seconds"] + record["sys_cpu_seconds"],
+            record["max_rss_kb"] / 1024,
+            "{}/{}".format(record["block_input_ops"], record["block_output_ops"]),
+            record["stage"] + ("" if record["exit_status"] == 0 else " (exit {})".format(record["exit_status"]))))
+
+    return "\n".join(lines)
+
+
+def _normalize_file_list(filenames):
+    # None means 'not declared', as opposed to an empty list meaning 'no files'
+    if filenames is None:
+        return None
+
+    return set([ os.path.abspath(filename) for filename in filenames if filename ])
+
+
+## inputs smaller than this are fingerprinted by content, larger ones by size and modification time.
+MAX_DIGEST_FILE_SIZE = 10 * 1024**2
+
+
+def _file_signature(filename):
+
+    if not os.path.exists(filename):
+        return "missing"
+
+    if os.path.isdir(filename):
+        return "dir"
+
+    statinfo = os.stat(filename)
+    if statinfo.st_size <= MAX_DIGEST_FILE_SIZE:
+        md5 = hashlib.md5()
+        with open(filename, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024**2), b""):
+                md5.update(chunk)
+        return "md5:{}".format(md5.hexdigest())
+
+    return "size:{},mtime:{}".format(statinfo.st_size, int(statinfo.st_mtime))
+
+
+## words that start a shell command without being the program it runs
+SHELL_BUILTINS = { "cd", "set", "export", "echo", "true", "false", "exit", "test", "[", ":", "wait" }
+SHELL_PREFIXES = { "env", "time", "nice", "nohup", "exec" }
+SHELLS = { "bash", "sh" }
+
+
+def _get_cmd_programs(cmdstr):
+    """
+    Returns the programs a shell command string runs:  the first word of each command of its pipelines and lists
+    (one per line), including those within nested bash -c / sh -c command strings.
+    """
+
+    programs = list()
+
+    for cmd_line in cmdstr.split("\n"):
+
+        try:
+            lexer = shlex.shlex(cmd_line, posix=True, punctuation_chars=True)
+            lexer.whitespace_split = True
+            tokens = list(lexer)
+        except ValueError:
+            # unbalanced quoting, just the leading program
+            tokens = cmd_line.split()[0:1]
+
+        at_cmd_start = True
+        prev_token = None
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+
+            if re.match(r"^[|&;]+$", token):
+                at_cmd_start = True
+            elif re.match(r"^[<>]+$", token) or token in ("(", ")"):
+                pass
+            elif prev_token is not None and re.match(r"^[<>]+$", prev_token):
+                pass  # a redirection target
+            elif at_cmd_start:
+                if re.match(r"^\w+=", token) or token in SHELL_PREFIXES:
+                    pass  # env assignment or prefix, the program follows
+                elif token in SHELLS and i + 1 < len(tokens) and tokens[i] == "-c":
+                    programs.extend(_get_cmd_programs(tokens[i + 1]))
+                    i += 2
+                    at_cmd_start = False
+                else:
+                    if token not in SHELL_BUILTINS:
+                        programs.append(token)
+                    at_cmd_start = False
+
+            prev_token = token
+
+    return programs
+
+
+def _program_signature(program):
+    """
+    signature of the program binary (or script) as resolved on the PATH, so upgrading a tool reruns its commands
+    """
+
+    program_path = program if os.sep in program else shutil.which(program)
+    if program_path is None:
+        return "missing"
+
+    return _file_signature(os.path.realpath(program_path))
+
+
+def _checkpoint_is_current(checkpoint_file, fingerprint):
+
+    if not os.path.exists(checkpoint_file):
+        return False
+
+    if fingerprint is None:
+        return True
+
+    with open(checkpoint_file, "rt") as fh:
+        recorded_fingerprint = fh.read().strip()
+
+    # checkpoints from earlier versions are empty touched files, so still honor them.
+    return recorded_fingerprint in ("", fingerprint)
+
+
+def _write_checkpoint(checkpoint_file, fingerprint):
+
+    with open(checkpoint_file, "wt") as fh:
+        fh.write("{}\n".format(fingerprint if fingerprint is not None else ""))
+
+
+def parse_memory_setting(memory):
+    """
+    Converts a memory setting such as 4G, 500M, or 20GB (or a plain number of bytes) into bytes.
+    None or 0 means unspecified.
+    """
+
+    if not memory:
+        return 0
+
+    if isinstance(memory, (int, float)):
+        return int(memory)
+
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", str(memory), re.IGNORECASE)
+    if not m:
+        raise ValueError("Error, cannot parse memory setting: {}".format(memory))
+
+    units = { "": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4 }
+
+    return int(float(m.group(1)) * units[m.group(2).upper()])
+
+
+def get_physical_memory():
+    """
+    Returns the machine's physical memory in bytes.
+    """
+
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class ResourcePool(object):
+    """
+    Tracks CPU threads and memory (bytes) in use against a machine budget.
+
+    A request larger than the whole budget is clamped to it, so it will eventually run, just on its own.
+    """
+
+    def __init__(self, max_cpu, max_memory=None):
+        self._max_cpu = max(1, max_cpu)
+        self._max_memory = parse_memory_setting(max_memory)  # 0 = unlimited
+        self._cpu_in_use = 0
+        self._memory_in_use = 0
+        self._lock = threading.Lock()
+
+
+    def _clamp(self, cpu, memory):
+        cpu = min(max(1, cpu), self._max_cpu)
+        memory = parse_memory_setting(memory)
+        if self._max_memory:
+            memory = min(memory, self._max_memory)
+        else:
+            memory = 0
+        return cpu, memory
+
+
+    def try_acquire(self, cpu, memory):
+        cpu, memory = self._clamp(cpu, memory)
+        with self._lock:
+            if self._cpu_in_use + cpu > self._max_cpu:
+                return False
+            if self._max_memory and self._memory_in_use + memory > self._max_memory:
+                return False
+            self._cpu_in_use += cpu
+            self._memory_in_use += memory
+            return True
+
+
+    def release(self, cpu, memory):
+        cpu, memory = self._clamp(cpu, memory)
+        with self._lock:
+            self._cpu_in_use -= cpu
+            self._memory_in_use -= memory
+
+
+
+def _run_scheduled(cmds, dependencies, num_workers, resource_pool, run_func):
+    """
+    Runs cmds (objects providing get_cpu() and get_memory()) as a dependency graph via run_func(cmd),
+    each on its own thread, starting every command whose prerequisites have completed as long as no more than
+    num_workers are running and their declared resources fit in the resource_pool.
+
+    Completion is signaled through a queue, so the dispatcher simply blocks until something finishes.
+
+    Returns the list of exceptions raised, after all launched commands have finished.
+    """
+
+    dependents = [ list() for i in range(len(dependencies)) ]
+    num_pending_deps = list()
+    for i, cmd_deps in enumerate(dependencies):
+        num_pending_deps.append(len(cmd_deps))
+        for j in cmd_deps:
+            dependents[j].append(i)
+
+    ready = [ i for i, num_deps in enumerate(num_pending_deps) if num_deps == 0 ]
+    completed = queue.Queue()
+    num_running = 0
+    errors = list()
+
+    def run_cmd_idx(cmd_idx):
+        try:
+            run_func(cmds[cmd_idx])
+            completed.put( (cmd_idx, None) )
+        except Exception as e:
+            completed.put( (cmd_idx, e) )
+
+    while ready or num_running > 0:
+
+        # launch everything that's ready and fits, unless we're winding down due to an error
+        if not errors:
+            still_waiting = list()
+            for cmd_idx in ready:
+                cmd = cmds[cmd_idx]
+                if num_running < num_workers and resource_pool.try_acquire(cmd.get_cpu(), cmd.get_memory()):
+                    cmdthread = threading.Thread(target=run_cmd_idx, args=(cmd_idx,))
+                    cmdthread.daemon = True
+                    num_running += 1
+                    cmdthread.start()
+                else:
+                    still_waiting.append(cmd_idx)
+            ready = still_waiting
+
+        if num_running == 0:
+            break
+
+        # block until a command finishes
+        cmd_idx, error = completed.get()
+        num_running -= 1
+        resource_pool.release(cmds[cmd_idx].get_cpu(), cmds[cmd_idx].get_memory())
+
+        if error is not None:
+            errors.append(error)
+            continue
+
+        for dependent_idx in dependents[cmd_idx]:
+            num_pending_deps[dependent_idx] -= 1
+            if num_pending_deps[dependent_idx] == 0:
+                ready.append(dependent_idx)
+
+    return errors
 
 
 class Pipeliner(object):
@@ -37,7 +397,8 @@ class Pipeliner(object):
     _checkpoint_dir = None
     _cmds_list = []
 
-    def __init__(self, checkpoint_dir):
+    def __init__(self, checkpoint_dir, num_workers=1, max_cpu=None, max_memory=None, version_info=None,
+                 profile_dir=None):
 
         checkpoint_dir = os.path.abspath(checkpoint_dir)
 
@@ -45,6 +406,13 @@ class Pipeliner(object):
             os.makedirs(checkpoint_dir)
             
         self._checkpoint_dir = checkpoint_dir
+        self._num_workers = max(1, num_workers)
+        self._max_cpu = max_cpu if max_cpu else self._num_workers
+        self._max_memory = max_memory
+        self._version_info = version_info
+        self._profile_dir = profile_dir
+        self._profile_records = []
+        self._cmds_list = []
     
 
 
@@ -65,10 +433,23 @@ class Pipeliner(object):
 
 
     def run(self):
-        for cmd in self._cmds_list:
-            
-            checkpoint_dir = self._checkpoint_dir
-            cmd.run(checkpoint_dir)
+
+        self._assign_fingerprints()
+
+        try:
+            if self._num_workers > 1:
+                self._run_dependency_graph()
+            else:
+                for cmd in self._cmds_list:
+
+                    checkpoint_dir = self._checkpoint_dir
+                    cmd.run(checkpoint_dir)
+        finally:
+            # capture the resource usage, including that of any failed command
+            for cmd in self._cmds_list:
+                self._profile_records.extend(cmd.get_profile_records())
+            if self._profile_dir is not None:
+                self._profile_records = write_profile(self._profile_dir, self._profile_records)
 
         # since all commands executed successfully, remove them from the current cmds list
         self._cmds_list = list()
@@ -76,13 +457,133 @@ class Pipeliner(object):
         return
 
 
+    def get_profile_records(self):
+        return self._profile_records
+
+
+    def _assign_fingerprints(self):
+        """
+        Computes each command's fingerprint from its command string, the version info, the signatures of the programs
+        it runs (those of its pipelines, including within bash -c, along with any tools it declares), and its inputs.  An input produced by an earlier command contributes that command's fingerprint,
+        and any other input contributes its content digest (or size and mtime if large).
+        So a changed command reruns along with everything downstream of it, and nothing else.
+
+        Commands that don't declare their files depend on the fingerprints of all earlier commands.
+        """
+
+        fingerprints = list()
+        producers = dict()
+        last_barrier_idx = None
+
+        for i, cmd in enumerate(self._cmds_list):
+
+            fingerprint_parts = [ "version:{}".format(self._version_info),
+                                  "cmd:{}".format(cmd.get_cmd()) ]
+
+            programs = _get_cmd_programs(cmd.get_cmd()) + cmd.get_tools()
+            for program in sorted(set(programs)):
+                fingerprint_parts.append("exe:{}:{}".format(program, _program_signature(program)))
+
+            if cmd.has_declared_files():
+                for input_file in sorted(cmd.get_inputs()):
+                    producer_idx = producers.get(input_file, last_barrier_idx)
+                    if producer_idx is not None:
+                        input_signature = fingerprints[producer_idx]
+                    else:
+                        input_signature = _file_signature(input_file)
+                    fingerprint_parts.append("input:{}:{}".format(input_file, input_signature))
+            else:
+                fingerprint_parts.extend(fingerprints)
+                last_barrier_idx = i
+
+            fingerprint = hashlib.sha256("\n".join(fingerprint_parts).encode("utf-8")).hexdigest()
+            cmd.set_fingerprint(fingerprint)
+            fingerprints.append(fingerprint)
+
+            for output_file in cmd.get_outputs():
+                producers[output_file] = i
+
+        return
+
+
+    def _build_dependency_graph(self):
+        """
+        Returns a list (parallel to _cmds_list) of sets of indices of the earlier commands each command must wait for.
+
+        A command that declares its input and output files depends only on earlier commands whose files it conflicts with
+        (it reads what they write, writes what they read, or writes what they write).
+        A command that declares neither acts as a barrier, preserving the original serial ordering around it.
+        """
+
+        dependencies = list()
+        last_barrier_idx = -1
+
+        for i, cmd in enumerate(self._cmds_list):
+
+            cmd_deps = set()
+
+            if not cmd.has_declared_files():
+                cmd_deps.update(range(last_barrier_idx + 1, i))
+                if last_barrier_idx >= 0:
+                    cmd_deps.add(last_barrier_idx)
+                last_barrier_idx = i
+            else:
+                if last_barrier_idx >= 0:
+                    cmd_deps.add(last_barrier_idx)
+
+                for j in range(last_barrier_idx + 1, i):
+                    prev_cmd = self._cmds_list[j]
+                    if ( (prev_cmd.get_outputs() & cmd.get_inputs())
+                         or (prev_cmd.get_inputs() & cmd.get_outputs())
+                         or (prev_cmd.get_outputs() & cmd.get_outputs()) ):
+                        cmd_deps.add(j)
+
+            dependencies.append(cmd_deps)
+
+        return dependencies
+
+
+    def _run_dependency_graph(self):
+        """
+        Runs the commands as a dependency graph, launching every command whose prerequisites have completed,
+        with no more than _num_workers commands running simultaneously and their declared CPU and memory
+        requirements packed within the _max_cpu and _max_memory budget.
+        """
+
+        dependencies = self._build_dependency_graph()
+        resource_pool = ResourcePool(self._max_cpu, self._max_memory)
+        checkpoint_dir = self._checkpoint_dir
+
+        errors = _run_scheduled(self._cmds_list, dependencies, self._num_workers, resource_pool,
+                                lambda cmd: cmd.run(checkpoint_dir))
+
+        if errors:
+            raise errors[0]
+
+        return
+
+
 
 class Command(object):
 
-    def __init__(self, cmd, checkpoint, ignore_error=False):
+    def __init__(self, cmd, checkpoint, ignore_error=False, inputs=None, outputs=None, cpu=1, memory=None,
+                 tools=None, inner_checkpoint_dir=None):
+        """
+        tools: programs the command runs indirectly (ie. from within a wrapper script), fingerprinted along with those of cmd
+        inner_checkpoint_dir: where a wrapper script keeps the checkpoints of its own steps, cleared when the command
+                              reruns because its fingerprint changed, so that the wrapper doesn't skip them
+        """
         self._cmd = cmd
         self._checkpoint = checkpoint
         self._ignore_error = ignore_error
+        self._cpu = cpu
+        self._memory = parse_memory_setting(memory)
+        self._fingerprint = None
+        self._inputs = _normalize_file_list(inputs)
+        self._outputs = _normalize_file_list(outputs)
+        self._tools = list(tools) if tools else list()
+        self._inner_checkpoint_dir = inner_checkpoint_dir
+        self._profile_record = None
         self._stacktrace = self._extract_stack(stack())
 
     def get_cmd(self):
@@ -93,6 +594,37 @@ class Command(object):
 
     def get_ignore_error_setting(self):
         return self._ignore_error
+
+    def get_inputs(self):
+        return self._inputs if self._inputs is not None else set()
+
+    def get_outputs(self):
+        return self._outputs if self._outputs is not None else set()
+
+    def has_declared_files(self):
+        return self._inputs is not None or self._outputs is not None
+
+    def get_tools(self):
+        return self._tools
+
+    def get_inner_checkpoint_dir(self):
+        return self._inner_checkpoint_dir
+
+    def get_cpu(self):
+        return self._cpu
+
+    def get_fingerprint(self):
+        return self._fingerprint
+
+    def set_fingerprint(self, fingerprint):
+        self._fingerprint = fingerprint
+
+    def get_memory(self):
+        return self._memory
+
+    def get_profile_records(self):
+        # only commands actually executed have a profile record
+        return [self._profile_record] if self._profile_record is not None else []
  
 
     def __repr__(self):
@@ -115,14 +647,24 @@ class Command(object):
 
         checkpoint_file = os.path.sep.join([checkpoint_dir, self.get_checkpoint()])
         ret = 0
-        if os.path.exists(checkpoint_file):
+        if _checkpoint_is_current(checkpoint_file, self.get_fingerprint()):
             logger.info("CMD: " + self.get_cmd() + " already processed. Skipping.")
         else:
+            if os.path.exists(checkpoint_file):
+                logger.info("CMD: " + self.get_cmd() + " or its inputs changed since last processed. Rerunning.")
+                inner_checkpoint_dir = self.get_inner_checkpoint_dir()
+                if inner_checkpoint_dir and os.path.isdir(inner_checkpoint_dir):
+                    logger.info("-clearing the stale checkpoints in {}".format(inner_checkpoint_dir))
+                    shutil.rmtree(inner_checkpoint_dir)
+                # no longer current, and if the rerun fails, resumes from the wrapper's own checkpoints next time
+                os.remove(checkpoint_file)
+
             # execute it.  If it succeeds, make the checkpoint file
             start_time = time.time()
 
             cmdstr = self.get_cmd()
-            ret = run_cmd(cmdstr, True)
+            ret, rusage = run_cmd_with_rusage(cmdstr, True)
+            self._profile_record = _make_profile_record(self.get_checkpoint(), cmdstr, time.time() - start_time, ret, rusage)
             if ret:
                 # failure occurred.
                 errmsg = str("Error, command: [ {} ] failed, stack trace: [ {} ] ".format(cmdstr, self.get_stacktrace()))
@@ -134,7 +676,7 @@ class Command(object):
                 end_time = time.time()
                 runtime_minutes = (end_time - start_time) / 60
                 logger.info("Execution Time = {:.2f} minutes. CMD: {}".format(runtime_minutes, cmdstr))
-                run_cmd("touch {}".format(checkpoint_file))  # only if succeeds.
+                _write_checkpoint(checkpoint_file, self.get_fingerprint())  # only if succeeds.
 
         return ret
 
@@ -144,83 +686,104 @@ class Command(object):
 #############################
 
 
-class ParallelCommandThread(threading.Thread):
+class ParallelCommandList(object):
+    """
+    Runs a list of commands concurrently.  Entries can be command strings or Command objects declaring
+    the cpu and memory they require; jobs are packed against num_threads CPU and the max_memory budget.
+    """
+
+    def __init__(self, cmdlist, checkpoint, num_threads, ignore_error=False, inputs=None, outputs=None,
+                 max_memory=None):
 
-    def __init__(self, cmdobj, checkpointdir, paraCmdListObj):
+        self._cmdlist = cmdlist
+        self._checkpoint = checkpoint
+        self._num_threads = num_threads
+        self._ignore_error = ignore_error
+        self._inputs = _normalize_file_list(inputs)
+        self._outputs = _normalize_file_list(outputs)
+        self._max_memory = max_memory
+        self._fingerprint = None
+        self._cmdobjs = list()
 
-        threading.Thread.__init__(self)
+    def get_cmd(self):
+        return "\n".join([ cmd.get_cmd() if isinstance(cmd, Command) else cmd for cmd in self._cmdlist ])
 
-        self._cmdobj = cmdobj
-        self._checkpointdir = checkpointdir
-        self._paraCmdListObj = paraCmdListObj
+    def get_fingerprint(self):
+        return self._fingerprint
 
+    def set_fingerprint(self, fingerprint):
+        self._fingerprint = fingerprint
 
-    def run(self):
+    def get_inputs(self):
+        return self._inputs if self._inputs is not None else set()
 
-        ret = self._cmdobj.run(self._checkpointdir)
+    def get_outputs(self):
+        return self._outputs if self._outputs is not None else set()
 
-        # track job completion and capture success/failure
-        self._paraCmdListObj._num_running -= 1
-        
-        if ret != 0:
-            self._paraCmdListObj._num_errors += 1
+    def has_declared_files(self):
+        return self._inputs is not None or self._outputs is not None
 
+    def get_tools(self):
+        return [ tool for cmd in self._cmdlist if isinstance(cmd, Command) for tool in cmd.get_tools() ]
 
-class ParallelCommandList(object):
+    def get_cpu(self):
+        # the list as a whole occupies its full thread allotment within a Pipeliner
+        return self._num_threads
 
-    def __init__(self, cmdlist, checkpoint, num_threads, ignore_error=False):
+    def get_memory(self):
+        return parse_memory_setting(self._max_memory)
 
-        self._cmdlist = cmdlist
-        self._checkpoint = checkpoint
-        self._num_threads = num_threads
-        self._ignore_error = ignore_error
-        self._num_running = 0
-        self._num_errors = 0
+    def get_profile_records(self):
+        profile_records = list()
+        for cmdobj in self._cmdobjs:
+            profile_records.extend(cmdobj.get_profile_records())
+        return profile_records
 
     def run(self, checkpoint_dir):
 
         parallel_job_checkpoint_file = self._checkpoint
 
         full_path_parallel_job_checkpoint_file = os.path.sep.join([checkpoint_dir, parallel_job_checkpoint_file])
-        if os.path.exists(full_path_parallel_job_checkpoint_file):
+        if _checkpoint_is_current(full_path_parallel_job_checkpoint_file, self.get_fingerprint()):
             logger.info("Parallel command series already completed, so skipping. Checkpoint found as: {}".format(full_path_parallel_job_checkpoint_file))
             return
         
-        ## run parallel command series, no more than _num_threads simultaneously.
-        
-        cmd_idx = 0
-        while cmd_idx < len(self._cmdlist):
-
-            if self._num_running < self._num_threads:
-                
-                cmdstr = self._cmdlist[cmd_idx]
-
-                checkpoint_file = "{}.tid-{}".format(parallel_job_checkpoint_file, cmd_idx)
-
-                cmdobj = Command(cmdstr, checkpoint_file, ignore_error=True)
-                cmdthread = ParallelCommandThread(cmdobj, checkpoint_dir, self)
-                self._num_running += 1
-                cmdthread.start() # will auto-decrement _num_threads once it completes via shared memory usage.
-                cmd_idx += 1
-
-        ## wait for the remaining ones to finish.
-        iter_counter = 0
-        while self._num_running > 0:
-            time.sleep(1) # avoid unnecessarily running at 100% CPU. Sleeping 1 second is a long enough time in the quantum realm.
-            iter_counter += 1
-            if iter_counter % 60 == 0:
-                sys.stderr.write("\r waiting for {} jobs to complete.    ".format(self._num_running))
+        ## run parallel command series, packed within the cpu and memory budget.
 
-
-        if self._num_errors > 0:
-            errmsg = "Error, {} commands failed".format(self._num_errors)
+        cmdobjs = self._cmdobjs = list()
+        for cmd_idx, cmd in enumerate(self._cmdlist):
+            checkpoint_file = "{}.tid-{}".format(parallel_job_checkpoint_file, cmd_idx)
+            if isinstance(cmd, Command):
+                cmdobj = Command(cmd.get_cmd(), checkpoint_file, ignore_error=True, cpu=cmd.get_cpu(), memory=cmd.get_memory())
+            else:
+                cmdobj = Command(cmd, checkpoint_file, ignore_error=True)
+            if self.get_fingerprint() is not None:
+                cmdobj.set_fingerprint(hashlib.sha256("{}\n{}".format(self.get_fingerprint(), cmdobj.get_cmd()).encode("utf-8")).hexdigest())
+            cmdobjs.append(cmdobj)
+
+        num_errors = [0]
+        num_errors_lock = threading.Lock()
+        def run_cmdobj(cmdobj):
+            ret = cmdobj.run(checkpoint_dir)
+            if ret != 0:
+                with num_errors_lock:
+                    num_errors[0] += 1
+
+        resource_pool = ResourcePool(self._num_threads, self._max_memory)
+        no_dependencies = [ set() for cmdobj in cmdobjs ]
+        errors = _run_scheduled(cmdobjs, no_dependencies, self._num_threads, resource_pool, run_cmdobj)
+
+        num_errors = num_errors[0] + len(errors)
+        
+        if num_errors > 0:
+            errmsg = "Error, {} commands failed".format(num_errors)
             logger.error(errmsg)
             if not self._ignore_error:
                 raise RuntimeError(errmsg)
         else:
             logger.info("All parallel commands succeeded.")
         
-        run_cmd("touch {}".format(full_path_parallel_job_checkpoint_file))
+        _write_checkpoint(full_path_parallel_job_checkpoint_file, self.get_fingerprint())
 
         logger.info("done running parallel command series.")
         
@@ -247,6 +810,14 @@ if __name__ == '__main__':
     
     pipeliner.run()
 
+    ## run as a dependency graph: the two 'sleep' commands only share an input and so run simultaneously.
+    dag_pipeliner = Pipeliner(checkpoint_dir, num_workers=4)
+    test_file = os.path.join(checkpoint_dir, "dag_test.txt")
+    dag_pipeliner.add_commands([Command("echo dag > {}".format(test_file), "dag_write.ok", outputs=[test_file]),
+                                Command("sleep 2 && cat {}".format(test_file), "dag_read_A.ok", inputs=[test_file]),
+                                Command("sleep 2 && cat {}".format(test_file), "dag_read_B.ok", inputs=[test_file]) ])
+    dag_pipeliner.run()
+
     shutil.rmtree(checkpoint_dir)
 
     sys.exit(0)
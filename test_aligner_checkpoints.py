@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Tests that rerunning an aligner stage for changed inputs reruns the aligner wrapper's own steps, and that the
+aligner indexes are rebuilt for changed contigs or annotations, or an interrupted build.
+
+The aligners and samtools are stood in for by small scripts, the bam being just the reads copied through.
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+
+import pytest
+
+if shutil.which("perl") is None:
+    pytest.skip("perl is required", allow_module_level=True)
+
+FI_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(FI_DIR, "PyLib"))
+from Pipeliner import Pipeliner, Command
+
+
+FAKE_STAR = """#!/bin/bash
+reads=""
+while [ $# -gt 0 ]; do
+    if [ "$1" == "--readFilesIn" ]; then
+        shift
+        while [ $# -gt 0 ] && [[ "$1" != --* ]]; do reads="$reads $1"; shift; done
+    elif [ "$1" == "--genomeDir" ] && [ -n "$FAKE_STAR_BUILD_LOG" ]; then
+        echo "$2" >> "$FAKE_STAR_BUILD_LOG"
+        shift
+    else
+        shift
+    fi
+done
+if [ -n "$reads" ]; then
+    cat $reads > Aligned.sortedByCoord.out.bam
+fi
+"""
+
+FAKE_MINIMAP2 = """#!/bin/bash
+if [ "$1" == "-d" ]; then
+    echo "$3" >> "$FAKE_MINIMAP2_BUILD_LOG"
+    cp "$3" "$2"
+fi
+"""
+
+FAKE_SAMTOOLS = """#!/bin/bash
+if [ "$1" == "index" ]; then
+    touch "$2.bai"
+fi
+"""
+
+
+def write_script(filename, content):
+    with open(filename, "wt") as ofh:
+        ofh.write(content)
+    os.chmod(filename, 0o755)
+
+
+def test_changed_reads_rerun_the_wrapped_alignment(monkeypatch):
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        bin_dir = os.path.join(tmpdir, "bin")
+        os.makedirs(bin_dir)
+        fake_star = os.path.join(bin_dir, "STAR")
+        write_script(fake_star, FAKE_STAR)
+        write_script(os.path.join(bin_dir, "samtools"), FAKE_SAMTOOLS)
+        monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+
+        contigs_fa = os.path.join(tmpdir, "contigs.fa")
+        with open(contigs_fa, "wt") as ofh:
+            ofh.write(">A--B\nACGTACGTACGT\n")
+
+        reads_fq = os.path.join(tmpdir, "reads.fq")
+        workdir = os.path.join(tmpdir, "workdir")
+        aligner_checkpoint_dir = os.path.join(workdir, "star_align.chkpts")
+        bam_file = os.path.join(workdir, "test.star.sortedByCoord.out.bam")
+
+        cmdstr = " ".join([os.path.join(FI_DIR, "util", "run_FI_STAR.pl"),
+                           "--genome", contigs_fa,
+                           "--reads", reads_fq,
+                           "--star_path", fake_star,
+                           "--out_prefix test.star",
+                           "--out_dir", workdir,
+                           "--checkpoint_dir", aligner_checkpoint_dir])
+
+        def run_pipeline():
+            pipeliner = Pipeliner(os.path.join(tmpdir, "chckpts"))
+            pipeliner.add_commands([Command(cmdstr, "run_STAR.ok",
+                                            inputs=[contigs_fa, reads_fq],
+                                            outputs=[bam_file, bam_file + ".bai"],
+                                            tools=[fake_star, "samtools"],
+                                            inner_checkpoint_dir=aligner_checkpoint_dir)])
+            pipeliner.run()
+
+        with open(reads_fq, "wt") as ofh:
+            ofh.write("@r1\nACGT\n+\nIIII\n")
+        run_pipeline()
+        assert open(bam_file).read() == "@r1\nACGT\n+\nIIII\n"
+
+        with open(reads_fq, "wt") as ofh:
+            ofh.write("@r2\nTTTT\n+\nIIII\n")
+        run_pipeline()
+        assert open(bam_file).read() == "@r2\nTTTT\n+\nIIII\n"
+
+
+def test_star_index_keyed_on_annotation_and_rebuilt_if_interrupted(monkeypatch):
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        fake_star = os.path.join(tmpdir, "STAR")
+        write_script(fake_star, FAKE_STAR)
+        build_log = os.path.join(tmpdir, "builds.log")
+        monkeypatch.setenv("FAKE_STAR_BUILD_LOG", build_log)
+
+        genome_fa = os.path.join(tmpdir, "genome.fa")
+        with open(genome_fa, "wt") as ofh:
+            ofh.write(">chr1\nACGTACGTACGT\n")
+        gtf_file = os.path.join(tmpdir, "annot.gtf")
+
+        def prep_index():
+            subprocess.run([os.path.join(FI_DIR, "util", "run_FI_STAR.pl"), "--genome", genome_fa, "-G", gtf_file,
+                            "--star_path", fake_star, "--prep_reference_only", "--out_dir", tmpdir], check=True)
+
+        def get_builds():
+            with open(build_log) as fh:
+                return fh.read().split()
+
+        with open(gtf_file, "wt") as ofh:
+            ofh.write("chr1\tx\texon\t1\t10\t.\t+\t.\tgene_id \"g1\";\n")
+        prep_index()
+        prep_index()
+        assert len(get_builds()) == 1
+        first_index = get_builds()[0]
+
+        with open(gtf_file, "wt") as ofh:
+            ofh.write("chr1\tx\texon\t1\t12\t.\t+\t.\tgene_id \"g1\";\n")
+        prep_index()
+        assert len(get_builds()) == 2 and get_builds()[1] != first_index
+
+        # an interrupted build of the first annotation's index
+        os.remove(os.path.join(first_index, "build.ok"))
+        with open(gtf_file, "wt") as ofh:
+            ofh.write("chr1\tx\texon\t1\t10\t.\t+\t.\tgene_id \"g1\";\n")
+        prep_index()
+        assert get_builds() == [first_index, get_builds()[1], first_index]
+
+
+def test_minimap2_contigs_index_rebuilt_for_changed_contigs(monkeypatch):
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        fake_minimap2 = os.path.join(tmpdir, "minimap2")
+        write_script(fake_minimap2, FAKE_MINIMAP2)
+        build_log = os.path.join(tmpdir, "builds.log")
+        monkeypatch.setenv("FAKE_MINIMAP2_BUILD_LOG", build_log)
+
+        genome_dir = os.path.join(tmpdir, "genome_lib")
+        os.makedirs(genome_dir)
+        genome_fa = os.path.join(genome_dir, "genome.fa")
+        with open(genome_fa, "wt") as ofh:
+            ofh.write(">chr1\nACGTACGTACGT\n")
+        contigs_fa = os.path.join(tmpdir, "contigs.fa")
+        out_dir = os.path.join(tmpdir, "out")
+
+        def prep_index():
+            return subprocess.run([os.path.join(FI_DIR, "util", "run_FI_minimap2.pl"), "--genome", genome_fa, "--patch", contigs_fa,
+                                   "--minimap2_path", fake_minimap2, "--prep_reference_only", "--out_dir", out_dir],
+                                  stderr=subprocess.PIPE)
+
+        def get_builds():
+            with open(build_log) as fh:
+                return fh.read().split()
+
+        with open(contigs_fa, "wt") as ofh:
+            ofh.write(">A--B\nACGTACGT\n")
+        assert prep_index().returncode == 0
+        assert prep_index().returncode == 0
+        assert get_builds() == [genome_fa, contigs_fa]
+
+        with open(contigs_fa, "wt") as ofh:
+            ofh.write(">A--B\nACGTACGTAAAA\n")
+        assert prep_index().returncode == 0
+        assert get_builds() == [genome_fa, contigs_fa, contigs_fa]
+
+        if os.geteuid() == 0:
+            # root can write to a read-only genome lib anyway
+            return
+
+        # an unbuilt genome index in a read-only genome lib isn't built per sample
+        os.remove(genome_fa + ".mmi.build.ok")
+        os.chmod(genome_dir, 0o555)
+        try:
+            result = prep_index()
+        finally:
+            os.chmod(genome_dir, 0o755)
+        assert result.returncode != 0
+        assert b"read-only" in result.stderr
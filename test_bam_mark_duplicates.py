@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests that duplicate marking over a bam stream (read until_eof) reports the same reads as over the indexed bam's
+contigs, the unplaced unmapped reads at the end of the stream being left out either way.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+pysam = pytest.importorskip("pysam")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "util"))
+from bam_mark_duplicates import mark_duplicates
+
+
+HEADER = pysam.AlignmentHeader.from_dict({"HD": {"VN": "1.6", "SO": "coordinate"},
+                                          "SQ": [{"SN": "A--B", "LN": 5000}, {"SN": "C--D", "LN": 5000}]})
+
+
+def _make_read(read_name, contig, pos, mate_pos, mate=1, is_unmapped=False):
+
+    read = pysam.AlignedSegment(HEADER)
+    read.query_name = read_name
+    read.query_sequence = "A" * 50
+    read.is_paired = True
+    read.is_read1 = (mate == 1)
+    read.is_read2 = (mate == 2)
+    if contig is None:
+        read.is_unmapped = True
+        read.mate_is_unmapped = True
+        read.reference_id = -1
+        read.reference_start = -1
+        read.next_reference_id = -1
+        read.next_reference_start = -1
+    else:
+        read.reference_name = contig
+        read.reference_start = pos
+        read.next_reference_name = contig
+        read.next_reference_start = mate_pos
+        if is_unmapped:
+            # placed at its mate's position
+            read.is_unmapped = True
+        else:
+            read.cigarstring = "50M"
+
+    return read
+
+
+READS = [
+    _make_read("pair1", "A--B", 100, 300),
+    _make_read("pair1_dup", "A--B", 100, 300),
+    _make_read("mate_unmapped", "A--B", 200, 200),
+    _make_read("mate_unmapped", "A--B", 200, 200, mate=2, is_unmapped=True),
+    _make_read("pair1", "A--B", 300, 100, mate=2),
+    _make_read("pair1_dup", "A--B", 300, 100, mate=2),
+    _make_read("pair2", "C--D", 50, 150),
+    _make_read("pair2", "C--D", 150, 50, mate=2),
+    _make_read("unplaced", None, -1, -1),
+    _make_read("unplaced", None, -1, -1, mate=2),
+]
+
+
+@pytest.mark.parametrize("remove_dups_flag", [False, True])
+def test_streamed_and_indexed_bam_report_the_same_reads(remove_dups_flag):
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        bam_filename = os.path.join(tmpdir, "aligned.bam")
+        with pysam.AlignmentFile(bam_filename, "wb", header=HEADER) as bamwriter:
+            for read in READS:
+                bamwriter.write(read)
+        pysam.index(bam_filename)
+
+        def get_reported_reads(bamreader, reads):
+            return [ (read.query_name, read.reference_name, read.reference_start, read.is_duplicate)
+                     for read in mark_duplicates(bamreader, reads, remove_dups_flag, dict()) ]
+
+        with pysam.AlignmentFile(bam_filename, "rb") as bamreader:
+            streamed_reads = get_reported_reads(bamreader, bamreader.fetch(until_eof=True))
+
+        with pysam.AlignmentFile(bam_filename, "rb") as bamreader:
+            fetched_reads = get_reported_reads(bamreader, bamreader.fetch())
+
+        indexed_reads = list()
+        with pysam.AlignmentFile(bam_filename, "rb") as bamreader:
+            for contig in bamreader.references:
+                indexed_reads += get_reported_reads(bamreader, bamreader.fetch(contig))
+
+        assert streamed_reads == fetched_reads == indexed_reads
+        assert "unplaced" not in [ read_name for (read_name, contig, start, is_duplicate) in streamed_reads ]
+        assert ("mate_unmapped", "A--B", 200, False) in streamed_reads
+
+        duplicates = [ (read_name, start) for (read_name, contig, start, is_duplicate) in streamed_reads if is_duplicate ]
+        assert duplicates == ([] if remove_dups_flag else [("pair1_dup", 100), ("pair1_dup", 300)])
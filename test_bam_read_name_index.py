@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests for the PyLib BamReadNameIndex file format and lookups.
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyLib"))
+from BamReadNameIndex import BamReadNameIndex, write_index
+
+
+def test_lookup_returns_all_alignments_of_both_mates():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        index_filename = os.path.join(tmpdir, "reads.bam.rni")
+
+        pairs = [("readA/1", 100), ("readB", 200), ("readA/2", 300 << 16 | 5), ("readC", 400), ("readB", 500)]
+        assert write_index(index_filename, pairs) == 5
+
+        read_name_index = BamReadNameIndex(index_filename)
+        assert len(read_name_index) == 5
+        assert sorted(read_name_index.get_virtual_offsets("readA")) == [100, 300 << 16 | 5]
+        assert sorted(read_name_index.get_virtual_offsets("readB/1")) == [200, 500]
+        assert read_name_index.get_virtual_offsets("readD") == []
+        read_name_index.close()
+
+
+def test_empty_index():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        index_filename = os.path.join(tmpdir, "empty.bam.rni")
+        assert write_index(index_filename, []) == 0
+
+        read_name_index = BamReadNameIndex(index_filename)
+        assert read_name_index.get_virtual_offsets("readA") == []
+        read_name_index.close()
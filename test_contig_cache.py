@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the PyLib ContigCache eviction and locking.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyLib"))
+from ContigCache import ContigCache
+
+
+def _add_entry(contig_cache, key_info, size):
+
+    key = ContigCache.make_key(key_info)
+    contig_cache.lock(key, exclusive=True)
+    entry_dir = contig_cache.open_entry(key, key_info)
+    with open(os.path.join(entry_dir, "fusion_contigs.fa"), "wb") as ofh:
+        ofh.write(b"A" * size)
+    contig_cache.unlock(key)
+
+    return key
+
+
+def _hold_lock(cache_dir, key, exclusive, locked_event, release_event):
+
+    other_run_cache = ContigCache(cache_dir)
+    other_run_cache.lock(key, exclusive=exclusive)
+    if exclusive:
+        # downgraded as after building an entry
+        other_run_cache.lock(key, exclusive=False)
+    locked_event.set()
+    release_event.wait()
+    other_run_cache.unlock(key)
+
+
+def _start_other_run(cache_dir, key, exclusive=False):
+    """
+    another run holding the entry, in its own process as the locks are per process
+    """
+
+    locked_event = multiprocessing.Event()
+    release_event = multiprocessing.Event()
+    proc = multiprocessing.Process(target=_hold_lock, args=(cache_dir, key, exclusive, locked_event, release_event))
+    proc.start()
+    assert locked_event.wait(10)
+
+    return proc, release_event
+
+
+def test_lru_eviction_skips_entries_in_use():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        contig_cache = ContigCache(tmpdir)
+
+        in_use_key = _add_entry(contig_cache, {"fusions": ["A--B"]}, 1000)
+        time.sleep(0.05)
+        older_key = _add_entry(contig_cache, {"fusions": ["C--D"]}, 1000)
+        time.sleep(0.05)
+        newest_key = _add_entry(contig_cache, {"fusions": ["E--F"]}, 1000)
+
+        assert ContigCache.make_key({"fusions": ["A--B"]}) == in_use_key
+
+        # another run holds the least recently used entry, so the next one goes instead
+        other_run_proc, release_event = _start_other_run(tmpdir, in_use_key)
+
+        contig_cache.evict(2500)
+
+        assert os.path.exists(contig_cache.get_entry_dir(in_use_key))
+        assert not os.path.exists(contig_cache.get_entry_dir(older_key))
+        assert os.path.exists(contig_cache.get_entry_dir(newest_key))
+
+        release_event.set()
+        other_run_proc.join()
+        contig_cache.evict(1500)
+        assert not os.path.exists(contig_cache.get_entry_dir(in_use_key))
+        assert os.path.exists(contig_cache.get_entry_dir(newest_key))
+
+
+def test_entry_downgraded_from_exclusive_is_not_evicted():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        contig_cache = ContigCache(tmpdir)
+        key = _add_entry(contig_cache, {"fusions": ["A--B"]}, 1000)
+
+        other_run_proc, release_event = _start_other_run(tmpdir, key, exclusive=True)
+
+        contig_cache.evict(0)
+        assert os.path.exists(contig_cache.get_entry_dir(key))
+
+        release_event.set()
+        other_run_proc.join()
+
+        contig_cache.evict(0)
+        assert not os.path.exists(contig_cache.get_entry_dir(key))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Regression test that extracting the fusion evidence by contig group (extract_fusion_evidence_from_bam.pl) reports the
+same junction and spanning evidence as running the junction and spanning classifiers over the whole bam, as
+FusionInspector did before.
+
+Aligns the test/ reads to the test/ fusion targets, so needs a CTAT genome lib (CTAT_GENOME_LIB), STAR and samtools.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+import pytest
+
+FI_DIR = os.path.dirname(os.path.abspath(__file__))
+UTILDIR = os.path.join(FI_DIR, "util")
+TESTDIR = os.path.join(FI_DIR, "test")
+
+if not os.environ.get("CTAT_GENOME_LIB"):
+    pytest.skip("set CTAT_GENOME_LIB to run the evidence extraction regression test", allow_module_level=True)
+
+for program in ("STAR", "samtools", "perl"):
+    if shutil.which(program) is None:
+        pytest.skip("{} is required".format(program), allow_module_level=True)
+
+if subprocess.run(["perl", "-MSet::IntervalTree", "-MJSON::XS", "-e", "1"], stderr=subprocess.DEVNULL).returncode != 0:
+    pytest.skip("the perl Set::IntervalTree and JSON::XS modules are required", allow_module_level=True)
+
+
+# per-row lists of reads, reported in hash order
+READ_LIST_COLUMNS = ("JunctionReads", "SpanningFrags", "CounterFusionLeftReads", "CounterFusionRightReads")
+
+
+def read_evidence_info(info_file):
+    """
+    returns the (header, rows) of a .fusion_junction_info or .fusion_spanning_info file, each row a dict with its read
+    lists sorted.
+    """
+
+    with open(info_file) as fh:
+        header = fh.readline().rstrip("\n").split("\t")
+        rows = list()
+        for line in fh:
+            row = dict(zip(header, line.rstrip("\n").split("\t")))
+            for column in READ_LIST_COLUMNS:
+                if column in row:
+                    row[column] = ",".join(sorted(row[column].split(",")))
+            rows.append(row)
+
+    return header, rows
+
+
+def get_row_key(row):
+    return (row["LeftGene"], row["LeftBreakpoint"], row["RightGene"], row["RightBreakpoint"], row["SpliceType"])
+
+
+def run_cmd(cmdstr):
+    subprocess.run(cmdstr, shell=True, check=True)
+
+
+def test_grouped_extraction_matches_single_pass():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        genome_lib_dir = os.environ["CTAT_GENOME_LIB"]
+        out_dir = os.path.join(tmpdir, "FI")
+        run_cmd(" ".join([os.path.join(FI_DIR, "FusionInspector"),
+                          "--fusions", os.path.join(TESTDIR, "fusion_targets.A.txt"),
+                          "--genome_lib", genome_lib_dir,
+                          "--left_fq", os.path.join(TESTDIR, "test.reads_1.fastq.gz"),
+                          "--right_fq", os.path.join(TESTDIR, "test.reads_2.fastq.gz"),
+                          "--out_prefix finspector",
+                          "--output_dir", out_dir]))
+
+        workdir = os.path.join(out_dir, "fi_workdir")
+        gtf_file = os.path.join(workdir, "finspector.gtf")
+        aligned_bam = os.path.join(workdir, "finspector.star.sortedByCoord.out.bam")
+
+        def copy_bam(subdir):
+            os.makedirs(os.path.join(tmpdir, subdir))
+            bam_file = os.path.join(tmpdir, subdir, "aligned.bam")
+            shutil.copy(aligned_bam, bam_file)
+            shutil.copy(aligned_bam + ".bai", bam_file + ".bai")
+            return bam_file
+
+        ## the whole bam at once
+        single_bam = copy_bam("single_pass")
+        run_cmd(" ".join([os.path.join(UTILDIR, "get_fusion_JUNCTION_reads_from_fusion_contig_bam.pl"),
+                          "--gtf_file", gtf_file, "--bam", single_bam, "--genome_lib_dir", genome_lib_dir,
+                          ">", single_bam + ".fusion_junc_reads.sam"]))
+        run_cmd(" ".join([os.path.join(UTILDIR, "get_fusion_SPANNING_reads_from_bam.from_chim_summary.pl"),
+                          "--gtf_file", gtf_file, "--bam", single_bam, "--genome_lib_dir", genome_lib_dir,
+                          "--junction_info", single_bam + ".fusion_junction_info",
+                          ">", single_bam + ".fusion_span_reads.sam"]))
+
+        ## by contig group, several groups for the test's handful of fusion contigs
+        grouped_bam = copy_bam("grouped")
+        run_cmd(" ".join([os.path.join(UTILDIR, "extract_fusion_evidence_from_bam.pl"),
+                          "--gtf_file", gtf_file, "--bam", grouped_bam, "--genome_lib_dir", genome_lib_dir,
+                          "--CPU", "3"]))
+
+        # the evidence reads are reported in bam order either way
+        for suffix in (".fusion_junc_reads.sam", ".fusion_span_reads.sam"):
+            with open(single_bam + suffix) as fh:
+                single_lines = fh.readlines()
+            with open(grouped_bam + suffix) as fh:
+                grouped_lines = fh.readlines()
+            assert single_lines, "no evidence reads in " + single_bam + suffix
+            assert grouped_lines == single_lines
+
+        # junctions by decreasing read count, those with equal counts in no particular order
+        single_header, single_rows = read_evidence_info(single_bam + ".fusion_junction_info")
+        grouped_header, grouped_rows = read_evidence_info(grouped_bam + ".fusion_junction_info")
+        assert grouped_header == single_header
+        assert [ row["JunctionReadCount"] for row in grouped_rows ] == [ row["JunctionReadCount"] for row in single_rows ]
+        assert sorted(grouped_rows, key=get_row_key) == sorted(single_rows, key=get_row_key)
+
+        # spanning evidence by contig in bam order
+        single_header, single_rows = read_evidence_info(single_bam + ".fusion_spanning_info")
+        grouped_header, grouped_rows = read_evidence_info(grouped_bam + ".fusion_spanning_info")
+        assert grouped_header == single_header
+        assert grouped_rows == single_rows
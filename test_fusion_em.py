@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the PyLib sparse FusionEM engine.
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+FI_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(FI_DIR, "PyLib"))
+from FusionEM import FusionEM
+
+
+def test_shared_reads_split_by_estimated_expression():
+
+    fusion_em = FusionEM()
+    # A: 3 unique spanning frags, B: 1 unique spanning frag, and 4 junction reads shared by both
+    fusion_em.add_fusion_transcript("A", ["s1", "s2", "s3", "s4"], ["a1", "a2", "a3"])
+    fusion_em.add_fusion_transcript("B", ["s1", "s2", "s3", "s4"], ["b1"])
+    fusion_em.add_fusion_transcript("C", [], [])
+    fusion_em.run()
+
+    # MLE:  theta_A = (3 + 4 theta_A) / 8  =>  theta_A = 0.75
+    est_J, est_S = fusion_em.get_fusion_estimated_J_S("A")
+    assert est_J == pytest.approx(3.0)
+    assert est_S == pytest.approx(3.0)
+
+    est_J, est_S = fusion_em.get_fusion_estimated_J_S("B")
+    assert est_J == pytest.approx(1.0)
+    assert est_S == pytest.approx(1.0)
+
+    assert fusion_em.get_fusion_estimated_J_S("C") == (0, 0)
+
+
+def test_indistinguishable_isoforms_share_evenly_and_reads_are_conserved():
+
+    fusion_em = FusionEM()
+    fusion_em.add_fusion_transcript("A", ["r1", "r2"], ["r3"])
+    fusion_em.add_fusion_transcript("B", ["r1", "r2"], ["r3"])
+    fusion_em.add_fusion_transcript("C", ["r4"], ["r3", "r5"])
+    fusion_em.run()
+
+    est_A = fusion_em.get_fusion_estimated_J_S("A")
+    est_B = fusion_em.get_fusion_estimated_J_S("B")
+    est_C = fusion_em.get_fusion_estimated_J_S("C")
+
+    assert est_A == pytest.approx(est_B)
+    assert sum(est_A) + sum(est_B) + sum(est_C) == pytest.approx(5.0)
+
+
+FUSIONS_TSV = """#FusionName	JunctionReadCount	SpanningFragCount	LeftGene	LeftBreakpoint	RightGene	RightBreakpoint	JunctionReads	SpanningFrags
+A--B	3	4	A	chr1:100:+	B	chr2:200:+	a1,a2,a3	s1,s2,s3,s4
+A--B	1	4	A	chr1:150:+	B	chr2:250:+	b1/1	s1,s2,s3,s4
+C--D	2	3	C	chr3:100:+	D	chr4:100:+	c1,c2,&s2@c4/2	s5,s6,s7
+C--D	1	2	C	chr3:120:+	D	chr4:100:+	c3	s5,s6
+C--D	1	2	C	chr3:140:+	D	chr4:100:+	c4/1	s6,s7
+"""
+
+
+@pytest.mark.skipif(shutil.which("perl") is None, reason="perl is required")
+def test_numpy_engine_agrees_with_perl_engine():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        fusions_tsv = os.path.join(tmpdir, "fusions.tsv")
+        with open(fusions_tsv, "wt") as ofh:
+            ofh.write(FUSIONS_TSV)
+
+        def get_estimates(em_runner):
+            output = subprocess.run([os.path.join(FI_DIR, "util", em_runner), fusions_tsv],
+                                    check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode("utf-8")
+            lines = output.rstrip("\n").split("\n")
+            column_headers = lines[0].split("\t")
+            rows = [ dict(zip(column_headers, line.split("\t"))) for line in lines[1:] ]
+            return [ (float(row["est_J"]), float(row["est_S"])) for row in rows ]
+
+        perl_estimates = get_estimates("fusion_EM_runner.pl")
+        numpy_estimates = get_estimates("fusion_EM_runner.py")
+
+        assert len(perl_estimates) == len(numpy_estimates) == 5
+        for perl_estimate, numpy_estimate in zip(perl_estimates, numpy_estimates):
+            assert numpy_estimate == pytest.approx(perl_estimate, abs=0.05)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Tests for grouping the fusion targets by shared genes.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyLib"))
+from FusionGroups import split_fusion_pair, get_gene_connected_fusion_groups
+
+
+def test_fusions_sharing_genes_are_grouped_in_order_of_appearance():
+
+    fusion_pairs = ["A--B", "C--D", "B--E", "F::G", "E--A", "D--H"]
+
+    assert get_gene_connected_fusion_groups(fusion_pairs) == [
+        ["A--B", "B--E", "E--A"],
+        ["C--D", "D--H"],
+        ["F::G"],
+    ]
+
+
+def test_split_fusion_pair():
+
+    assert split_fusion_pair("ACACA--STAC2") == ("ACACA", "STAC2")
+    assert split_fusion_pair("RP11-1::GENE-2") == ("RP11-1", "GENE-2")
+
+    with pytest.raises(RuntimeError):
+        split_fusion_pair("ACACA")
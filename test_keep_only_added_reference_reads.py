@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests that filtering the alignments to an index including the fusion contigs keeps the same reads, with the same
+NH multimapping counts, as STAR --outSAMfilter KeepOnlyAddedReferences with the contigs given by --genomeFastaFiles.
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+
+import pytest
+
+pysam = pytest.importorskip("pysam")
+
+UTILDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "util")
+sys.path.insert(0, UTILDIR)
+from keep_only_added_reference_reads import get_added_reference_reads
+
+
+HEADER = pysam.AlignmentHeader.from_dict({"HD": {"VN": "1.6", "SO": "unsorted"},
+                                          "SQ": [{"SN": "chr1", "LN": 100000}, {"SN": "GENE1--GENE2", "LN": 5000}]})
+
+
+def _make_read(read_name, contig, pos, num_hits, mate=0):
+
+    read = pysam.AlignedSegment(HEADER)
+    read.query_name = read_name
+    read.reference_name = contig
+    read.reference_start = pos
+    read.cigarstring = "50M"
+    read.query_sequence = "A" * 50
+    if mate:
+        read.is_paired = True
+        read.is_read1 = (mate == 1)
+        read.is_read2 = (mate == 2)
+    read.set_tag("NH", num_hits)
+
+    return read
+
+
+# each read's alignments together, as STAR reports them unsorted, and what KeepOnlyAddedReferences reports of them:
+STAR_UNSORTED_ALIGNMENTS = [
+    # multimaps within the contig, kept with NH 2
+    (_make_read("contig_only", "GENE1--GENE2", 100, 2), True),
+    (_make_read("contig_only", "GENE1--GENE2", 900, 2), True),
+    # the contig alignment of a read also aligning to the genome, which a bed filter of the alignments would keep
+    (_make_read("contig_and_genome", "GENE1--GENE2", 200, 2), False),
+    (_make_read("contig_and_genome", "chr1", 5000, 2), False),
+    (_make_read("genome_only", "chr1", 7000, 1), False),
+    # a pair is dropped if either mate aligns to the genome
+    (_make_read("pair_split", "GENE1--GENE2", 300, 1, mate=1), False),
+    (_make_read("pair_split", "chr1", 9000, 1, mate=2), False),
+    (_make_read("pair_on_contig", "GENE1--GENE2", 400, 1, mate=1), True),
+    (_make_read("pair_on_contig", "GENE1--GENE2", 600, 1, mate=2), True),
+]
+
+
+def test_reads_with_any_genome_alignment_are_dropped():
+
+    reads = [ read for (read, kept) in STAR_UNSORTED_ALIGNMENTS ]
+    expected_reads = [ read for (read, kept) in STAR_UNSORTED_ALIGNMENTS if kept ]
+
+    kept_reads = list(get_added_reference_reads(reads, {"GENE1--GENE2"}))
+
+    assert kept_reads == expected_reads
+    assert [ read.get_tag("NH") for read in kept_reads ] == [2, 2, 1, 1]
+
+
+def test_filters_a_sam_stream():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        contigs_fa = os.path.join(tmpdir, "contigs.fa")
+        with open(contigs_fa, "wt") as ofh:
+            ofh.write(">GENE1--GENE2 some description\n" + "ACGT" * 10 + "\n")
+
+        sam_text = str(HEADER) + "".join([ read.to_string() + "\n" for (read, kept) in STAR_UNSORTED_ALIGNMENTS ])
+
+        output_bam = os.path.join(tmpdir, "out.bam")
+        subprocess.run([sys.executable, os.path.join(UTILDIR, "keep_only_added_reference_reads.py"),
+                        "--contigs_fa", contigs_fa, "-i", "-", "-o", output_bam],
+                       input=sam_text.encode("utf-8"), check=True)
+
+        with pysam.AlignmentFile(output_bam, "rb") as bamreader:
+            kept_alignments = [ (read.query_name, read.reference_start) for read in bamreader.fetch(until_eof=True) ]
+
+        assert kept_alignments == [ (read.query_name, read.reference_start) for (read, kept) in STAR_UNSORTED_ALIGNMENTS if kept ]
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests that the k-mer prefilter's packed k-mer screening keeps the same reads as looking up each queried k-mer string
+in the set of the contigs' k-mers on both strands.
+"""
+
+import os
+import sys
+import random
+import subprocess
+import tempfile
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+UTILDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "util")
+sys.path.insert(0, UTILDIR)
+import kmer_prefilter_reads
+
+
+def revcomp(seq):
+    return seq.translate(str.maketrans("ACGTN", "TGCAN"))[::-1]
+
+
+def has_target_kmer_string_lookup(seq, contig_kmers, kmer_size, stride):
+
+    last_kmer_start = len(seq) - kmer_size
+    if last_kmer_start < 0:
+        return False
+
+    positions = list(range(0, last_kmer_start + 1, stride))
+    if positions[-1] != last_kmer_start:
+        positions.append(last_kmer_start)
+
+    return any(seq[i:i + kmer_size] in contig_kmers for i in positions)
+
+
+def make_fastq_record(read_name, seq):
+    return "@{}\n{}\n+\n{}\n".format(read_name, seq, "I" * len(seq))
+
+
+@pytest.mark.parametrize("kmer_size,stride", [(31, 4), (32, 1), (11, 3)])
+def test_same_reads_kept_as_string_lookup(kmer_size, stride):
+
+    rng = random.Random(kmer_size)
+
+    def random_seq(length):
+        return "".join(rng.choice("ACGT") for i in range(length))
+
+    contigs = [random_seq(500), random_seq(300)[:150] + "N" + random_seq(200), random_seq(20)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        contigs_fa = os.path.join(tmpdir, "contigs.fa")
+        with open(contigs_fa, "wt") as ofh:
+            for i, contig in enumerate(contigs):
+                ofh.write(">contig{}\n{}\n{}\n".format(i, contig[:60].lower(), contig[60:]))
+
+        contig_kmers = set()
+        for contig in contigs:
+            for seq in (contig, revcomp(contig)):
+                for i in range(len(seq) - kmer_size + 1):
+                    if "N" not in seq[i:i + kmer_size]:
+                        contig_kmers.add(seq[i:i + kmer_size])
+
+        kmer_prefilter_reads.KMER_SIZE = kmer_size
+        kmer_prefilter_reads.STRIDE = stride
+        kmer_prefilter_reads.TARGET_KMERS = kmer_prefilter_reads.get_contig_kmers(contigs_fa, kmer_size)
+        kmer_prefilter_reads.TARGET_KMER_HASHES = kmer_prefilter_reads.get_kmer_hash_bitmap(kmer_prefilter_reads.TARGET_KMERS)
+
+        assert len(kmer_prefilter_reads.TARGET_KMERS) <= len(contig_kmers)
+
+    # reads from either strand of the contigs, overlapping them by various lengths, short reads, and reads with Ns
+    seqs = list()
+    for i in range(400):
+        contig = rng.choice(contigs[:2])
+        overlap = rng.randint(0, 60)
+        start = rng.randint(0, len(contig) - overlap)
+        seq = random_seq(rng.randint(0, 100)) + contig[start:start + overlap] + random_seq(rng.randint(0, 100))
+        if rng.random() < 0.5:
+            seq = revcomp(seq)
+        if rng.random() < 0.1 and seq:
+            pos = rng.randrange(len(seq))
+            seq = seq[:pos] + "N" + seq[pos + 1:]
+        seqs.append(seq)
+
+    found = kmer_prefilter_reads.get_reads_with_target_kmer([ make_fastq_record("r{}".format(i), seq) for i, seq in enumerate(seqs) ])
+
+    expected = [ has_target_kmer_string_lookup(seq, contig_kmers, kmer_size, stride) for seq in seqs ]
+
+    assert list(found) == expected
+    assert 0 < sum(expected) < len(seqs)
+
+
+def test_keeps_pairs_with_either_mate_matching():
+
+    rng = random.Random(1)
+    contig = "".join(rng.choice("ACGT") for i in range(400))
+    unrelated = "".join(rng.choice("ACGT") for i in range(100))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        contigs_fa = os.path.join(tmpdir, "contigs.fa")
+        with open(contigs_fa, "wt") as ofh:
+            ofh.write(">A--B\n{}\n".format(contig))
+
+        left_fq = os.path.join(tmpdir, "reads_1.fq")
+        right_fq = os.path.join(tmpdir, "reads_2.fq")
+        with open(left_fq, "wt") as left_ofh, open(right_fq, "wt") as right_ofh:
+            left_ofh.write(make_fastq_record("left_matches/1", contig[50:150]) + make_fastq_record("none/1", unrelated)
+                           + make_fastq_record("right_matches/1", unrelated))
+            right_ofh.write(make_fastq_record("left_matches/2", unrelated) + make_fastq_record("none/2", unrelated)
+                            + make_fastq_record("right_matches/2", revcomp(contig[200:300])))
+
+        out_prefix = os.path.join(tmpdir, "prefiltered")
+        subprocess.run([sys.executable, os.path.join(UTILDIR, "kmer_prefilter_reads.py"), "--contigs_fa", contigs_fa,
+                        "--left_fq", left_fq, "--right_fq", right_fq, "--out_prefix", out_prefix, "--CPU", "1"], check=True)
+
+        with open(out_prefix + ".left.fq") as fh:
+            assert [ line.rstrip() for line in fh ][::4] == ["@left_matches/1", "@right_matches/1"]
+        with open(out_prefix + ".right.fq") as fh:
+            assert [ line.rstrip() for line in fh ][::4] == ["@left_matches/2", "@right_matches/2"]
+        with open(out_prefix + ".total_frags") as fh:
+            assert fh.read().strip() == "3"
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for merging the split genome and fusion contig minimap2 alignments.
+"""
+
+import os
+import sys
+
+import pytest
+
+pysam = pytest.importorskip("pysam")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "util"))
+from merge_genome_and_fusion_contig_alignments import merge_read_alignments
+
+
+HEADER = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "chr1", "LN": 100000}, {"SN": "GENE1--GENE2", "LN": 5000}]})
+
+
+def _make_read(contig, pos, score, mate=1, supplementary=False):
+
+    read = pysam.AlignedSegment(HEADER)
+    read.query_name = "read1"
+    read.reference_name = contig
+    read.reference_start = pos
+    read.cigarstring = "50M"
+    read.query_sequence = "A" * 50
+    read.is_paired = True
+    read.is_read1 = (mate == 1)
+    read.is_read2 = (mate == 2)
+    read.is_supplementary = supplementary
+    read.set_tag("AS", score)
+
+    return read
+
+
+def test_contig_hits_keep_primary_and_count_genome_hits():
+
+    contig_reads = [ _make_read("GENE1--GENE2", 100, 50, mate=1), _make_read("GENE1--GENE2", 300, 48, mate=2) ]
+    genome_reads = [ _make_read("chr1", 1000, 45, mate=1) ]
+
+    merged_reads = list(merge_read_alignments(contig_reads, genome_reads, 0.8))
+
+    assert len(merged_reads) == 2
+    assert not any(read.is_secondary for read in merged_reads)
+    # mate 1 aligns to both the contig and the genome, mate 2 only to the contig
+    assert [ read.get_tag("NH") for read in merged_reads ] == [2, 1]
+
+
+def test_contig_hits_outscored_by_genome_become_secondary_and_weak_ones_are_dropped():
+
+    contig_reads = [ _make_read("GENE1--GENE2", 100, 40), _make_read("GENE1--GENE2", 2000, 20),
+                     _make_read("GENE1--GENE2", 3000, 15, supplementary=True) ]
+    genome_reads = [ _make_read("chr1", 1000, 50) ]
+
+    merged_reads = list(merge_read_alignments(contig_reads, genome_reads, 0.8))
+
+    # the score 20 hit is below 0.8 * 50, while the supplementary alignment is kept as is
+    assert [ read.reference_start for read in merged_reads ] == [100, 3000]
+    assert merged_reads[0].is_secondary
+    assert [ read.get_tag("NH") for read in merged_reads ] == [2, 2]
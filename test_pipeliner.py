@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Tests for the PyLib Pipeliner dependency-graph scheduling.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyLib"))
+from Pipeliner import (
+    Pipeliner,
+    Command,
+    ParallelCommandList,
+    ResourcePool,
+    parse_memory_setting,
+    format_profile_report,
+    _get_cmd_programs,
+)
+
+
+def test_dependency_graph():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        pipeliner = Pipeliner(os.path.join(tmpdir, "chckpts"), num_workers=4)
+
+        a_file = os.path.join(tmpdir, "a.txt")
+        b_file = os.path.join(tmpdir, "b.txt")
+        c_file = os.path.join(tmpdir, "c.txt")
+
+        pipeliner.add_commands(
+            [
+                Command(f"echo a > {a_file}", "a.ok", outputs=[a_file]),
+                Command(f"cat {a_file} > {b_file}", "b.ok", inputs=[a_file], outputs=[b_file]),
+                Command(f"cat {a_file} > {c_file}", "c.ok", inputs=[a_file], outputs=[c_file]),
+                Command("echo barrier", "barrier.ok"),
+                Command(f"cat {b_file} {c_file}", "d.ok", inputs=[b_file, c_file]),
+            ]
+        )
+
+        deps = pipeliner._build_dependency_graph()
+        assert deps == [set(), {0}, {0}, {0, 1, 2}, {3}]
+
+        pipeliner.run()
+        assert open(c_file).read() == "a\n"
+
+
+def test_independent_stages_run_concurrently():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        pipeliner = Pipeliner(os.path.join(tmpdir, "chckpts"), num_workers=3)
+        pipeliner.add_commands(
+            [Command("sleep 1", f"sleep{i}.ok", inputs=[], outputs=[]) for i in range(3)]
+        )
+
+        start_time = time.time()
+        pipeliner.run()
+        assert time.time() - start_time < 2.5
+
+
+def test_resource_pool_packing():
+
+    assert parse_memory_setting("4G") == 4 * 1024**3
+    assert parse_memory_setting("500M") == 500 * 1024**2
+
+    pool = ResourcePool(max_cpu=8, max_memory="32G")
+    assert pool.try_acquire(4, "20G")
+    assert not pool.try_acquire(2, "20G")  # would exceed memory
+    assert pool.try_acquire(4, "4G")
+    assert not pool.try_acquire(1, None)  # cpu exhausted
+    pool.release(4, "20G")
+    assert pool.try_acquire(64, "100G") is False  # clamped to the whole machine, must wait for the rest
+    pool.release(4, "4G")
+    assert pool.try_acquire(64, "100G")
+
+
+def test_parallel_command_list_memory_budget():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        # two jobs fit by cpu, but not by memory, so they must run one after the other
+        cmdlist = [Command("sleep 1", "mem.ok", cpu=1, memory="3G") for i in range(2)]
+        para = ParallelCommandList(cmdlist, "para.ok", num_threads=4, max_memory="4G")
+
+        start_time = time.time()
+        para.run(tmpdir)
+        assert time.time() - start_time >= 2
+        assert os.path.exists(os.path.join(tmpdir, "para.ok"))
+
+
+def test_checkpoint_fingerprints_rerun_only_affected_stages():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        chckpts_dir = os.path.join(tmpdir, "chckpts")
+        align_file = os.path.join(tmpdir, "align.txt")
+        filter_file = os.path.join(tmpdir, "filter.txt")
+        log_file = os.path.join(tmpdir, "log.txt")
+
+        def build_pipeline(min_reads):
+            pipeliner = Pipeliner(chckpts_dir)
+            pipeliner.add_commands(
+                [
+                    Command(f"echo align >> {log_file} && echo reads > {align_file}", "align.ok",
+                            inputs=[], outputs=[align_file]),
+                    Command(f"echo filter{min_reads} >> {log_file} && cat {align_file} > {filter_file}", "filter.ok",
+                            inputs=[align_file], outputs=[filter_file]),
+                    Command(f"echo report >> {log_file} && cat {filter_file}", "report.ok",
+                            inputs=[filter_file], outputs=[]),
+                ]
+            )
+            return pipeliner
+
+        build_pipeline(1).run()
+        build_pipeline(1).run()
+        build_pipeline(2).run()
+
+        with open(log_file) as fh:
+            assert fh.read().split() == ["align", "filter1", "report", "filter2", "report"]
+
+
+def test_cmd_programs_include_pipelines_within_bash_c():
+
+    cmdstr = "bash -c \"set -eo pipefail; STAR --readFilesCommand 'gunzip -c' | samtools view -u - | /path/to/dedup.py -i - \""
+    assert _get_cmd_programs(cmdstr) == ["STAR", "samtools", "/path/to/dedup.py"]
+
+    cmdstr = "cd outdir && LC_ALL=C sort in.txt > out.txt 2> err.log; minimap2 -d x.mmi x.fa || echo failed"
+    assert _get_cmd_programs(cmdstr) == ["sort", "minimap2"]
+
+
+def test_checkpoint_fingerprints_rerun_on_tool_change():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        chckpts_dir = os.path.join(tmpdir, "chckpts")
+        tool = os.path.join(tmpdir, "mytool")
+        log_file = os.path.join(tmpdir, "log.txt")
+
+        def write_tool(version):
+            with open(tool, "wt") as ofh:
+                ofh.write("#!/bin/sh\necho {} >> {}\n".format(version, log_file))
+            os.chmod(tool, 0o755)
+
+        def run_pipeline():
+            pipeliner = Pipeliner(chckpts_dir)
+            # the tool runs within a pipeline of a bash -c command string
+            pipeliner.add_commands([Command(f"bash -c 'set -o pipefail; echo x | {tool}'", "tool.ok", inputs=[], outputs=[])])
+            pipeliner.run()
+
+        write_tool("v1")
+        run_pipeline()
+        run_pipeline()
+        write_tool("v2")
+        run_pipeline()
+
+        with open(log_file) as fh:
+            assert fh.read().split() == ["v1", "v2"]
+
+
+def test_profile_records():
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        pipeliner = Pipeliner(os.path.join(tmpdir, "chckpts"), profile_dir=tmpdir)
+        pipeliner.add_commands([Command("python3 -c 'sum(range(10**6))'", "busy.ok")])
+        pipeliner.run()
+
+        records = pipeliner.get_profile_records()
+        assert len(records) == 1
+        assert records[0]["stage"] == "busy.ok" and records[0]["exit_status"] == 0
+        assert records[0]["max_rss_kb"] > 0
+        assert os.path.exists(os.path.join(tmpdir, "pipeline_profile.json"))
+        assert "busy.ok" in format_profile_report(records)
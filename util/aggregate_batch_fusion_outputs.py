@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import logging
+
+sys.path.insert(0, os.path.sep.join([os.path.dirname(os.path.realpath(__file__)), "../PyLib"]))
+from BatchManifest import parse_batch_manifest
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="aggregates the per-sample FusionInspector outputs from a --batch_manifest run into a single cohort table", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--batch_manifest", type=str, required=True, help="batch manifest file (format: sample(tab)/path/left.fq(tab)/path/right.fq)")
+    parser.add_argument("--batch_output_dir", type=str, required=True, help="FusionInspector batch output directory containing the per-sample output directories")
+    parser.add_argument("--out_prefix", type=str, default="finspector", help="FusionInspector output filename prefix used for each sample")
+    parser.add_argument("--output", type=str, required=True, help="output cohort table filename")
+
+    args = parser.parse_args()
+
+    # the fastqs needn't still be around to aggregate the outputs
+    sample_names = [ sample_name for (sample_name, left_fq, right_fq) in parse_batch_manifest(args.batch_manifest, check_files=False) ]
+
+    logger.info("-there are {} sample outputs to aggregate.".format(len(sample_names)))
+
+    printed_header = False
+    with open(args.output, 'wt') as ofh:
+
+        for sample_name in sample_names:
+
+            FI_output_file = os.path.join(args.batch_output_dir, sample_name, args.out_prefix + ".FusionInspector.fusions.abridged.tsv")
+
+            if not os.path.exists(FI_output_file):
+                raise RuntimeError("Error, missing expected output file: {}".format(FI_output_file))
+
+            logger.info("-processing {}".format(FI_output_file))
+
+            with open(FI_output_file, 'rt') as fh:
+                header = next(fh).rstrip("\n").split("\t")
+                if not printed_header:
+                    # Sample placed just after the #FusionName, just like the single cell 'Cell' reporting.
+                    ofh.write("\t".join([header[0], "Sample"] + header[1:]) + "\n")
+                    printed_header = True
+
+                for line in fh:
+                    vals = line.rstrip("\n").split("\t")
+                    ofh.write("\t".join([vals[0], sample_name] + vals[1:]) + "\n")
+
+    logger.info("-done.  Wrote cohort table: {}".format(args.output))
+
+    sys.exit(0)
+
+
+if __name__=='__main__':
+    main()
@@ -4,47 +4,124 @@
 import os, sys, re
 import logging
 import argparse
+import subprocess
+import multiprocessing
+import shutil
+import heapq
 import pysam
 
-logging.basicConfig(level=logging.INFO, 
+logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s : %(levelname)s : %(message)s',
                     datefmt='%H:%M:%S')
 logger = logging.getLogger(__name__)
 
+
+## contig batches per worker, so busy contigs don't hold up the others
+BATCHES_PER_CPU = 4
+
+
 def main():
 
     parser = argparse.ArgumentParser(description="mark duplicates in bam", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument("--input_bam", "-i", dest="input_bam", required=True, type=str,
-                        help="input bam file, coordinate sorted")
+                        help="input bam file, coordinate sorted.  Use '-' to filter a coordinate-sorted bam stream (ie. from samtools sort -o -)")
 
     parser.add_argument("--output_bam", "-o", dest="output_bam", required=True, type=str,
-                        help="output bam file")
+                        help="output bam file, written along with its .bai index")
 
     parser.add_argument("--remove_dups", "-r", dest='remove_dups', action='store_true', default=False,
                         help='instead of marking duplicates, just remove them')
-    
+
+    parser.add_argument("--CPU", dest="CPU", type=int, default=1,
+                        help="number of contig workers and bgzf compression threads")
+
     args = parser.parse_args()
 
     input_bam_filename = args.input_bam
     output_bam_filename = args.output_bam
     remove_dups_flag = args.remove_dups
-    
-    bamreader = pysam.AlignmentFile(input_bam_filename, "rb")
+    num_cpu = max(1, args.CPU)
+
+    if input_bam_filename == "-":
+        bamreader = pysam.AlignmentFile("-", "rb", threads=num_cpu)
+    else:
+        bamreader = pysam.AlignmentFile(input_bam_filename, "rb")
 
     if ( ( (not 'SO' in bamreader.header.as_dict()['HD']) )
         or
         bamreader.header.as_dict()['HD']['SO'] != 'coordinate') :
         raise RuntimeError("Error, file: {} must be coordinate sorted".format(input_bam_filename))
-    
-    bamwriter =  pysam.AlignmentFile(output_bam_filename, "wb", template=bamreader)
-    
+
+
+    if bamreader.has_index():
+
+        ## each batch of contigs deduplicated in its own worker, then merged in header order
+
+        contig_batches = get_contig_batches(bamreader, num_cpu * BATCHES_PER_CPU)
+        contig_order = bamreader.references
+        bamreader.close()
+
+        parts_dir = output_bam_filename + ".parts"
+        if os.path.exists(parts_dir):
+            shutil.rmtree(parts_dir)
+        os.makedirs(parts_dir)
+
+        part_bam_filenames = [ os.path.join(parts_dir, "part_{:05d}.bam".format(i)) for i in range(len(contig_batches)) ]
+
+        jobs = [ (input_bam_filename, contigs, part_bam_filename, remove_dups_flag)
+                 for contigs, part_bam_filename in zip(contig_batches, part_bam_filenames) ]
+
+        contig_stats = dict()
+        with multiprocessing.Pool(num_cpu) as pool:
+            for batch_contig_stats in pool.imap(mark_duplicates_in_contigs, jobs):
+                contig_stats.update(batch_contig_stats)
+
+        # parts are disjoint and in header order, so merging concatenates them
+        write_indexed_bam(["samtools", "merge", "-f", "--no-PG", "-@", str(num_cpu)], output_bam_filename, part_bam_filenames)
+
+        shutil.rmtree(parts_dir)
+
+    else:
+
+        logger.info("-no index for {}, deduplicating serially".format(input_bam_filename))
+
+        if input_bam_filename != "-":
+            bamreader.close()
+            bamreader = pysam.AlignmentFile(input_bam_filename, "rb", threads=num_cpu)
+
+        samtools_proc, bamwriter = open_indexed_bam_writer(output_bam_filename, bamreader, num_cpu)
+
+        contig_stats = dict()
+        for read in mark_duplicates(bamreader, bamreader.fetch(until_eof=True), remove_dups_flag, contig_stats):
+            bamwriter.write(read)
+
+        bamwriter.close()
+        if samtools_proc.wait():
+            raise RuntimeError("Error, writing {} failed".format(output_bam_filename))
+
+        contig_order = bamreader.references
+        bamreader.close()
+
+    write_contig_stats(output_bam_filename + ".dup_stats.tsv", contig_stats, contig_order)
+
+    logger.info("Done.")
+
+    sys.exit(0)
+
+
+def mark_duplicates(bamreader, reads, remove_dups_flag, contig_stats):
+    """
+    yields the reads to be written, with duplicates marked (or removed).
+    Tallies [num_reads, num_duplicates] per contig into contig_stats.
+    """
 
     # KISS: just use the read and mate starting points
-    
+
     prev_start = -1
     prev_chrom = None
     queued_duplicate_reads = dict()
+    queued_mate_starts = list()  # heap of (mate_start, read_name), to expire queued reads whose mate start has been passed
     current_pos_mate_coords = set()
 
     def reinit_current_contig():
@@ -55,11 +132,22 @@ def main():
         reinit_current_contig()
         nonlocal queued_duplicate_reads
         queued_duplicate_reads.clear()
-        prev_start = -1
-        prev_chrom = None
-        
-        
-    for read in bamreader.fetch():
+        queued_mate_starts.clear()
+
+    def expire_queued_reads(start):
+        # coordinate sorted, so a queued read whose mate start is behind us can never be matched.
+        # Keeps memory bounded by the reads pending at the current position rather than by contig depth.
+        while queued_mate_starts and queued_mate_starts[0][0] < start:
+            mate_start, read_name = heapq.heappop(queued_mate_starts)
+            if queued_duplicate_reads.get(read_name) == mate_start:
+                del queued_duplicate_reads[read_name]
+
+
+    for read in reads:
+        if read.reference_id < 0:
+            # unplaced unmapped reads, at the end of a stream read until_eof, are left out as fetch() leaves them out of the contigs
+            continue
+
         chrom = bamreader.get_reference_name(read.reference_id)
         start = read.reference_start
         read_name = read.query_name
@@ -68,24 +156,29 @@ def main():
 
         #if read.is_secondary:  important: need to hold on to secondary reads... could be a duplicate fusion entry, still want to capture it.
         #    continue
-        
+
         if chrom != prev_chrom:
             reinit_new_contig()
+            if chrom not in contig_stats:
+                contig_stats[chrom] = [0, 0]
+            chrom_stats = contig_stats[chrom]
         elif start != prev_start:
             reinit_current_contig()
-        
+            expire_queued_reads(start)
+
         mate_start = read.next_reference_start
 
         duplicate_flag = False
-        
+
         if read_name in queued_duplicate_reads and queued_duplicate_reads[read_name] == start:
             # mark as duplicate
             duplicate_flag = True
             del queued_duplicate_reads[read_name]
-        
+
         elif mate_start > start and mate_start in current_pos_mate_coords:
             # mark this read as a duplicate
             queued_duplicate_reads[read_name] = mate_start
+            heapq.heappush(queued_mate_starts, (mate_start, read_name))
             duplicate_flag = True
 
         else:
@@ -93,21 +186,105 @@ def main():
             # store mate coord in case we find others w/ similar read and mate starts
             current_pos_mate_coords.add(mate_start)
 
+        chrom_stats[0] += 1
 
         # output read alignment.
         if duplicate_flag:
             read.is_duplicate = True
+            chrom_stats[1] += 1
 
         if (not duplicate_flag) or (duplicate_flag and not remove_dups_flag):
-            bamwriter.write(read)
-            
+            yield read
+
         prev_chrom = chrom
         prev_start = start
 
 
-    logger.info("Done.")
-    
-    sys.exit(0)
+def get_contig_batches(bamreader, num_batches):
+    """
+    consecutive contigs in header order, balanced by their mapped read counts
+    """
+
+    contig_counts = [ (stat.contig, stat.mapped + stat.unmapped) for stat in bamreader.get_index_statistics() ]
+    contig_counts = [ (contig, count) for (contig, count) in contig_counts if count > 0 ]
+
+    total_count = sum([ count for (contig, count) in contig_counts ])
+    num_batches = max(1, min(num_batches, len(contig_counts)))
+    batch_target = total_count / num_batches
+
+    contig_batches = [ [] ]
+    batch_count = 0
+    for contig, count in contig_counts:
+        if batch_count >= batch_target and len(contig_batches) < num_batches:
+            contig_batches.append([])
+            batch_count = 0
+        contig_batches[-1].append(contig)
+        batch_count += count
+
+    return contig_batches
+
+
+def mark_duplicates_in_contigs(job):
+
+    (input_bam_filename, contigs, part_bam_filename, remove_dups_flag) = job
+
+    contig_stats = dict()
+
+    bamreader = pysam.AlignmentFile(input_bam_filename, "rb")
+    # uncompressed, since compressed just once when merged
+    bamwriter = pysam.AlignmentFile(part_bam_filename, "wbu", template=bamreader)
+
+    for contig in contigs:
+        for read in mark_duplicates(bamreader, bamreader.fetch(contig), remove_dups_flag, contig_stats):
+            bamwriter.write(read)
+
+    bamwriter.close()
+    bamreader.close()
+
+    return contig_stats
+
+
+def write_indexed_bam(samtools_cmd, output_bam_filename, input_filenames):
+    """
+    runs the samtools command writing the bam and its .bai index in the same pass
+    """
+
+    cmd = samtools_cmd + [ "--write-index", output_bam_filename + "##idx##" + output_bam_filename + ".bai" ] + input_filenames
+
+    logger.info("CMD: {}".format(" ".join(cmd)))
+    subprocess.check_call(cmd)
+
+    return
+
+
+def open_indexed_bam_writer(output_bam_filename, template_bamreader, num_cpu):
+    """
+    returns the samtools process and a pysam writer streaming into it, compressed and indexed by samtools
+    """
+
+    cmd = [ "samtools", "view", "-b", "--no-PG", "-@", str(num_cpu), "--write-index",
+            "-o", output_bam_filename + "##idx##" + output_bam_filename + ".bai", "-" ]
+
+    logger.info("CMD: {}".format(" ".join(cmd)))
+    samtools_proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    bamwriter = pysam.AlignmentFile(samtools_proc.stdin, "wbu", template=template_bamreader)
+
+    return samtools_proc, bamwriter
+
+
+def write_contig_stats(stats_filename, contig_stats, contig_order):
+
+    with open(stats_filename, "wt") as ofh:
+        print("\t".join(["contig", "num_reads", "num_duplicates", "duplicate_rate"]), file=ofh)
+
+        # header order
+        for contig in contig_order:
+            if contig in contig_stats:
+                num_reads, num_duplicates = contig_stats[contig]
+                print("\t".join([contig, str(num_reads), str(num_duplicates), "{:.4f}".format(num_duplicates / num_reads)]), file=ofh)
+
+    return
 
 
 if __name__=='__main__':
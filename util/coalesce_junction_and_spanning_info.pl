@@ -6,17 +6,20 @@ use FindBin;
 use Carp;
 use lib ("$FindBin::Bin/../PerlLib");
 use DelimParser;
+use Read_name_dict;
 use Data::Dumper;
 
 my $PSEUDOCOUNT = 0;
 
-my $usage = "\n\tusage: $0 junction_info_A.txt,[junction_info_B.txt,...] spanning_info_A.txt,[spanning_info_B.txt,...] [PSEUDOCOUNT=$PSEUDOCOUNT]\n\n";
+my $usage = "\n\tusage: $0 junction_info_A.txt,[junction_info_B.txt,...] spanning_info_A.txt,[spanning_info_B.txt,...] [PSEUDOCOUNT=$PSEUDOCOUNT] [read_names.dict]\n\n"
+    . "\t\tread_names.dict: (optional) write the read lists as interned read ids, with the read names stored once in this file\n\n";
 
 my $junction_info_file_list = $ARGV[0] or die $usage;
 my $spanning_info_file_list = $ARGV[1] or die $usage;
 if ($ARGV[2]) {
     $PSEUDOCOUNT = $ARGV[2];
 }
+my $read_names_dict_file = $ARGV[3];
 
 
 main: {
@@ -47,6 +50,11 @@ main: {
     
     my $tab_writer = new DelimParser::Writer(*STDOUT, "\t", \@fields);
 
+    my $read_name_dict;
+    if ($read_names_dict_file) {
+        $read_name_dict = new Read_name_dict();
+    }
+
     foreach my $fusion (keys %fusion_info) {
 
         
@@ -101,6 +109,17 @@ main: {
             
         my ($geneA_symbol, @restA) = split(/\^/, $geneA);
         my ($geneB_symbol, @restB) = split(/\^/, $geneB);
+
+        my %read_lists = (JunctionReads => join(",", @junction_reads),
+                          SpanningFrags => join(",", @spanning_reads),
+                          CounterFusionLeftReads => join(",", @left_contrary_reads),
+                          CounterFusionRightReads => join(",", @right_contrary_reads),
+            );
+        if ($read_name_dict) {
+            foreach my $read_list_type (keys %read_lists) {
+                $read_lists{$read_list_type} = $read_name_dict->encode_read_list($read_lists{$read_list_type});
+            }
+        }
         
         $tab_writer->write_row( { 
 
@@ -115,19 +134,21 @@ main: {
             JunctionReadCount => $num_junction_reads,
             SpanningFragCount => $num_spanning_reads,
             LargeAnchorSupport => $has_large_anchor_junction_support,
-            JunctionReads => join(",", @junction_reads),
-            SpanningFrags => join(",", @spanning_reads),
+            JunctionReads => $read_lists{JunctionReads},
+            SpanningFrags => $read_lists{SpanningFrags},
             NumCounterFusionLeft => $num_left_contrary_reads,
-            CounterFusionLeftReads => join(",", @left_contrary_reads),
+            CounterFusionLeftReads => $read_lists{CounterFusionLeftReads},
             NumCounterFusionRight => $num_right_contrary_reads,
-            CounterFusionRightReads => join(",", @right_contrary_reads),
+            CounterFusionRightReads => $read_lists{CounterFusionRightReads},
             FAR_left => $FAR_left,
             FAR_right => $FAR_right,
                                 } );
         
     }
     
-    
+    if ($read_name_dict) {
+        $read_name_dict->write_dict_file($read_names_dict_file);
+    }
 
     exit(0);
 }
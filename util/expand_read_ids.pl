@@ -0,0 +1,47 @@
+#!/usr/bin/env perl
+
+use strict;
+use warnings;
+use FindBin;
+use lib ("$FindBin::Bin/../PerlLib");
+use DelimParser;
+use Read_name_dict;
+
+my $usage = "\n\tusage: $0 read_names.dict fusions.tsv\n\n"
+    . "\t\trestores the read names in the read list columns of a fusions table whose reads were interned\n"
+    . "\t\tas ids (by coalesce_junction_and_spanning_info.pl).  Use '-' to read the table from stdin.\n\n";
+
+my $read_names_dict_file = $ARGV[0] or die $usage;
+my $fusions_file = $ARGV[1] or die $usage;
+
+my @READ_LIST_COLUMNS = ("JunctionReads", "SpanningFrags", "CounterFusionLeftReads", "CounterFusionRightReads");
+
+main: {
+
+    my $read_name_dict = new Read_name_dict($read_names_dict_file);
+
+    my $fh;
+    if ($fusions_file eq "-") {
+        $fh = *STDIN;
+    }
+    else {
+        open ($fh, $fusions_file) or die "Error, cannot open file $fusions_file";
+    }
+
+    my $tab_reader = new DelimParser::Reader($fh, "\t");
+
+    my @column_headers = $tab_reader->get_column_headers();
+    my %is_column = map { $_ => 1 } @column_headers;
+    my @read_list_columns = grep { $is_column{$_} } @READ_LIST_COLUMNS;
+
+    my $tab_writer = new DelimParser::Writer(*STDOUT, "\t", \@column_headers);
+
+    while (my $row = $tab_reader->get_row()) {
+        foreach my $read_list_column (@read_list_columns) {
+            $row->{$read_list_column} = $read_name_dict->decode_read_list($row->{$read_list_column});
+        }
+        $tab_writer->write_row($row);
+    }
+
+    exit(0);
+}
@@ -0,0 +1,398 @@
+#!/usr/bin/env perl
+
+use strict;
+use warnings;
+use Carp;
+
+use FindBin;
+use lib ("$FindBin::Bin/../PerlLib");
+use Checkpoint_stamp;
+use Getopt::Long qw(:config posix_default no_ignore_case bundling pass_through);
+
+
+my $MIN_ALIGN_PER_ID = 96;
+my $CPU = 1;
+
+my $usage = <<__EOUSAGE__;
+
+###############################################################
+#
+# Extracts the fusion junction and spanning read evidence, decoding the bam just once.
+#
+# Required:
+#
+#  --gtf_file <string>         genePairContig.gtf
+#  --bam <string>              read_alignments.bam
+#  --genome_lib_dir <string>   genome_lib_dir
+#
+# Optional:
+#
+#  --CPU <int>                 number of fusion contig groups examined in parallel (default: $CPU)
+#  --MIN_ALIGN_PER_ID <int>    default: $MIN_ALIGN_PER_ID
+#  --no_seq_sim_filter         exclude the seq-similarity evidence filtering
+#  --ignore_num_hits           ignore filtering of reads based on number of hits
+#  --read_align_counts_idx <string>  read alignment counts from index_read_alignment_counts.pl
+#                              (default: bam.read_align_counts.idx, built here if lacking its .ok checkpoint)
+#  --keep_decoded_sam          retain the decoded per-group fusion contig alignments (bam.evidence_parts/part_*.bam)
+#
+# Writes:
+#
+#   bam.fusion_junction_info  and  bam.fusion_junc_reads.sam
+#   bam.fusion_spanning_info  and  bam.fusion_span_reads.sam  (including the counter-fusion reads)
+#
+# If the bam is indexed, only the fusion contig regions are fetched and decoded.
+#
+##############################################################
+
+
+__EOUSAGE__
+
+    ;
+
+
+my $help_flag;
+my $gtf_file;
+my $bam_file;
+my $genome_lib_dir;
+my $no_seq_sim_filter = 0;
+my $ignore_num_hits = 0;
+my $keep_decoded_sam = 0;
+my $align_counts_idx_file;
+
+&GetOptions('help|h' => \$help_flag,
+            'gtf_file=s' => \$gtf_file,
+            'bam=s' => \$bam_file,
+            'genome_lib_dir=s' => \$genome_lib_dir,
+            'CPU=i' => \$CPU,
+            'MIN_ALIGN_PER_ID=i' => \$MIN_ALIGN_PER_ID,
+            'no_seq_sim_filter' => \$no_seq_sim_filter,
+            'ignore_num_hits' => \$ignore_num_hits,
+            'keep_decoded_sam' => \$keep_decoded_sam,
+            'read_align_counts_idx=s' => \$align_counts_idx_file,
+    );
+
+if ($help_flag) {
+    die $usage;
+}
+
+unless ($gtf_file && $bam_file && $genome_lib_dir) {
+    die $usage;
+}
+
+if ($CPU < 1) {
+    $CPU = 1;
+}
+
+$align_counts_idx_file ||= "$bam_file.read_align_counts.idx";
+
+
+main: {
+
+    my $parts_dir = "$bam_file.evidence_parts";
+    if (-d $parts_dir) {
+        &process_cmd("rm -rf $parts_dir");
+    }
+    mkdir($parts_dir) or die "Error, cannot mkdir $parts_dir";
+
+    # rebuilt whenever the bam has been regenerated since it was indexed
+    unless (&Checkpoint_stamp::is_checkpoint_current("$align_counts_idx_file.ok", $bam_file)) {
+        &process_cmd("$FindBin::Bin/index_read_alignment_counts.pl --bam $bam_file --gtf_file $gtf_file "
+                     . " --output $align_counts_idx_file --CPU $CPU");
+    }
+
+    ## partition the fusion contigs into groups of consecutive contigs, in bam order, balanced by their read counts.
+    my @contig_groups = &get_fusion_contig_groups($bam_file, $gtf_file, $CPU);
+
+    my %contig_to_group_idx;
+    for (my $i = 0; $i <= $#contig_groups; $i++) {
+        foreach my $contig (@{$contig_groups[$i]}) {
+            $contig_to_group_idx{$contig} = $i;
+        }
+    }
+
+    ## single decoding pass:  write each group's alignments.
+    ## The parts are written as bam, so the evidence extractors' region and flag filters run in samtools
+    ## and the discarded records are never parsed in perl.
+
+    my $bam_header = `samtools view -H $bam_file`;
+    if ($?) {
+        die "Error, samtools view -H $bam_file exited with ret $?";
+    }
+
+    my @group_ofhs;
+    for (my $i = 0; $i <= $#contig_groups; $i++) {
+        my $part_bam = "$parts_dir/part_$i.bam";
+        open(my $ofh, "| samtools view -u -o $part_bam -") or die "Error, cannot write to $part_bam";
+        print $ofh $bam_header;
+        push (@group_ofhs, $ofh);
+    }
+
+    my $samtools_view_cmd;
+    if (-s "$bam_file.bai") {
+        # only the fusion contig regions, never the genome-wide alignments
+        my @regions = map { @$_ } @contig_groups;
+        $samtools_view_cmd = (@regions) ? "samtools view -@ $CPU $bam_file " . join(" ", map { "'$_'" } @regions) : undef;
+    }
+    else {
+        $samtools_view_cmd = "samtools view -@ $CPU $bam_file";
+    }
+
+    if ($samtools_view_cmd) {
+        print STDERR "-decoding $bam_file\n";
+        open(my $fh, "$samtools_view_cmd |") or die "Error, cannot run $samtools_view_cmd";
+        while (my $line = <$fh>) {
+            my (undef, undef, $contig) = split(/\t/, $line, 4);
+            my $group_idx = $contig_to_group_idx{$contig};
+            unless (defined $group_idx) { next; } # only the fusion contigs are examined
+
+            print { $group_ofhs[$group_idx] } $line;
+        }
+        close $fh;
+        if ($?) {
+            die "Error, $samtools_view_cmd exited with ret $?";
+        }
+    }
+    foreach my $ofh (@group_ofhs) {
+        close $ofh;
+        if ($?) {
+            die "Error, writing the decoded part bams exited with ret $?";
+        }
+    }
+
+    my @part_prefixes = map { "$parts_dir/part_$_" } (0..$#contig_groups);
+
+    if (-s "$bam_file.bai") {
+        # the regions were fetched in coordinate order, so the parts are sorted and can be region-fetched too
+        foreach my $part_prefix (@part_prefixes) {
+            &process_cmd("samtools index $part_prefix.bam");
+        }
+    }
+
+
+    my $read_filter_settings = " --read_align_counts_idx $align_counts_idx_file ";
+    $read_filter_settings .= " --no_seq_sim_filter " if $no_seq_sim_filter;
+    $read_filter_settings .= " --ignore_num_hits " if $ignore_num_hits;
+
+    ## junction reads, each contig group in parallel
+    my @junction_cmds;
+    foreach my $part_prefix (@part_prefixes) {
+        push (@junction_cmds, "$FindBin::Bin/get_fusion_JUNCTION_reads_from_fusion_contig_bam.pl "
+              . " --gtf_file $gtf_file --MIN_ALIGN_PER_ID $MIN_ALIGN_PER_ID --bam $part_prefix --sam $part_prefix.bam "
+              . " --genome_lib_dir $genome_lib_dir $read_filter_settings "
+              . " > $part_prefix.fusion_junc_reads.sam");
+    }
+    &run_parallel_cmds(@junction_cmds);
+
+    &merge_junction_info_files("$bam_file.fusion_junction_info", map { "$_.fusion_junction_info" } @part_prefixes);
+    &concatenate_files("$bam_file.fusion_junc_reads.sam", 0, map { "$_.fusion_junc_reads.sam" } @part_prefixes);
+
+    ## spanning reads, given all junction reads and breakpoints
+    my @spanning_cmds;
+    foreach my $part_prefix (@part_prefixes) {
+        push (@spanning_cmds, "$FindBin::Bin/get_fusion_SPANNING_reads_from_bam.from_chim_summary.pl "
+              . " --gtf_file $gtf_file --MIN_ALIGN_PER_ID $MIN_ALIGN_PER_ID --bam $part_prefix --sam $part_prefix.bam "
+              . " --junction_info $bam_file.fusion_junction_info "
+              . " --genome_lib_dir $genome_lib_dir $read_filter_settings "
+              . " > $part_prefix.fusion_span_reads.sam");
+    }
+    &run_parallel_cmds(@spanning_cmds);
+
+    &concatenate_files("$bam_file.fusion_spanning_info", 1, map { "$_.fusion_spanning_info" } @part_prefixes);
+    &concatenate_files("$bam_file.fusion_span_reads.sam", 0, map { "$_.fusion_span_reads.sam" } @part_prefixes);
+    &concatenate_files("$bam_file.failed_reads_during_span_analysis", 0, map { "$_.failed_reads_during_span_analysis" } @part_prefixes);
+
+    unless ($keep_decoded_sam) {
+        &process_cmd("rm -rf $parts_dir");
+    }
+
+    exit(0);
+}
+
+
+####
+sub get_fusion_contig_groups {
+    my ($bam_file, $gtf_file, $num_groups) = @_;
+
+    my %gtf_contigs;
+    open(my $fh, $gtf_file) or die "Error, cannot open $gtf_file";
+    while (<$fh>) {
+        if (/^\#/) { next; }
+        my ($contig) = split(/\t/);
+        if ($contig =~ /\-\-/) {
+            $gtf_contigs{$contig} = 1;
+        }
+    }
+    close $fh;
+
+    ## fusion contigs in bam order, weighted by their read counts if the bam is indexed
+    my @contigs;
+    my %contig_num_reads;
+    if (-s "$bam_file.bai") {
+        open(my $fh, "samtools idxstats $bam_file |") or die "Error, cannot run samtools idxstats $bam_file";
+        while (<$fh>) {
+            chomp;
+            my ($contig, $len, $num_mapped, $num_unmapped) = split(/\t/);
+            if ($gtf_contigs{$contig} && $num_mapped + $num_unmapped > 0) {
+                push (@contigs, $contig);
+                $contig_num_reads{$contig} = $num_mapped + $num_unmapped;
+            }
+        }
+        close $fh;
+        if ($?) {
+            die "Error, samtools idxstats $bam_file exited with ret $?";
+        }
+    }
+    else {
+        open(my $fh, "samtools view -H $bam_file |") or die "Error, cannot run samtools view -H $bam_file";
+        while (<$fh>) {
+            if (/^\@SQ\t.*SN:(\S+)/ && $gtf_contigs{$1}) {
+                push (@contigs, $1);
+                $contig_num_reads{$1} = 1;
+            }
+        }
+        close $fh;
+        if ($?) {
+            die "Error, samtools view -H $bam_file exited with ret $?";
+        }
+    }
+
+    my $total_reads = 0;
+    foreach my $contig (@contigs) {
+        $total_reads += $contig_num_reads{$contig};
+    }
+
+    if ($num_groups > scalar(@contigs)) {
+        $num_groups = scalar(@contigs) || 1;
+    }
+
+    ## consecutive contigs, so concatenating the group outputs keeps the bam order
+    my @contig_groups = ([]);
+    my $group_reads = 0;
+    my $group_target = $total_reads / $num_groups;
+    foreach my $contig (@contigs) {
+        if ($group_reads >= $group_target && scalar(@contig_groups) < $num_groups) {
+            push (@contig_groups, []);
+            $group_reads = 0;
+        }
+        push (@{$contig_groups[$#contig_groups]}, $contig);
+        $group_reads += $contig_num_reads{$contig};
+    }
+
+    print STDERR "-examining " . scalar(@contigs) . " fusion contigs in " . scalar(@contig_groups) . " groups\n";
+
+    return(@contig_groups);
+}
+
+
+####
+sub run_parallel_cmds {
+    my @cmds = @_;
+
+    my %pid_to_cmd;
+    foreach my $cmd (@cmds) {
+        print STDERR "CMD: $cmd\n";
+        my $pid = fork();
+        unless (defined $pid) {
+            die "Error, cannot fork";
+        }
+        if ($pid == 0) {
+            exec("/bin/sh", "-c", $cmd) or die "Error, cannot exec $cmd";
+        }
+        $pid_to_cmd{$pid} = $cmd;
+    }
+
+    my @failed_cmds;
+    while (%pid_to_cmd) {
+        my $pid = waitpid(-1, 0);
+        if ($pid < 0) { last; }
+        my $cmd = delete $pid_to_cmd{$pid};
+        if ($?) {
+            push (@failed_cmds, "$cmd (ret $?)");
+        }
+    }
+
+    if (@failed_cmds) {
+        die "Error, cmds failed:\n" . join("\n", @failed_cmds) . "\n";
+    }
+
+    return;
+}
+
+
+####
+sub merge_junction_info_files {
+    my ($merged_file, @info_files) = @_;
+
+    ## reordered by decreasing JunctionReadCount as in the per-group files
+
+    my $header;
+    my @rows;
+    foreach my $info_file (@info_files) {
+        open(my $fh, $info_file) or die "Error, cannot open $info_file";
+        my $file_header = <$fh>;
+        $header = $file_header unless defined $header;
+        while (<$fh>) {
+            push (@rows, $_);
+        }
+        close $fh;
+    }
+
+    my @column_headers = split(/\t/, $header);
+    my ($count_idx) = grep { $column_headers[$_] eq "JunctionReadCount" } (0..$#column_headers);
+    unless (defined $count_idx) {
+        confess "Error, no JunctionReadCount column in $info_files[0]";
+    }
+
+    my @counts = map { (split(/\t/, $_))[$count_idx] } @rows;
+    my @row_order = sort { $counts[$b] <=> $counts[$a] || $a <=> $b } (0..$#rows);
+
+    open(my $ofh, ">$merged_file") or die "Error, cannot write to $merged_file";
+    print $ofh $header;
+    foreach my $i (@row_order) {
+        print $ofh $rows[$i];
+    }
+    close $ofh;
+
+    return;
+}
+
+
+####
+sub concatenate_files {
+    my ($merged_file, $has_header, @files) = @_;
+
+    open(my $ofh, ">$merged_file") or die "Error, cannot write to $merged_file";
+    my $header;
+    foreach my $file (@files) {
+        open(my $fh, $file) or die "Error, cannot open $file";
+        if ($has_header) {
+            my $file_header = <$fh>;
+            if (! defined $header && defined $file_header) {
+                $header = $file_header;
+                print $ofh $header;
+            }
+        }
+        while (<$fh>) {
+            print $ofh $_;
+        }
+        close $fh;
+    }
+    close $ofh;
+
+    return;
+}
+
+
+####
+sub process_cmd {
+    my ($cmd) = @_;
+
+    print STDERR "CMD: $cmd\n";
+
+    my $ret = system($cmd);
+    if ($ret) {
+        die "Error, cmd: $cmd died with ret ($ret)";
+    }
+
+    return;
+}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import logging
+
+sys.path.insert(0, os.path.sep.join([os.path.dirname(os.path.realpath(__file__)), "../PyLib"]))
+from FusionEM import FusionEM
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="adds EM-adjusted junction and spanning counts (est_J, est_S) to the fusions table, as fusion_EM_runner.pl, writing to stdout", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("fusions_tsv", type=str, help="fusions table with JunctionReads and SpanningFrags columns")
+
+    args = parser.parse_args()
+
+    fusion_em = FusionEM()
+
+    rows = list()
+
+    with open(args.fusions_tsv, "rt") as fh:
+        column_headers = next(fh).rstrip("\n").split("\t")
+
+        for line in fh:
+            vals = line.rstrip("\n").split("\t")
+            if len(vals) != len(column_headers):
+                raise RuntimeError("Error, line: [{}] is lacking {} fields".format(line, len(column_headers)))
+            row = dict(zip(column_headers, vals))
+            rows.append(row)
+
+            fusion_isoform_name = "::".join([row["#FusionName"], row["LeftGene"], row["LeftBreakpoint"], row["RightGene"], row["RightBreakpoint"]])
+            row["fusion_isoform_name"] = fusion_isoform_name
+
+            junction_reads = list()
+            if row["JunctionReads"] not in (".", ""):
+                junction_reads = [ re.sub("/[12]$", "", junction_read) for junction_read in row["JunctionReads"].split(",") ]
+
+            spanning_frags = list()
+            if row["SpanningFrags"] not in (".", ""):
+                spanning_frags = row["SpanningFrags"].split(",")
+
+            fusion_em.add_fusion_transcript(fusion_isoform_name, junction_reads, spanning_frags)
+
+    fusion_em.run()
+
+    ## output with estimated J and S vals
+
+    adjusted_column_headers = column_headers
+    if "est_J" not in adjusted_column_headers:
+        adjusted_column_headers = column_headers[0:3] + ["est_J", "est_S"] + column_headers[3:]
+
+    sys.stdout.write("\t".join(adjusted_column_headers) + "\n")
+    for row in rows:
+        est_J, est_S = fusion_em.get_fusion_estimated_J_S(row["fusion_isoform_name"])
+        row["est_J"] = "{:.2f}".format(est_J)
+        row["est_S"] = "{:.2f}".format(est_S)
+
+        sys.stdout.write("\t".join([row[column_header] for column_header in adjusted_column_headers]) + "\n")
+
+    sys.exit(0)
+
+
+if __name__=='__main__':
+    main()
@@ -10,10 +10,14 @@ use lib ("$FindBin::Bin/../PerlLib");
 use Nuc_translator;
 use Overlap_piler;
 use Data::Dumper;
-use Fasta_reader;
+use Fasta_faidx_reader;
+use TiedHash;
+use Checkpoint_stamp;
+use File::Basename;
 
 my $max_intron_length = 1000;
 my $genome_flank_size = 1000;
+my $CPU = 1;
 
 my $usage = <<__EOUSAGE__;
 
@@ -37,6 +41,8 @@ my $usage = <<__EOUSAGE__;
 #
 #  --out_prefix <string>            output prefix for output files (gtf and fasta) default: geneMergeContig.\${process_id}
 #
+#  --CPU <int>                      number of workers building the fusion contigs (default: $CPU)
+#
 ###############################################################################################
 
 
@@ -67,6 +73,8 @@ my $top_candidates_only = 0; # for troubleshooting
               
               'out_prefix=s' => \$out_prefix,
               
+              'CPU=i' => \$CPU,
+              
               'top_candidates_only=i' => \$top_candidates_only,
 
     );
@@ -84,11 +92,8 @@ main: {
 
     my @chim_pairs;
 
-    print STDERR "-loading genome from $genome_fasta_file...";
-    my $fasta_reader = new Fasta_reader($genome_fasta_file);
-    my %genome_seqs = $fasta_reader->retrieve_all_seqs_hash();
-    my $genome_seqs_href = \%genome_seqs;
-    print STDERR "done loading genome.\n\n";
+    # gene regions are read on demand via the genome's .fai index, rather than loading the whole genome.
+    my $genome_faidx_reader = new Fasta_faidx_reader($genome_fasta_file);
     
   parse_fusion_candidates: {
       
@@ -143,6 +148,12 @@ main: {
     }
     
     
+    my $gene_gtfs_idx = "$gtf_file.gene_gtfs.idx";
+    if (! &Checkpoint_stamp::is_checkpoint_current("$gene_gtfs_idx.ok", $gtf_file) && -w dirname($gtf_file)) {
+        # one-time indexing (or reindexing once the gtf changes), so later runs fetch just the fusion genes
+        &process_cmd("$FindBin::Bin/index_gene_gtfs.pl --gtf $gtf_file --output $gene_gtfs_idx");
+    }
+    
     my %gene_to_gtf = &extract_gene_gtfs($gtf_file, \%genes_want);
     
     print STDERR "-splitting readthru fusions into composite genes\n";
@@ -196,11 +207,112 @@ main: {
     open (my $out_gtf_ofh, ">$out_prefix.gtf.tmp") or die "Error, cannot write to $out_prefix.gtf.tmp";
     
     my %seen;
+    my @uniq_chim_pairs;
+    foreach my $chim_pair (sort {$a->[0] cmp $b->[0]} @chim_pairs) {
+        my $chim_pair_token = join("--", @$chim_pair);
+        
+        if ($seen{$chim_pair_token}) {
+            next; 
+        }
+        $seen{$chim_pair_token}++;
+
+        push (@uniq_chim_pairs, $chim_pair);
+    }
+    
+    my $num_workers = ($CPU < scalar(@uniq_chim_pairs)) ? $CPU : scalar(@uniq_chim_pairs);
+    
+    if ($num_workers <= 1) {
+        &build_fusion_contigs(\@uniq_chim_pairs, \%gene_to_gtf, $genome_faidx_reader, $out_genome_ofh, $out_gtf_ofh);
+    }
+    else {
+        # each worker builds a consecutive block of the pairs, and the blocks are concatenated in order.
+        my $block_size = int( (scalar(@uniq_chim_pairs) + $num_workers - 1) / $num_workers);
+        my @part_prefixes;
+        my @pids;
+        for (my $i = 0; $i < $num_workers; $i++) {
+            my @block_chim_pairs = grep { defined } @uniq_chim_pairs[ ($i * $block_size) .. (($i+1) * $block_size - 1) ];
+            unless (@block_chim_pairs) { last; }
+            
+            my $part_prefix = "$out_prefix.part$i";
+            push (@part_prefixes, $part_prefix);
+            
+            my $pid = fork();
+            unless (defined $pid) {
+                die "Error, cannot fork";
+            }
+            if ($pid == 0) {
+                open (my $part_genome_ofh, ">$part_prefix.fa") or die "Error, cannot write to $part_prefix.fa";
+                open (my $part_gtf_ofh, ">$part_prefix.gtf") or die "Error, cannot write to $part_prefix.gtf";
+                &build_fusion_contigs(\@block_chim_pairs, \%gene_to_gtf, $genome_faidx_reader, $part_genome_ofh, $part_gtf_ofh);
+                close $part_genome_ofh;
+                close $part_gtf_ofh;
+                exit(0);
+            }
+            push (@pids, $pid);
+        }
+        
+        my $num_failed = 0;
+        foreach my $pid (@pids) {
+            waitpid($pid, 0);
+            if ($?) {
+                $num_failed++;
+            }
+        }
+        if ($num_failed) {
+            die "Error, $num_failed fusion contig building workers failed";
+        }
+        
+        foreach my $part_prefix (@part_prefixes) {
+            &append_file("$part_prefix.fa", $out_genome_ofh);
+            &append_file("$part_prefix.gtf", $out_gtf_ofh);
+            unlink("$part_prefix.fa", "$part_prefix.gtf");
+        }
+    }
+    
+    
+    print STDERR "Done.\n";
+    
+    close $out_genome_ofh;
+    close $out_gtf_ofh;
+
+    if (! -s "$out_prefix.fa.tmp") {
+        die "Error, no fusion contigs written";
+    }
+    else {
+        rename("$out_prefix.fa.tmp", "$out_prefix.fa");
+        rename("$out_prefix.gtf.tmp", "$out_prefix.gtf");
+    }
+
+    # index the fasta file
+    &process_cmd("samtools faidx $out_prefix.fa");
+    
+    exit(0);
+    
+
+}
+
+####
+sub build_fusion_contigs {
+    my ($chim_pairs_aref, $gene_to_gtf_href, $genome_faidx_reader, $out_genome_ofh, $out_gtf_ofh) = @_;
+    
+    # genes recur across many pairs, so each gene's contig region is built just once.
+    my %gene_to_contig_region;
+    my $get_gene_contig_region = sub {
+        my ($gene) = @_;
+        unless ($gene_to_contig_region{$gene}) {
+            my ($gene_supercontig_gtf, $gene_sequence_region) = &get_gene_contig_gtf($gene_to_gtf_href->{$gene}, $genome_faidx_reader);
+            if ($shrink_introns_flag) {
+                ($gene_supercontig_gtf, $gene_sequence_region) = &shrink_introns($gene_supercontig_gtf, $gene_sequence_region, $max_intron_length);
+            }
+            $gene_to_contig_region{$gene} = [$gene_supercontig_gtf, $gene_sequence_region];
+        }
+        return(@{$gene_to_contig_region{$gene}});
+    };
     
-    my $num_chim_pairs = scalar(@chim_pairs);
+    my $num_chim_pairs = scalar(@$chim_pairs_aref);
     my $counter = 0;
     
-    foreach my $chim_pair (sort {$a->[0] cmp $b->[0]} @chim_pairs) {
+    foreach my $chim_pair (@$chim_pairs_aref) {
 
         $counter+= 1;
         my $pct_done = sprintf("%.1f", $counter / $num_chim_pairs * 100);
@@ -209,15 +321,10 @@ main: {
 
         my $chim_pair_token = join("--", @$chim_pair);
         
-        if ($seen{$chim_pair_token}) {
-            next; 
-        }
-        $seen{$chim_pair_token}++;
-        
         my ($left_gene, $right_gene) = @$chim_pair;
         
-        my $left_gene_gtf = $gene_to_gtf{$left_gene};
-        my $right_gene_gtf = $gene_to_gtf{$right_gene};
+        my $left_gene_gtf = $gene_to_gtf_href->{$left_gene};
+        my $right_gene_gtf = $gene_to_gtf_href->{$right_gene};
         
         unless ($left_gene_gtf) {
             print STDERR "WARNING, no gtf annotations found for [$left_gene]\n";
@@ -230,16 +337,10 @@ main: {
         
         eval {
 
-            my ($left_gene_supercontig_gtf, $left_gene_sequence_region) = &get_gene_contig_gtf($left_gene_gtf, $genome_seqs_href);
+            my ($left_gene_supercontig_gtf, $left_gene_sequence_region) = &$get_gene_contig_region($left_gene);
             
-            my ($right_gene_supercontig_gtf, $right_gene_sequence_region) = &get_gene_contig_gtf($right_gene_gtf, $genome_seqs_href);
+            my ($right_gene_supercontig_gtf, $right_gene_sequence_region) = &$get_gene_contig_region($right_gene);
             
-            if ($shrink_introns_flag) {
-                ($left_gene_supercontig_gtf, $left_gene_sequence_region) = &shrink_introns($left_gene_supercontig_gtf, $left_gene_sequence_region, $max_intron_length);
-
-                ($right_gene_supercontig_gtf, $right_gene_sequence_region) = &shrink_introns($right_gene_supercontig_gtf, $right_gene_sequence_region, $max_intron_length);
-            }
-
             my $supercontig = $left_gene_sequence_region . ("N" x 1000) . $right_gene_sequence_region;
             
             $right_gene_supercontig_gtf = &adjust_gtf_coordinates($right_gene_supercontig_gtf, length($left_gene_sequence_region) + 1000);
@@ -262,28 +363,24 @@ main: {
         }
     }
     
-    
-    print STDERR "Done.\n";
-    
-    close $out_genome_ofh;
-    close $out_gtf_ofh;
+    return;
+}
 
-    if (! -s "$out_prefix.fa.tmp") {
-        die "Error, no fusion contigs written";
-    }
-    else {
-        rename("$out_prefix.fa.tmp", "$out_prefix.fa");
-        rename("$out_prefix.gtf.tmp", "$out_prefix.gtf");
-    }
 
-    # index the fasta file
-    &process_cmd("samtools faidx $out_prefix.fa");
+####
+sub append_file {
+    my ($filename, $ofh) = @_;
     
-    exit(0);
+    open (my $fh, $filename) or die "Error, cannot open file $filename";
+    while (<$fh>) {
+        print $ofh $_;
+    }
+    close $fh;
     
-
+    return;
 }
 
+
 ####
 sub shrink_introns {
     my ($gene_gtf, $gene_seq_region, $max_intron_length) = @_;
@@ -435,7 +532,7 @@ sub set_gtf_scaffold_name {
 
 ####
 sub get_gene_contig_gtf {
-    my ($gene_gtf, $genome_seqs_href) = @_;
+    my ($gene_gtf, $genome_faidx_reader) = @_;
 
     
     my ($gene_chr, $gene_lend, $gene_rend, $gene_orient, $revised_gene_gtf) = &get_gene_span_info($gene_gtf);
@@ -447,7 +544,7 @@ sub get_gene_contig_gtf {
     #print STDERR "\n\nGENE_GTF:\n$gene_gtf\n\n";
     
     
-    my $seq_region = &get_genomic_region_sequence($genome_seqs_href,
+    my $seq_region = &get_genomic_region_sequence($genome_faidx_reader,
                                                   $gene_chr, 
                                                   $gene_lend - $genome_flank_size, 
                                                   $gene_rend + $genome_flank_size,
@@ -469,7 +566,7 @@ sub get_gene_contig_gtf {
 
 #####
 sub get_genomic_region_sequence {
-    my ($genome_seqs_href, $chr, $lend, $rend, $orient) = @_;
+    my ($genome_faidx_reader, $chr, $lend, $rend, $orient) = @_;
 
     #my $cmd = "samtools faidx $fasta_file $chr:$lend-$rend";
     #my $seq = `$cmd`;
@@ -480,7 +577,7 @@ sub get_genomic_region_sequence {
     #($header, $seq) = split(/\n/, $seq, 2);
     #$seq =~ s/\s//g;
 
-    my $seq = uc substr($genome_seqs_href->{$chr}, $lend - 1, $rend - $lend + 1);
+    my $seq = uc $genome_faidx_reader->get_subseq($chr, $lend, $rend);
     
     my $seq_len = $rend - $lend + 1;
     if (length($seq) != $seq_len) {
@@ -504,7 +601,17 @@ sub extract_gene_gtfs {
     
     my %gene_to_gtf;
 
-    open (my $fh, $gtf_file) or die "Error, cannot open file $gtf_file";
+    my $fh;
+    my $gene_gtfs_idx = "$gtf_file.gene_gtfs.idx";
+    if (&Checkpoint_stamp::is_checkpoint_current("$gene_gtfs_idx.ok", $gtf_file)) {
+        # only the records of the wanted genes, rather than rescanning the full gtf.
+        # (an index left over from an earlier version of the gtf is bypassed)
+        my $gene_gtfs_text = &get_indexed_gene_gtfs($gene_gtfs_idx, $gene_want_href);
+        open ($fh, "<", \$gene_gtfs_text) or die "Error, cannot read gene gtfs from $gene_gtfs_idx";
+    }
+    else {
+        open ($fh, $gtf_file) or die "Error, cannot open file $gtf_file";
+    }
     while (<$fh>) {
         chomp;
         if (/^\#/) { next;}
@@ -582,6 +689,34 @@ sub extract_gene_gtfs {
 }
 
 
+####
+sub get_indexed_gene_gtfs {
+    my ($gene_gtfs_idx, $gene_want_href) = @_;
+
+    my $gene_gtfs_tiedhash = new TiedHash( { use => $gene_gtfs_idx } );
+
+    my %gene_ids;
+    foreach my $gene (keys %$gene_want_href) {
+        # wanted by gene_id or by gene_name
+        if (defined $gene_gtfs_tiedhash->get_value("gtf$;$gene")) {
+            $gene_ids{$gene} = 1;
+        }
+        if (my $gene_ids_txt = $gene_gtfs_tiedhash->get_value("name$;$gene")) {
+            foreach my $gene_id (split(/,/, $gene_ids_txt)) {
+                $gene_ids{$gene_id} = 1;
+            }
+        }
+    }
+
+    my $gene_gtfs_text = "";
+    foreach my $gene_id (sort { $gene_gtfs_tiedhash->get_value("order$;$a") <=> $gene_gtfs_tiedhash->get_value("order$;$b") } keys %gene_ids) {
+        $gene_gtfs_text .= $gene_gtfs_tiedhash->get_value("gtf$;$gene_id");
+    }
+
+    return($gene_gtfs_text);
+}
+
+
 ####
 sub clean_gene_GTFs {
     my ($gene_to_gtf_href) = @_;
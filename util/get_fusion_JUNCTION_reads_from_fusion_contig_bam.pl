@@ -6,6 +6,7 @@ use warnings;
 use FindBin;
 use lib ("$FindBin::Bin/../PerlLib", "$FindBin::Bin/../../PerlLib/");
 use SAM_reader;
+use Checkpoint_stamp;
 use SAM_entry;
 use DelimParser;
 use Carp;
@@ -41,6 +42,11 @@ my $usage = <<__EOUSAGE__;
 #
 # Optional:
 #
+#  --sam <string>             read the alignments from this already-decoded sam file instead of the bam
+#                             (output files are still named according to --bam)
+#  --read_align_counts_idx <string>  per-read alignment counts among fusion contigs (default: bam.read_align_counts.idx)
+#                             reused if its .ok checkpoint exists (for the default, if current with the bam)
+#
 #  --MIN_ALIGN_PER_ID <int>   default: $MIN_ALIGN_PER_ID
 #
 #  --MIN_SMALL_ANCHOR <int>   default: $MIN_SMALL_ANCHOR
@@ -65,6 +71,8 @@ __EOUSAGE__
 
 my $gtf_file;
 my $bam_file;
+my $sam_file;
+my $read_align_counts_idx;
 my $help_flag;
 my $genome_lib_dir;
 my $no_seq_sim_filter = 0;
@@ -73,6 +81,8 @@ my $ignore_num_hits = 0;
 &GetOptions('help|h' => \$help_flag,
             'gtf_file=s' => \$gtf_file,
             'bam=s' => \$bam_file,
+            'sam=s' => \$sam_file,
+            'read_align_counts_idx=s' => \$read_align_counts_idx,
             'genome_lib_dir=s' => \$genome_lib_dir,
 
 
@@ -97,6 +107,11 @@ unless ($gtf_file && $bam_file && $genome_lib_dir) {
     die $usage;
 }
 
+$sam_file ||= $bam_file;
+## a given index was checked against the bam by the caller, while the default one must be current with the bam.
+my $read_align_counts_idx_given = defined($read_align_counts_idx);
+$read_align_counts_idx ||= "$bam_file.read_align_counts.idx";
+
 
 my $BLAST_ALIGNS_IDX;
 my $blast_aligns_idx_file = "$genome_lib_dir/trans.blast.align_coords.align_coords.dbm";
@@ -128,18 +143,29 @@ main: {
     my %fusion_junctions;
     my %fusion_large_anchors;
 
-    my %sam_index_capture;
+    my @junction_read_sam_lines;
 
     my %elimination_counter;
 
     
-    my %read_alignment_counter = &count_read_alignments_among_fusion_contigs($bam_file);
+    my %read_alignment_counter;
+    my $read_alignment_counter_tiedhash;
+    my $idx_file = $read_align_counts_idx;
+    if ($read_align_counts_idx_given ? (-e "$idx_file.ok") : &Checkpoint_stamp::is_checkpoint_current("$idx_file.ok", $sam_file)) {
+        print STDERR "-reusing earlier idx: $idx_file\n";
+        $read_alignment_counter_tiedhash = new TiedHash( { 'use' => $idx_file } );
+    }
+    else {
+        %read_alignment_counter = &count_read_alignments_among_fusion_contigs($sam_file, [sort keys %scaffold_to_gene_structs]);
+    }
     
     
     my $counter = 0;
     ## find the reads that matter:
-    print STDERR "-parsing $bam_file\n";
-    my $sam_reader = new SAM_reader($bam_file);
+    print STDERR "-parsing $sam_file\n";
+    # duplicates and alignments off the fusion contig targets are dropped by samtools, never parsed here.
+    my $sam_reader = new SAM_reader($sam_file, { regions => [sort keys %scaffold_to_gene_structs],
+                                                 exclude_flags => 0x400 } );  # duplicates
     while (my $sam_entry = $sam_reader->get_next()) {
         
         if ($DEBUG) {
@@ -151,12 +177,6 @@ main: {
             print STDERR "\r[$counter]   ";
         }
 
-        if ($sam_entry->is_duplicate()) {
-            
-            if ($DEBUG) { print STDERR "-skipping duplicate mapping\n"; }
-            next;
-        }
-
         my $full_read_name = $sam_entry->reconstruct_full_read_name();
                 
         #my $qual_val = $sam_entry->get_mapping_quality();
@@ -180,10 +200,21 @@ main: {
         if ($line =~ /NH:i:(\d+)/) {
             $num_hits = $1;
         }
-        my $num_hits_on_fusion_contigs = $read_alignment_counter{$full_read_name} || 0;
+        my $num_hits_on_fusion_contigs;
+        if ($read_alignment_counter_tiedhash) {
+            # count <tab> NH, the NH being the read's largest among its fusion contig alignments
+            my $indexed_num_hits;
+            ($num_hits_on_fusion_contigs, $indexed_num_hits) = split(/\t/, $read_alignment_counter_tiedhash->get_value($full_read_name) || "0\t0");
+            if ($indexed_num_hits > $num_hits) {
+                $num_hits = $indexed_num_hits;
+            }
+        }
+        else {
+            $num_hits_on_fusion_contigs = $read_alignment_counter{$full_read_name} || 0;
+        }
         
         if (! $ignore_num_hits) {
-            if ($num_hits != $read_alignment_counter{$full_read_name}) {
+            if ($num_hits != $num_hits_on_fusion_contigs) {
                 $elimination_counter{"num_hits: $num_hits != num_counted_on_fusion_contigs $num_hits_on_fusion_contigs "}++;
                 if ($DEBUG) { print STDERR "-skipping, num hits ($num_hits) indicates not unique\n"; }
                 next;
@@ -373,7 +404,7 @@ main: {
                 
                 # calling it a fusion read.
                 $fusion_split_reads{$core_read_name} = 1;
-                $sam_index_capture{$counter} = 1;
+                push (@junction_read_sam_lines, $sam_entry->get_original_line());
 
                 if ($read_group) {
                     # encode the read group into the read name:
@@ -400,29 +431,19 @@ main: {
         
     } #end of sam reading
     
-    print STDERR "-done parsing $bam_file.  Extracting junction info.\n";
+    print STDERR "-done parsing $sam_file.  Extracting junction info.\n";
     
     print STDERR "junction read elimination tally: " . Dumper(\%elimination_counter);
         
     
 
     {
-        # capture the alignments involving identified junction / split reads:
-
-        my $sam_reader = new SAM_reader($bam_file);
-        my $counter = 0;
-        while (my $sam_entry = $sam_reader->get_next()) {
+        # report the alignments involving identified junction / split reads, captured in input order during the parse above:
 
-            $counter++;
-            
-            my $core_read_name = $sam_entry->get_core_read_name();
-            # want both reads in the pair
-            if ($fusion_split_reads{$core_read_name} && $sam_index_capture{$counter}) {
-                print $sam_entry->get_original_line() . "\n";
-            }
-            
+        foreach my $sam_line (@junction_read_sam_lines) {
+            print "$sam_line\n";
         }
-    
+        @junction_read_sam_lines = ();
     }
     
 
@@ -857,19 +878,14 @@ sub partition_gene_structs {
                                 
 ####
 sub count_read_alignments_among_fusion_contigs {
-    my ($bam_file) = @_;
+    my ($sam_file, $fusion_contigs_aref) = @_;
 
     my %alignment_counter;
 
-    my $sam_reader = new SAM_reader($bam_file);
+    # only the fusion contigs
+    my $sam_reader = new SAM_reader($sam_file, { regions => $fusion_contigs_aref } );
     while (my $sam_entry = $sam_reader->get_next()) {
         
-        # ensure on fusion contig.
-        my $contig = $sam_entry->get_scaffold_name();
-        unless ($contig =~ /\-\-/) {
-            next;
-        }
-        
         my $full_read_name = $sam_entry->reconstruct_full_read_name();
         
         $alignment_counter{$full_read_name} += 1;
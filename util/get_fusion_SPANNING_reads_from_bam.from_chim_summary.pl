@@ -7,6 +7,7 @@ use Carp;
 use FindBin;
 use lib ("$FindBin::Bin/../PerlLib");
 use SAM_reader;
+use Checkpoint_stamp;
 use SAM_entry;
 use DelimParser;
 use SeqUtil;
@@ -19,6 +20,8 @@ use Storable qw(dclone);
 
 my $gtf_file;
 my $bam_file;
+my $sam_file;
+my $read_align_counts_idx;
 my $junction_info_file;
 my $genome_lib_dir;
 
@@ -47,6 +50,11 @@ my $usage = <<__EOUSAGE__;
 #
 # Optional:
 #
+#  --sam <string>              read the alignments from this already-decoded sam file instead of the bam
+#                              (output files are still named according to --bam)
+#  --read_align_counts_idx <string>  per-read alignment counts among fusion contigs (default: bam.read_align_counts.idx)
+#                              reused if its .ok checkpoint exists (for the default, if current with the bam)
+#
 #  --MIN_ALIGN_PER_ID <int>     default: $MIN_ALIGN_PER_ID
 #  --MAX_END_CLIP <int>         default: $MAX_END_CLIP
 #  --MIN_SEQ_ENTROPY <float>    default: $MIN_SEQ_ENTROPY
@@ -75,6 +83,8 @@ my $ignore_num_hits = 0;
             
             'gtf_file=s' => \$gtf_file,
             'bam=s' => \$bam_file,
+            'sam=s' => \$sam_file,
+            'read_align_counts_idx=s' => \$read_align_counts_idx,
             'junction_info=s' => \$junction_info_file,
             'genome_lib_dir=s' => \$genome_lib_dir,
 
@@ -96,6 +106,11 @@ unless ($gtf_file && $bam_file && $junction_info_file && $genome_lib_dir) {
     die $usage;
 }
 
+$sam_file ||= $bam_file;
+## a given index was checked against the bam by the caller, while the default one must be current with the bam.
+my $read_align_counts_idx_given = defined($read_align_counts_idx);
+$read_align_counts_idx ||= "$bam_file.read_align_counts.idx";
+
 
 my %exon_bounds;
 my %orig_coord_info;
@@ -268,7 +283,7 @@ main: {
  
         print STDERR " - counting read alignments among fusion contigs.\n";
         
-        my $read_alignment_counter_tiedhash = &count_read_alignments_among_fusion_contigs($bam_file);
+        my $read_alignment_counter_tiedhash = &count_read_alignments_among_fusion_contigs($read_align_counts_idx);
         
 
         my %filtered_read_reason_counter;
@@ -282,7 +297,8 @@ main: {
         my $prev_read_align_pos = 0;
         my $read_align_pos_counter = 0;
 
-        my $sam_reader = new SAM_reader($bam_file);
+        # alignments off the fusion contig targets are dropped by samtools, never parsed here.
+        my $sam_reader = new SAM_reader($sam_file, { regions => [sort keys %scaffold_to_gene_breaks] } );
         while (my $sam_entry = $sam_reader->get_next()) {
             $counter++;
             print STDERR "\r[$counter]   " if $counter % 1000 == 0;
@@ -460,6 +476,12 @@ main: {
             
             my $full_read_name = $sam_entry->reconstruct_full_read_name();
 
+            # count <tab> NH, the NH being the read's largest among its fusion contig alignments
+            my ($fusion_scaff_hit_count, $indexed_hit_count) = split(/\t/, $read_alignment_counter_tiedhash->get_value($full_read_name) || "0\t0");
+            if ($indexed_hit_count > $hit_count) {
+                $hit_count = $indexed_hit_count;
+            }
+
             my $core = $full_read_name;
             my $pair_end = 1; # default single end
             if ($full_read_name =~ /^(\S+)\/([12])$/) {
@@ -485,7 +507,7 @@ main: {
                                                                                           qual => $qual_val,
                                                                                           full_read_name => $full_read_name,
                                                                                           NH => $hit_count,
-                                                                                          fusion_scaff_hit_count => $read_alignment_counter_tiedhash->get_value($full_read_name),
+                                                                                          fusion_scaff_hit_count => $fusion_scaff_hit_count,
                                                                                           read_group => $read_group,
                 };
             }
@@ -513,7 +535,7 @@ main: {
     
     if ($HAS_SPANNING_FRAGS) {
         
-        my $sam_reader = new SAM_reader($bam_file);
+        my $sam_reader = new SAM_reader($sam_file, { regions => [sort keys %scaffold_to_gene_breaks] } );
         while (my $sam_entry = $sam_reader->get_next()) {
                         
             my $scaffold = $sam_entry->get_scaffold_name();
@@ -931,35 +953,34 @@ sub capture_spanning_frags {
 
 ####
 sub count_read_alignments_among_fusion_contigs {
-    my ($bam_file) = @_;
+    my ($idx_file) = @_;
 
-    my $idx_file = "$bam_file.read_align_counts.idx";
     my $idx_checkpoint_file = $idx_file . ".ok";
     
-    if (-e $idx_checkpoint_file) {
+    if ($read_align_counts_idx_given ? (-e $idx_checkpoint_file) : &Checkpoint_stamp::is_checkpoint_current($idx_checkpoint_file, $sam_file)) {
         my $alignment_counter_tiedhash = new TiedHash( { 'use' => $idx_file });
         print STDERR "-reusing earlier idx: $idx_file\n";
         return ($alignment_counter_tiedhash);
     }
     
-    my $alignment_counter_tiedhash = new TiedHash( { create => "$bam_file.read_align_counts.idx" } );;
+    my $alignment_counter_tiedhash = new TiedHash( { create => $idx_file } );;
 
-    my $sam_reader = new SAM_reader($bam_file);
+    # only the fusion contigs
+    my $sam_reader = new SAM_reader($sam_file, { regions => [sort keys %scaffold_to_gene_breaks] } );
     while (my $sam_entry = $sam_reader->get_next()) {
         
-        # ensure on fusion contig.
-        my $contig = $sam_entry->get_scaffold_name();
-        unless ($contig =~ /\-\-/) {
-            next;
-        }
-        
         my $full_read_name = $sam_entry->reconstruct_full_read_name();
+        my $num_hits = ($sam_entry->get_original_line() =~ /\tNH:i:(\d+)/) ? $1 : 1;
         
-        my $curr_count = $alignment_counter_tiedhash->get_value($full_read_name) || 0;
-        $alignment_counter_tiedhash->store_key_value($full_read_name, $curr_count + 1);
+        # count <tab> NH, as index_read_alignment_counts.pl writes them
+        my ($curr_count, $max_num_hits) = split(/\t/, $alignment_counter_tiedhash->get_value($full_read_name) || "0\t0");
+        if ($num_hits > $max_num_hits) {
+            $max_num_hits = $num_hits;
+        }
+        $alignment_counter_tiedhash->store_key_value($full_read_name, ($curr_count + 1) . "\t$max_num_hits");
     }
 
-    system("touch $idx_checkpoint_file");
+    &Checkpoint_stamp::write_checkpoint($idx_checkpoint_file, $sam_file);
     
     return($alignment_counter_tiedhash);
 }
@@ -5,6 +5,9 @@ use warnings;
 use FindBin;
 use lib ("$FindBin::Bin/../PerlLib");
 use Fastq_reader;
+use SAM_reader;
+use SAM_entry;
+use Nuc_translator;
 use Process_cmd;
 use DelimParser;
 use Carp;
@@ -28,6 +31,11 @@ my $usage = <<__EOUSAGE__;
 #   or
 #     --samples_file <string>
 #
+#   and/or
+#     --bam <string>               alignments of the reads (FusionInspector's aligner bam). The evidence reads are
+#                                  written from their primary alignment records instead of rescanning the fastqs.
+#                                  Mates missing from the bam are looked up in just the fastqs (above) holding them.
+#
 #
 #  --output_prefix <string>     output prefix
 #
@@ -56,6 +64,7 @@ my $output_prefix;
 my $samples_file;
 my $BY_ISOFORM;
 my $BY_FUSION;
+my $bam_file;
 
 &GetOptions( 'help|h' => \$help_flag,
              
@@ -65,6 +74,8 @@ my $BY_FUSION;
              'right_fq=s' => \$right_fq,
              
              'samples_file=s' => \$samples_file,
+
+             'bam=s' => \$bam_file,
              
              'output_prefix=s' => \$output_prefix,
              
@@ -79,7 +90,7 @@ if ($help_flag) {
     die $usage;
 }
 
-unless ($fusion_results_file && ($left_fq  || $samples_file) && $output_prefix) {
+unless ($fusion_results_file && ($left_fq  || $samples_file || $bam_file) && $output_prefix) {
     die $usage;
 }
 
@@ -105,6 +116,9 @@ if ($BY_FUSION) {
     }
 }    
 
+# per-fusion and per-isoform fastq text, written once at the end rather than reopening a file per record
+my %fastq_file_to_buffered_text;
+
 
 main: {
 
@@ -175,12 +189,19 @@ main: {
         ($sample_names, $left_fq, $right_fq) = &parse_samples_file($samples_file);
     }
 
+
+    if ($bam_file) {
+        &write_fastq_files_from_bam($bam_file, $left_fq, $right_fq, $output_prefix, \%core_frag_name_to_fusion_name, $sample_names, \%core_frag_to_simple_fusion);
+    }
+    else {
+        &write_fastq_files($left_fq, $output_prefix, "_1", \%core_frag_name_to_fusion_name, $sample_names, \%core_frag_to_simple_fusion);
         
-    &write_fastq_files($left_fq, $output_prefix, "_1", \%core_frag_name_to_fusion_name, $sample_names, \%core_frag_to_simple_fusion);
-    
-    if ($right_fq) {
-        &write_fastq_files($right_fq, $output_prefix, "_2", \%core_frag_name_to_fusion_name, $sample_names, \%core_frag_to_simple_fusion);
+        if ($right_fq) {
+            &write_fastq_files($right_fq, $output_prefix, "_2", \%core_frag_name_to_fusion_name, $sample_names, \%core_frag_to_simple_fusion);
+        }
     }
+
+    &write_buffered_fastq_files();
     
     print STDERR "\nDone.\n\n";
     
@@ -216,52 +237,12 @@ sub write_fastq_files {
             my $record_text = $fq_record->get_fastq_record();
             chomp $record_text;
 
-            if ($BY_FUSION) {
-                if (my $simple_fusion_name = $core_frag_to_simple_fusion_href->{$core_read_name}) {
-                    open(my $fusion_reads_ofh, ">>$BY_FUSION/${simple_fusion_name}${output_fastq_file_suffix}.fq") or die "Error, cannot append to file $BY_FUSION/${simple_fusion_name}${output_fastq_file_suffix}.fq";
-                    print $fusion_reads_ofh $record_text . "\n";
-                    close $fusion_reads_ofh;
-                }
-            }
-            
-            my $fusion_instances_with_read_aref = $core_frag_name_to_fusion_name_href->{$core_read_name};
-            
-            if (ref $fusion_instances_with_read_aref) {
-                
-                my @fusion_instances = @$fusion_instances_with_read_aref;
-                
-                
-                my @lines = split(/\n/, $record_text);
-                    
-                my $reported_in_full_file = 0;
-                
-                foreach my $fusion_instance (@fusion_instances) {    
-
-                    my ($_1, $_2, $_3, $_4) = @lines;
-
-                    if ($sample_name) {
-                        # encode it in the read name:
-                        $_1 =~ s/^\@/\@\&${sample_name}\@/;
-                    }
-                    $_3 = "+$fusion_instance"; # encode the fusion name in the 3rd line, which is otherwise useless anyway
-                    
-                    unless ($reported_in_full_file) {
-                        # report in the full file only once.
-                        print $ofh join("\n", ($_1, $_2, $_3, $_4)) . "\n";
-                        $reported_in_full_file = 1;
-                    }
-                    
-                    if ($BY_ISOFORM) {
-                        my ($fusion_instance_filename, $rest) = split(/\|[JS][12]?\|/, $fusion_instance);
-                        
-                        $fusion_instance_filename =~ s/\W+/_/g; 
-                        $fusion_instance_filename =~ s/_$//;
-                        
-                        open(my $isoform_ofh, ">>$BY_ISOFORM/${fusion_instance_filename}${output_fastq_file_suffix}.fq") or die "Error, cannot append to file $BY_ISOFORM/${fusion_instance}${output_fastq_file_suffix}.fq";
-                        print $isoform_ofh join("\n", ($_1, $_2, $_3, $_4)) . "\n";
-                        close $isoform_ofh;
-                    }
-                }
+            if (ref $core_frag_name_to_fusion_name_href->{$core_read_name}) {
+
+                &report_fastq_record($ofh, $record_text, $sample_name, $output_fastq_file_suffix,
+                                     $core_frag_name_to_fusion_name_href->{$core_read_name},
+                                     $core_frag_to_simple_fusion_href->{$core_read_name});
+
                 delete $reads_to_capture{$core_read_name} if exists $reads_to_capture{$core_read_name};
             }
         }
@@ -278,6 +259,223 @@ sub write_fastq_files {
 }
 
 
+####
+sub report_fastq_record {
+    my ($ofh, $record_text, $sample_name, $output_fastq_file_suffix, $fusion_instances_aref, $simple_fusion_name) = @_;
+
+    if ($BY_FUSION && $simple_fusion_name) {
+        $fastq_file_to_buffered_text{"$BY_FUSION/${simple_fusion_name}${output_fastq_file_suffix}.fq"} .= $record_text . "\n";
+    }
+
+    my @lines = split(/\n/, $record_text);
+
+    my $reported_in_full_file = 0;
+
+    foreach my $fusion_instance (@$fusion_instances_aref) {
+
+        my ($_1, $_2, $_3, $_4) = @lines;
+
+        if ($sample_name) {
+            # encode it in the read name:
+            $_1 =~ s/^\@/\@\&${sample_name}\@/;
+        }
+        $_3 = "+$fusion_instance"; # encode the fusion name in the 3rd line, which is otherwise useless anyway
+
+        unless ($reported_in_full_file) {
+            # report in the full file only once.
+            print $ofh join("\n", ($_1, $_2, $_3, $_4)) . "\n";
+            $reported_in_full_file = 1;
+        }
+
+        if ($BY_ISOFORM) {
+            my ($fusion_instance_filename, $rest) = split(/\|[JS][12]?\|/, $fusion_instance);
+
+            $fusion_instance_filename =~ s/\W+/_/g;
+            $fusion_instance_filename =~ s/_$//;
+
+            $fastq_file_to_buffered_text{"$BY_ISOFORM/${fusion_instance_filename}${output_fastq_file_suffix}.fq"} .= join("\n", ($_1, $_2, $_3, $_4)) . "\n";
+        }
+    }
+
+    return;
+}
+
+
+####
+sub write_buffered_fastq_files {
+
+    foreach my $fastq_file (sort keys %fastq_file_to_buffered_text) {
+        open(my $ofh, ">>$fastq_file") or die "Error, cannot append to file $fastq_file";
+        print $ofh $fastq_file_to_buffered_text{$fastq_file};
+        close $ofh;
+    }
+
+    %fastq_file_to_buffered_text = ();
+
+    return;
+}
+
+
+####
+sub write_fastq_files_from_bam {
+    my ($bam_file, $left_fqs, $right_fqs, $output_prefix, $core_frag_name_to_fusion_name_href, $sample_names, $core_frag_to_simple_fusion_href) = @_;
+
+    ## the aligned records carry each read's sequence and qualities, so the evidence reads come
+    ## from the (small) bam instead of a pass over every input read.
+    
+    my %core_read_to_records;  # core_read_name => { 1 => record_text, 2 => record_text }
+    my %core_read_to_sample;
+    my %paired_reads;
+    my @core_read_names_in_order;
+
+    print STDERR "-retrieving fusion evidence reads from $bam_file\n";
+    
+    # primary records only: secondary and supplementary alignments may lack (or clip) the read sequence
+    my $sam_reader = new SAM_reader($bam_file, { exclude_flags => 0x900 });
+    while (my $sam_entry = $sam_reader->get_next()) {
+
+        my $core_read_name = $sam_entry->get_core_read_name();
+        unless (exists $core_frag_name_to_fusion_name_href->{$core_read_name}) { next; }
+
+        my $pair_end = ($sam_entry->is_second_in_pair()) ? 2 : 1;
+        if (&has_record(\%core_read_to_records, $core_read_name, $pair_end)) { next; }
+
+        my $sequence = $sam_entry->get_sequence();
+        my $quals = $sam_entry->get_quality_scores();
+        if ($sequence eq '*') { next; }
+        
+        if ($sam_entry->get_query_strand() eq '-') {
+            # restore the read as sequenced
+            $sequence = &reverse_complement($sequence);
+            $quals = reverse($quals);
+        }
+
+        unless (exists $core_read_to_records{$core_read_name}) {
+            push (@core_read_names_in_order, $core_read_name);
+        }
+        
+        $core_read_to_records{$core_read_name}->{$pair_end} = join("\n", "\@" . $sam_entry->reconstruct_full_read_name(), $sequence, "+", $quals);
+        
+        if ($sample_names && (my $read_group = $sam_entry->get_read_group()) ) {
+            $core_read_to_sample{$core_read_name} = $read_group;
+        }
+        if ($sam_entry->is_paired()) {
+            $paired_reads{$core_read_name} = 1;
+        }
+    }
+
+    ## mates the aligner didn't report: targeted lookup in only the fastqs that hold them
+    
+    my %pair_end_to_fqs = (1 => $left_fqs, 2 => $right_fqs);
+    foreach my $pair_end (1, 2) {
+        my $fqs = $pair_end_to_fqs{$pair_end} or next;
+
+        my %missing_core_read_names;
+        foreach my $core_read_name (keys %$core_frag_name_to_fusion_name_href) {
+            if (&has_record(\%core_read_to_records, $core_read_name, $pair_end)) { next; }
+            if ($pair_end == 2 && exists $core_read_to_records{$core_read_name} && ! $paired_reads{$core_read_name}) { next; }
+            $missing_core_read_names{$core_read_name} = 1;
+        }
+        unless (%missing_core_read_names) { next; }
+
+        my %fq_records = &retrieve_fastq_records_by_name($fqs, $sample_names, \%missing_core_read_names, \%core_read_to_sample);
+        foreach my $core_read_name (keys %fq_records) {
+            unless (exists $core_read_to_records{$core_read_name}) {
+                push (@core_read_names_in_order, $core_read_name);
+            }
+            $core_read_to_records{$core_read_name}->{$pair_end} = $fq_records{$core_read_name}->{record};
+            if (my $sample_name = $fq_records{$core_read_name}->{sample}) {
+                $core_read_to_sample{$core_read_name} = $sample_name;
+            }
+        }
+    }
+
+    my $num_unrecovered_mates = grep { ! &has_record(\%core_read_to_records, $_, 1) || ! &has_record(\%core_read_to_records, $_, 2) } keys %paired_reads;
+    if ($num_unrecovered_mates) {
+        print STDERR "-warning, $num_unrecovered_mates evidence reads are missing a mate that's neither in the bam nor in the fastqs given\n";
+    }
+    
+    my @missing_core_read_names = grep { ! exists $core_read_to_records{$_} } keys %$core_frag_name_to_fusion_name_href;
+    if (@missing_core_read_names) {
+        confess "Error, failed to capture fusion evidence reads: " . Dumper(\@missing_core_read_names);
+    }
+    
+    ## write the evidence fastqs
+    
+    foreach my $pair_end (1, 2) {
+
+        if ($pair_end == 2 && ! ($right_fqs || %paired_reads)) { last; }
+        
+        my $output_fastq_file_suffix = "_$pair_end";
+        my $output_fastq_file = "$output_prefix.fusion_evidence_reads${output_fastq_file_suffix}.fq";
+        open (my $ofh, ">$output_fastq_file") or die "Error, cannot write to $output_fastq_file";
+        
+        foreach my $core_read_name (@core_read_names_in_order) {
+            my $record_text = $core_read_to_records{$core_read_name}->{$pair_end} or next;
+
+            &report_fastq_record($ofh, $record_text, $core_read_to_sample{$core_read_name}, $output_fastq_file_suffix,
+                                 $core_frag_name_to_fusion_name_href->{$core_read_name},
+                                 $core_frag_to_simple_fusion_href->{$core_read_name});
+        }
+        close $ofh;
+        
+        print STDERR "\nDone writing to $output_fastq_file\n\n";
+    }
+    
+    return;
+}
+
+
+####
+sub has_record {
+    my ($core_read_to_records_href, $core_read_name, $pair_end) = @_;
+
+    # without autovivifying the read's entry
+    return( (exists $core_read_to_records_href->{$core_read_name}
+             && exists $core_read_to_records_href->{$core_read_name}->{$pair_end}) ? 1 : 0);
+}
+
+
+####
+sub retrieve_fastq_records_by_name {
+    my ($fq_files, $sample_names, $core_read_names_href, $core_read_to_sample_href) = @_;
+
+    my @samples = split(/,/, $sample_names);
+
+    my %core_read_to_fq_record;
+    
+    foreach my $fq_file (split(/,/, $fq_files)) {
+        my $sample_name = shift @samples;
+
+        # just the reads of this sample, when the bam told us which sample they're from
+        my %wanted_core_read_names;
+        foreach my $core_read_name (keys %$core_read_names_href) {
+            if (exists $core_read_to_fq_record{$core_read_name}) { next; }
+            my $read_sample_name = $core_read_to_sample_href->{$core_read_name};
+            if ($sample_name && $read_sample_name && $read_sample_name ne $sample_name) { next; }
+            $wanted_core_read_names{$core_read_name} = 1;
+        }
+        unless (%wanted_core_read_names) { next; }
+
+        print STDERR "-searching fq file: $fq_file for " . scalar(keys %wanted_core_read_names) . " reads\n";
+        
+        my $fastq_reader = new Fastq_reader($fq_file);
+        while (%wanted_core_read_names && (my $fq_record = $fastq_reader->next()) ) {
+            my $core_read_name = $fq_record->get_core_read_name();
+            if (delete $wanted_core_read_names{$core_read_name}) {
+                my $record_text = $fq_record->get_fastq_record();
+                chomp $record_text;
+                $core_read_to_fq_record{$core_read_name} = { record => $record_text,
+                                                             sample => $sample_name };
+            }
+        }
+        $fastq_reader->finish();
+    }
+
+    return(%core_read_to_fq_record);
+}
+
+
 ####
 sub append_reads_to_fusion {
     my ($fusion_name, $core_frag_name_to_fusion_name_href, $reads_href) = @_;
@@ -6,17 +6,68 @@ use warnings;
 use FindBin;
 use lib ("$FindBin::Bin/../PerlLib");
 use DelimParser;
-
-my $usage = "\n\n\tusage: $0 left.fq finspector.fusion_predictions.final.abridged\n\n";
-
-my $fq_filename = $ARGV[0] or die $usage;
-my $finspector_results = $ARGV[1] or die $usage;
+use Fragment_counter;
+use Getopt::Long qw(:config no_ignore_case bundling);
+
+my $CPU = 1;
+my $samples_file;
+my $per_sample_output;
+&GetOptions('CPU=i' => \$CPU,
+            'samples_file=s' => \$samples_file,
+            'per_sample_output=s' => \$per_sample_output,
+    );
+
+my $usage = "\n\n\tusage: $0 [--CPU $CPU] left.fq finspector.fusion_predictions.final.abridged [total_frags_file]\n\n"
+    . "\t\ttotal_frags_file: (optional) file containing the total number of frags in left.fq, if already counted,\n"
+    . "\t\t                  or the aligner's Log.final.out (STAR)\n\n"
+    . "\t\tOtherwise, left.fq is counted (decompressing with --CPU threads) just once, and cached in left.fq.fragcount\n\n"
+    . "\tor, for a samples file (format:  sample(tab)/path/left.fq(tab)/path/right.fq):\n\n"
+    . "\t\t$0 [--CPU $CPU] --samples_file samples.txt --per_sample_output per_sample.tsv finspector.fusion_predictions.tsv\n\n"
+    . "\t\tThe samples' left fastqs are counted in parallel, and each sample's junction reads and spanning frags\n"
+    . "\t\t(tagged with their read group during extraction) are reported with that sample's FFPM in the per_sample_output.\n\n";
+
+my ($fq_filename, $finspector_results, $total_frags_file);
+if ($samples_file) {
+    $finspector_results = $ARGV[0] or die $usage;
+    $per_sample_output or die $usage;
+}
+else {
+    $fq_filename = $ARGV[0] or die $usage;
+    $finspector_results = $ARGV[1] or die $usage;
+    $total_frags_file = $ARGV[2];
+}
 
 ## Require at least 100k reads before computing any FFPM value.
 
 main: {
 
-    my $num_frags = &get_num_total_frags($fq_filename);
+    my $num_frags;
+    my %sample_to_num_frags;
+    if ($samples_file) {
+        %sample_to_num_frags = &get_sample_num_frags($samples_file, $CPU);
+        $num_frags = 0;
+        foreach my $sample_num_frags (values %sample_to_num_frags) {
+            $num_frags += $sample_num_frags;
+        }
+        $fq_filename = $samples_file;
+    }
+    elsif ($total_frags_file && $total_frags_file =~ /Log\.final\.out$/) {
+        $num_frags = &Fragment_counter::get_num_input_reads_from_STAR_log($total_frags_file);
+        if ($fq_filename !~ /,/ && ! defined &Fragment_counter::get_cached_frag_count($fq_filename)) {
+            # the aligner already counted them, so later runs needn't
+            &Fragment_counter::write_frag_count_sidecar($fq_filename, $num_frags);
+        }
+    }
+    elsif ($total_frags_file) {
+        open(my $fh, $total_frags_file) or die "Error, cannot open file: $total_frags_file";
+        $num_frags = <$fh>;
+        close $fh;
+        $num_frags =~ /^\s*(\d+)/ or die "Error, cannot extract frag count from $total_frags_file";
+        $num_frags = $1;
+    }
+    else {
+        $num_frags = &Fragment_counter::get_num_total_frags($fq_filename, $CPU);
+    }
     print STDERR "-total frags in $fq_filename: $num_frags\n";
     
     open (my $fh, $finspector_results) or die "Error, cannot open file $finspector_results";
@@ -26,6 +77,13 @@ main: {
     push (@column_headers, "FFPM");
 
     my $tab_writer = new DelimParser::Writer(*STDOUT, "\t", \@column_headers);
+
+    my $per_sample_tab_writer;
+    if ($samples_file) {
+        open (my $ofh, ">$per_sample_output") or die "Error, cannot write to $per_sample_output";
+        $per_sample_tab_writer = new DelimParser::Writer($ofh, "\t", ["#FusionName", "LeftBreakpoint", "RightBreakpoint", "Sample",
+                                                                      "JunctionReadCount", "SpanningFragCount", "total_frags", "FFPM"]);
+    }
     
     while (my $row = $tab_reader->get_row()) {
 
@@ -45,6 +103,10 @@ main: {
         $row->{FFPM} = $J_FFPM + $S_FFPM;
         
         $tab_writer->write_row($row);
+
+        if ($per_sample_tab_writer) {
+            &write_per_sample_FFPM($per_sample_tab_writer, $row, \%sample_to_num_frags);
+        }
     }
     close $fh;
     
@@ -53,38 +115,74 @@ main: {
 }
 
 ####
-sub get_num_total_frags {
-    my ($fq_file) = @_;
-
-    if ($fq_file =~ /,/) {
-        my @fq_files = split(",", $fq_file);
-        my $num_fq_records = 0;
-        foreach my $fq_file (@fq_files) {
-            my $count = &get_num_total_frags($fq_file);
-            $num_fq_records += $count;
-        }
-        return($num_fq_records);
+sub get_sample_num_frags {
+    my ($samples_file, $CPU) = @_;
+
+    my %sample_to_fqs;
+    open(my $fh, $samples_file) or die "Error, cannot open file: $samples_file";
+    while (<$fh>) {
+        chomp;
+        unless (/\w/) { next; }
+        my ($sample_name, $left_fq, $right_fq) = split(/\t/);
+        push (@{$sample_to_fqs{$sample_name}}, $left_fq);
     }
-    
+    close $fh;
 
-    my $num_lines;
-    if ($fq_file =~ /\.gz/) {
-        $num_lines = `gunzip -c $fq_file | wc -l`;
-    }
-    else {
-        $num_lines = `cat $fq_file | wc -l`;
+    my @fq_files = map { @$_ } values %sample_to_fqs;
+    my %fq_to_num_frags = &Fragment_counter::get_num_frags_per_fastq(\@fq_files, $CPU);
+
+    my %sample_to_num_frags;
+    foreach my $sample_name (keys %sample_to_fqs) {
+        my $num_frags = 0;
+        foreach my $fq_file (@{$sample_to_fqs{$sample_name}}) {
+            $num_frags += $fq_to_num_frags{$fq_file};
+        }
+        $sample_to_num_frags{$sample_name} = $num_frags;
+        print STDERR "-total frags for sample $sample_name: $num_frags\n";
     }
 
-    chomp $num_lines;
-    
-    $num_lines =~ /^\s*(\d+)/ or die "Error, cannot extract line count from [$num_lines]";
-    $num_lines = $1;
+    return(%sample_to_num_frags);
+}
 
-    my $num_seq_records = $num_lines / 4;
 
-    return($num_seq_records);
+####
+sub write_per_sample_FFPM {
+    my ($per_sample_tab_writer, $row, $sample_to_num_frags_href) = @_;
+
+    # reads carry their sample's read group as:  &sample@read_name
+    my %sample_to_counts;
+    foreach my $count_type ("JunctionReads", "SpanningFrags") {
+        my $reads_list = $row->{$count_type};
+        unless (defined $reads_list) {
+            die "Error, per-sample FFPM requires the $count_type column";
+        }
+        foreach my $read_name (split(/,/, $reads_list)) {
+            if ($read_name =~ /^\&([^\@]+)\@/) {
+                $sample_to_counts{$1}->{$count_type}++;
+            }
+        }
+    }
+
+    foreach my $sample_name (sort keys %sample_to_counts) {
+        my $J = $sample_to_counts{$sample_name}->{JunctionReads} || 0;
+        my $S = $sample_to_counts{$sample_name}->{SpanningFrags} || 0;
+        my $sample_num_frags = $sample_to_num_frags_href->{$sample_name}
+            or die "Error, no frag count for sample [$sample_name] in the samples file";
+
+        $per_sample_tab_writer->write_row( { "#FusionName" => $row->{"#FusionName"},
+                                             LeftBreakpoint => $row->{LeftBreakpoint},
+                                             RightBreakpoint => $row->{RightBreakpoint},
+                                             Sample => $sample_name,
+                                             JunctionReadCount => $J,
+                                             SpanningFragCount => $S,
+                                             total_frags => $sample_num_frags,
+                                             FFPM => &compute_FFPM($J + $S, $sample_num_frags),
+                                           } );
+    }
+
+    return;
 }
-            
+
 
 ####
 sub compute_FFPM {
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import logging
+
+sys.path.insert(0, os.path.sep.join([os.path.dirname(os.path.realpath(__file__)), "../PyLib"]))
+from BamReadNameIndex import build_bam_read_name_index, get_index_filename
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="builds a read-name index (bam.rni) for random-access retrieval of reads by name", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--bam", type=str, required=True, help="input bam file")
+    parser.add_argument("--output", type=str, default=None, help="output index file (default: bam.rni)")
+
+    args = parser.parse_args()
+
+    index_filename = args.output if args.output else get_index_filename(args.bam)
+
+    build_bam_read_name_index(args.bam, index_filename)
+
+    sys.exit(0)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env perl
+
+use strict;
+use warnings;
+use Carp;
+
+use FindBin;
+use lib ("$FindBin::Bin/../PerlLib");
+use TiedHash;
+use Checkpoint_stamp;
+use Fcntl qw(:flock);
+use Getopt::Long qw(:config posix_default no_ignore_case bundling pass_through);
+
+
+my $usage = <<__EOUSAGE__;
+
+###############################################################
+#
+# Indexes the exon and CDS records of each gene, so that contig construction
+# fetches just the fusion genes instead of rescanning the whole annotation.
+#
+# Required:
+#
+#  --gtf <string>              ref_annot.gtf
+#
+# Optional:
+#
+#  --output <string>           output index (default: gtf.gene_gtfs.idx)
+#
+# Writes a TiedHash (DB_File btree) with keys:
+#    gtf<sep>gene_id      : the gene's exon and CDS records, in file order
+#    order<sep>gene_id    : the gene's rank in the gtf file
+#    name<sep>gene_name   : the gene_ids with that gene_name, comma-delimited
+# and its .ok checkpoint (recording the gtf size and mtime) once complete.
+# Built once, and reused by every run until the gtf changes.
+#
+##############################################################
+
+
+__EOUSAGE__
+
+    ;
+
+
+my $help_flag;
+my $gtf_file;
+my $idx_file;
+
+&GetOptions('help|h' => \$help_flag,
+            'gtf=s' => \$gtf_file,
+            'output=s' => \$idx_file,
+    );
+
+if ($help_flag) {
+    die $usage;
+}
+
+unless ($gtf_file) {
+    die $usage;
+}
+
+$idx_file ||= "$gtf_file.gene_gtfs.idx";
+
+
+main: {
+
+    if (&Checkpoint_stamp::is_checkpoint_current("$idx_file.ok", $gtf_file)) {
+        print STDERR "-gene gtf index $idx_file already built\n";
+        exit(0);
+    }
+
+    # concurrent runs wait on the one build
+    open(my $lock_fh, ">", "$idx_file.lock") or die "Error, cannot write to $idx_file.lock";
+    flock($lock_fh, LOCK_EX) or die "Error, cannot lock $idx_file.lock";
+
+    if (&Checkpoint_stamp::is_checkpoint_current("$idx_file.ok", $gtf_file)) {
+        exit(0);
+    }
+
+    # stale, from an earlier version of the gtf
+    unlink("$idx_file.ok");
+
+    my $gene_gtfs_tiedhash = new TiedHash( { create => "$idx_file.tmp" } );
+
+    my %gene_id_to_order;
+    my %gene_name_to_ids;
+
+    my $prev_gene_id = "";
+    my $gene_gtf = "";
+
+    my $flush_gene = sub {
+        if ($gene_gtf) {
+            # gtf records are usually grouped by gene, but not necessarily
+            my $stored_gtf = $gene_gtfs_tiedhash->get_value("gtf$;$prev_gene_id") || "";
+            $gene_gtfs_tiedhash->store_key_value("gtf$;$prev_gene_id", $stored_gtf . $gene_gtf);
+            $gene_gtf = "";
+        }
+    };
+
+    print STDERR "-indexing gene gtfs from $gtf_file\n";
+
+    open (my $fh, $gtf_file) or die "Error, cannot open file $gtf_file";
+    while (my $line = <$fh>) {
+        if ($line =~ /^\#/) { next;}
+        unless ($line =~ /\w/) { next; }
+
+        my @x = split(/\t/, $line);
+        my $feat_type = $x[2];
+        unless ($feat_type eq 'exon' || $feat_type eq 'CDS') { next; } # only exon records of gtf file
+
+        my $info = $x[8];
+
+        my $gene_id = "";
+        if ($info =~ /gene_id \"([^\"]+)\"/) {
+            $gene_id = $1;
+        }
+        if ($info =~ /gene_name \"([^\"]+)\"/) {
+            my $gene_name = $1;
+            $gene_name_to_ids{$gene_name}->{$gene_id} = 1;
+        }
+
+        if ($gene_id ne $prev_gene_id) {
+            &$flush_gene();
+            $prev_gene_id = $gene_id;
+            unless (exists $gene_id_to_order{$gene_id}) {
+                $gene_id_to_order{$gene_id} = scalar(keys %gene_id_to_order);
+            }
+        }
+        $gene_gtf .= $line;
+    }
+    &$flush_gene();
+    close $fh;
+
+    foreach my $gene_id (keys %gene_id_to_order) {
+        $gene_gtfs_tiedhash->store_key_value("order$;$gene_id", $gene_id_to_order{$gene_id});
+    }
+    foreach my $gene_name (keys %gene_name_to_ids) {
+        my @gene_ids = sort { $gene_id_to_order{$a} <=> $gene_id_to_order{$b} } keys %{$gene_name_to_ids{$gene_name}};
+        $gene_gtfs_tiedhash->store_key_value("name$;$gene_name", join(",", @gene_ids));
+    }
+
+    undef $gene_gtfs_tiedhash;
+
+    rename("$idx_file.tmp", $idx_file) or die "Error, cannot rename $idx_file.tmp to $idx_file";
+
+    print STDERR "-indexed " . scalar(keys %gene_id_to_order) . " genes in $idx_file\n";
+
+    &Checkpoint_stamp::write_checkpoint("$idx_file.ok", $gtf_file);
+
+    close $lock_fh;
+
+    exit(0);
+}
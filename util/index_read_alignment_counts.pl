@@ -0,0 +1,185 @@
+#!/usr/bin/env perl
+
+use strict;
+use warnings;
+use Carp;
+
+use FindBin;
+use lib ("$FindBin::Bin/../PerlLib");
+use SAM_entry;
+use TiedHash;
+use Checkpoint_stamp;
+use File::Basename;
+use Getopt::Long qw(:config posix_default no_ignore_case bundling pass_through);
+
+
+my $CPU = 1;
+my $sort_buffer_size = "2G";
+
+my $usage = <<__EOUSAGE__;
+
+###############################################################
+#
+# Indexes each read's alignment multiplicity, for reuse by all the bam evidence extractors.
+#
+# Required:
+#
+#  --bam <string>              read_alignments.bam
+#  --gtf_file <string>         genePairContig.gtf
+#
+# Optional:
+#
+#  --output <string>           output index (default: bam.read_align_counts.idx)
+#  --CPU <int>                 bam decoding and sorting threads (default: $CPU)
+#  --sort_buffer_size <string> sort memory (default: $sort_buffer_size)
+#
+# Writes a TiedHash (DB_File btree) keyed by full read name (read/1, read/2)
+# with value:  num_alignments_on_fusion_contigs <tab> NH
+# and its .ok checkpoint (recording the bam size and mtime) once complete.
+#
+# The NH is the read's total alignment count reported by the aligner (the largest NH:i: among its
+# fusion contig alignments, 1 if absent), so a read aligning uniquely among the fusion contigs has
+# both values equal.  The btree is on disk with only the pages looked up held in memory, so it's keyed
+# by the full read name rather than a hashed read id, keeping the counts exact (no collisions).
+#
+##############################################################
+
+
+__EOUSAGE__
+
+    ;
+
+
+my $help_flag;
+my $bam_file;
+my $gtf_file;
+my $idx_file;
+
+&GetOptions('help|h' => \$help_flag,
+            'bam=s' => \$bam_file,
+            'gtf_file=s' => \$gtf_file,
+            'output=s' => \$idx_file,
+            'CPU=i' => \$CPU,
+            'sort_buffer_size=s' => \$sort_buffer_size,
+    );
+
+if ($help_flag) {
+    die $usage;
+}
+
+unless ($bam_file && $gtf_file) {
+    die $usage;
+}
+
+$idx_file ||= "$bam_file.read_align_counts.idx";
+
+
+main: {
+
+    unlink("$idx_file.ok");
+
+    my %fusion_contigs;
+    open(my $fh, $gtf_file) or die "Error, cannot open $gtf_file";
+    while (<$fh>) {
+        if (/^\#/) { next; }
+        my ($contig) = split(/\t/);
+        if ($contig =~ /\-\-/) {
+            $fusion_contigs{$contig} = 1;
+        }
+    }
+    close $fh;
+
+    my $samtools_view_cmd = "samtools view -@ $CPU $bam_file";
+    if (-s "$bam_file.bai") {
+        # only the fusion contig regions, never the genome-wide alignments
+        my @regions = grep { $fusion_contigs{$_} } &get_bam_contigs_with_reads($bam_file);
+        $samtools_view_cmd = (@regions) ? "$samtools_view_cmd " . join(" ", map { "'$_'" } @regions) : undef;
+    }
+
+    ## read names (with each alignment's NH) are sorted externally rather than counted in a hash,
+    ## so memory stays bounded on deep libraries.
+    my $sorted_names_file = "$idx_file.sorted_read_names";
+
+    open(my $ofh, "| LC_ALL=C sort -T " . dirname($idx_file) . " -S $sort_buffer_size --parallel=$CPU > $sorted_names_file") or die "Error, cannot run sort";
+    if ($samtools_view_cmd) {
+        print STDERR "-decoding $bam_file\n";
+        open(my $fh, "$samtools_view_cmd |") or die "Error, cannot run $samtools_view_cmd";
+        while (my $line = <$fh>) {
+            my (undef, undef, $contig) = split(/\t/, $line, 4);
+            unless ($fusion_contigs{$contig}) { next; }
+
+            my $sam_entry = new SAM_entry($line);
+
+            my $num_hits = ($line =~ /\tNH:i:(\d+)/) ? $1 : 1;
+
+            print $ofh $sam_entry->reconstruct_full_read_name() . "\t$num_hits\n";
+        }
+        close $fh;
+        if ($?) {
+            die "Error, $samtools_view_cmd exited with ret $?";
+        }
+    }
+    close $ofh;
+    if ($?) {
+        die "Error, sorting read names exited with ret $?";
+    }
+
+    ## sorted keys also make for efficient btree insertion
+    my $alignment_counter_tiedhash = new TiedHash( { create => $idx_file } );
+    my $num_reads = 0;
+
+    open($fh, $sorted_names_file) or die "Error, cannot open $sorted_names_file";
+    my ($prev_read_name, $count, $max_num_hits) = ("", 0, 0);
+    while (my $line = <$fh>) {
+        chomp $line;
+        my ($read_name, $num_hits) = split(/\t/, $line);
+        if ($read_name ne $prev_read_name) {
+            if ($count) {
+                $alignment_counter_tiedhash->store_key_value($prev_read_name, "$count\t$max_num_hits");
+                $num_reads++;
+            }
+            ($prev_read_name, $count, $max_num_hits) = ($read_name, 0, 0);
+        }
+        $count++;
+        if ($num_hits > $max_num_hits) {
+            $max_num_hits = $num_hits;
+        }
+    }
+    if ($count) {
+        $alignment_counter_tiedhash->store_key_value($prev_read_name, "$count\t$max_num_hits");
+        $num_reads++;
+    }
+    close $fh;
+    undef $alignment_counter_tiedhash;
+
+    unlink($sorted_names_file);
+
+    print STDERR "-indexed alignment counts for $num_reads reads in $idx_file\n";
+
+    &Checkpoint_stamp::write_checkpoint("$idx_file.ok", $bam_file);
+
+    exit(0);
+}
+
+
+####
+sub get_bam_contigs_with_reads {
+    my ($bam_file) = @_;
+
+    my @contigs;
+
+    open(my $fh, "samtools idxstats $bam_file |") or die "Error, cannot run samtools idxstats $bam_file";
+    while (<$fh>) {
+        chomp;
+        my ($contig, $len, $num_mapped, $num_unmapped) = split(/\t/);
+        if ($num_mapped + $num_unmapped > 0) {
+            push (@contigs, $contig);
+        }
+    }
+    close $fh;
+    if ($?) {
+        die "Error, samtools idxstats $bam_file exited with ret $?";
+    }
+
+    return(@contigs);
+}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os, sys, re
+import logging
+import argparse
+import pysam
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s : %(levelname)s : %(message)s',
+                    datefmt='%H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="reports only the reads aligning solely to the fusion contigs, as STAR --outSAMfilter KeepOnlyAddedReferences "
+                                     + "does for contigs given by --genomeFastaFiles at the mapping stage, for an index that already includes them",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--contigs_fa", dest="contigs_fa", required=True, type=str,
+                        help="fusion contigs fasta (ie. the STAR --patch)")
+
+    parser.add_argument("--input_bam", "-i", dest="input_bam", default="-", type=str,
+                        help="alignments with all those of a read together (ie. STAR --outSAMtype BAM Unsorted).  Use '-' for a sam or bam stream on stdin")
+
+    parser.add_argument("--output_bam", "-o", dest="output_bam", default="-", type=str,
+                        help="output uncompressed bam")
+
+    parser.add_argument("--CPU", dest="CPU", type=int, default=1,
+                        help="bgzf decompression threads")
+
+    args = parser.parse_args()
+
+    added_refs = get_fasta_seq_names(args.contigs_fa)
+
+    bamreader = pysam.AlignmentFile(args.input_bam, "r", threads=max(1, args.CPU))
+    bamwriter = pysam.AlignmentFile(args.output_bam, "wbu", template=bamreader)
+
+    num_reads = 0
+    for read in get_added_reference_reads(bamreader.fetch(until_eof=True), added_refs):
+        bamwriter.write(read)
+        num_reads += 1
+
+    bamwriter.close()
+    bamreader.close()
+
+    logger.info("-kept {} alignments of reads aligning only to the {} fusion contigs".format(num_reads, len(added_refs)))
+
+    sys.exit(0)
+
+
+def get_fasta_seq_names(fasta_file):
+
+    seq_names = set()
+    with open(fasta_file, "rt") as fh:
+        for line in fh:
+            m = re.match(r"^>(\S+)", line)
+            if m:
+                seq_names.add(m.group(1))
+
+    return seq_names
+
+
+def get_added_reference_reads(reads, added_refs):
+    """
+    yields the alignments of the reads that align only to the added references, given the alignments of each read together.
+    A read (with its mate) having any alignment elsewhere is dropped along with all its alignments, so the NH of those kept
+    counts just their added reference alignments.
+    """
+
+    def keeps(read_group):
+        mapped_reads = [ read for read in read_group if not read.is_unmapped ]
+        return len(mapped_reads) > 0 and all(read.reference_name in added_refs for read in mapped_reads)
+
+    read_group = list()
+    for read in reads:
+        if read_group and read.query_name != read_group[0].query_name:
+            if keeps(read_group):
+                yield from read_group
+            read_group = list()
+        read_group.append(read)
+
+    if read_group and keeps(read_group):
+        yield from read_group
+
+
+if __name__=='__main__':
+    main()
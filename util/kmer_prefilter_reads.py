@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import logging
+import subprocess
+import multiprocessing
+import itertools
+import numpy
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+## set in the parent before the worker pool forks, shared copy-on-write.
+## The contig k-mers are held as a sorted numpy array of 2-bit packed canonical k-mers (the lesser of a k-mer and its
+## reverse complement), 8 bytes per distinct k-mer, along with a bitmap of their hashes, 16 to 32 bits per k-mer, that
+## screens out most of the queried k-mers before they're looked up in the array.  So at most 12 bytes per contig base.  Being
+## single buffers without per-item reference counts, their pages stay shared with the workers rather than copied into each.
+TARGET_KMERS = None
+TARGET_KMER_HASHES = None
+KMER_SIZE = None
+STRIDE = None  # querying every stride'th k-mer of a read cuts the per-read cost
+
+MAX_KMER_SIZE = 32  # packed into 64 bits
+
+KMER_HASH_BITS_PER_KMER = 16
+KMER_HASH_MULTIPLIER = numpy.uint64(0x9E3779B97F4A7C15)  # Fibonacci hashing, the high bits of the product
+
+## A,C,G,T => 0,1,2,3, and anything else (N) => 4, marking the k-mers containing it as unmatchable
+BASE_CODES = numpy.full(256, 4, dtype=numpy.uint8)
+BASE_CODES[numpy.frombuffer(b"ACGTacgt", dtype=numpy.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+
+RECORDS_PER_CHUNK = 20000
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="keeps only the reads (pairs) sharing a k-mer with the fusion contigs, so only those are aligned", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--contigs_fa", type=str, required=True, help="fusion contigs fasta file")
+    parser.add_argument("--left_fq", type=str, required=True, help="left (or single) fastq file(s), comma-delimited, gzipped or not")
+    parser.add_argument("--right_fq", type=str, default="", help="right fastq file(s), comma-delimited, paired with the --left_fq")
+    parser.add_argument("--out_prefix", type=str, required=True, help="writes out_prefix.left.fq (and out_prefix.right.fq), and out_prefix.total_frags with the number of input reads (pairs)")
+    parser.add_argument("--kmer_size", type=int, default=31, help="k-mer length (at most {})".format(MAX_KMER_SIZE))
+    parser.add_argument("--stride", type=int, default=4, help="query every stride'th k-mer of each read.  Reads overlapping the contigs by at least kmer_size + stride - 1 bases are always kept")
+    parser.add_argument("--CPU", type=int, default=2, help="number of screening processes")
+
+    args = parser.parse_args()
+
+    if not 0 < args.kmer_size <= MAX_KMER_SIZE:
+        raise RuntimeError("Error, --kmer_size must be between 1 and {}".format(MAX_KMER_SIZE))
+
+    global TARGET_KMERS, TARGET_KMER_HASHES, KMER_SIZE, STRIDE
+    KMER_SIZE = args.kmer_size
+    STRIDE = args.stride
+    TARGET_KMERS = get_contig_kmers(args.contigs_fa, KMER_SIZE)
+    TARGET_KMER_HASHES = get_kmer_hash_bitmap(TARGET_KMERS)
+
+    logger.info("-{} distinct canonical k-mers ({:.1f} MB) in {}".format(len(TARGET_KMERS), (TARGET_KMERS.nbytes + TARGET_KMER_HASHES.nbytes) / 1e6,
+                                                                         args.contigs_fa))
+
+    left_fqs = args.left_fq.split(",")
+    right_fqs = args.right_fq.split(",") if args.right_fq else [None] * len(left_fqs)
+
+    if len(right_fqs) != len(left_fqs):
+        raise RuntimeError("Error, need the same number of --left_fq and --right_fq files")
+
+    left_ofh = open(args.out_prefix + ".left.fq", "wt")
+    right_ofh = open(args.out_prefix + ".right.fq", "wt") if args.right_fq else None
+
+    num_total = 0
+    num_kept = 0
+
+    pool = multiprocessing.Pool(args.CPU)
+
+    for left_fq, right_fq in zip(left_fqs, right_fqs):
+
+        logger.info("-screening {} {}".format(left_fq, right_fq if right_fq else ""))
+
+        chunks = get_read_chunks(left_fq, right_fq)
+
+        for (kept_left, kept_right, chunk_total, chunk_kept) in pool.imap(screen_chunk, chunks):
+            left_ofh.write(kept_left)
+            if right_ofh:
+                right_ofh.write(kept_right)
+            num_total += chunk_total
+            num_kept += chunk_kept
+
+    pool.close()
+    pool.join()
+
+    left_ofh.close()
+    if right_ofh:
+        right_ofh.close()
+
+    with open(args.out_prefix + ".total_frags", "wt") as ofh:
+        print(num_total, file=ofh)
+
+    logger.info("-kept {} of {} reads ({:.2f}%)".format(num_kept, num_total, 100 * num_kept / max(1, num_total)))
+
+    sys.exit(0)
+
+
+def get_contig_kmers(contigs_fa, kmer_size):
+    """
+    returns the sorted distinct canonical k-mers of the contigs, packed as numpy.uint64
+    """
+
+    kmer_arrays = list()
+
+    seqs = list()
+    with open(contigs_fa, "rt") as fh:
+        for line in itertools.chain(fh, [">"]):
+            if line.startswith(">"):
+                if seqs:
+                    codes = encode_seqs(["".join(seqs)])
+                    kmer_positions = numpy.arange(max(0, len(codes) - kmer_size + 1))
+                    kmers, has_N = get_canonical_kmers(codes, kmer_positions, kmer_size)
+                    kmer_arrays.append(numpy.unique(kmers[~has_N]))
+                seqs = list()
+            else:
+                seqs.append(line.strip())
+
+    if not kmer_arrays:
+        return numpy.zeros(0, dtype=numpy.uint64)
+
+    return numpy.unique(numpy.concatenate(kmer_arrays))
+
+
+def get_kmer_hash_bitmap(kmers):
+    """
+    returns a bitmap, as numpy.uint8, with the bits of the k-mers' hashes set
+    """
+
+    num_bits = 64
+    while num_bits < KMER_HASH_BITS_PER_KMER * len(kmers):
+        num_bits *= 2
+
+    is_set = numpy.zeros(num_bits, dtype=bool)
+    is_set[get_kmer_hashes(kmers, num_bits)] = True
+
+    return numpy.packbits(is_set, bitorder="little")
+
+
+def get_kmer_hashes(kmers, num_bits):
+    hash_shift = numpy.uint64(64 - (num_bits.bit_length() - 1))
+    return ((kmers * KMER_HASH_MULTIPLIER) >> hash_shift).astype(numpy.int64)
+
+
+def is_in_kmer_hash_bitmap(kmers, kmer_hash_bitmap):
+    kmer_hashes = get_kmer_hashes(kmers, 8 * len(kmer_hash_bitmap))
+    return ((kmer_hash_bitmap[kmer_hashes >> 3] >> (kmer_hashes & 7).astype(numpy.uint8)) & 1).astype(bool)
+
+
+def encode_seqs(seqs):
+    """
+    returns the 2-bit base codes of the concatenated seqs, as numpy.uint8
+    """
+
+    return BASE_CODES[numpy.frombuffer("".join(seqs).encode("ascii"), dtype=numpy.uint8)]
+
+
+def get_canonical_kmers(codes, kmer_positions, kmer_size):
+    """
+    returns (kmers, has_N) for the k-mers starting at kmer_positions of the encoded seq codes:  the packed canonical k-mers
+    and whether each contains a base other than ACGT.
+    """
+
+    N_counts = numpy.concatenate([[0], numpy.cumsum(codes > 3, dtype=numpy.int32)])
+    has_N = (N_counts[kmer_positions + kmer_size] - N_counts[kmer_positions]) > 0
+
+    kmers = get_packed_kmers(codes & 3, kmer_positions, kmer_size)
+
+    return numpy.minimum(kmers, get_revcomp_kmers(kmers, kmer_size)), has_N
+
+
+def get_packed_kmers(bases, kmer_positions, kmer_size):
+    """
+    returns the packed k-mers starting at kmer_positions of the 2-bit base codes.  Runs of 1, 2, 4, 8, .. packed bases
+    are built for all positions by doubling, each in the smallest integer type holding it, and each k-mer is joined from
+    the runs of its length's binary digits.
+    """
+
+    kmers = numpy.zeros(len(kmer_positions), dtype=numpy.uint64)
+    kmer_len = 0
+    packed = bases  # packed[i] holds bases[i:i + span]
+    span = 1
+    while True:
+        if kmer_size & span:
+            kmers = (kmers << numpy.uint64(2 * span)) | packed[kmer_positions + kmer_len].astype(numpy.uint64)
+            kmer_len += span
+        if 2 * span > kmer_size:
+            break
+        packed_type = numpy.min_scalar_type(4 ** (2 * span) - 1)
+        packed = (packed[:len(packed) - span].astype(packed_type) << packed_type.type(2 * span)) | packed[span:]
+        span *= 2
+
+    return kmers
+
+
+def get_revcomp_kmers(kmers, kmer_size):
+    """
+    returns the reverse complements of the packed k-mers:  complemented, with the order of the 2-bit bases reversed
+    """
+
+    revcomp_kmers = ~kmers
+    revcomp_kmers = ((revcomp_kmers >> numpy.uint64(2)) & numpy.uint64(0x3333333333333333)) | ((revcomp_kmers & numpy.uint64(0x3333333333333333)) << numpy.uint64(2))
+    revcomp_kmers = ((revcomp_kmers >> numpy.uint64(4)) & numpy.uint64(0x0F0F0F0F0F0F0F0F)) | ((revcomp_kmers & numpy.uint64(0x0F0F0F0F0F0F0F0F)) << numpy.uint64(4))
+    revcomp_kmers = revcomp_kmers.byteswap()
+
+    return revcomp_kmers >> numpy.uint64(2 * (MAX_KMER_SIZE - kmer_size))
+
+
+def open_fastq(fq_filename):
+    """
+    returns (filehandle, decompressing process or None)
+    """
+
+    if re.search("\\.gz$", fq_filename):
+        proc = subprocess.Popen(["gzip", "-dc", fq_filename], stdout=subprocess.PIPE, universal_newlines=True)
+        return (proc.stdout, proc)
+
+    return (open(fq_filename, "rt"), None)
+
+
+def close_fastq(fq_filename, fh, proc):
+
+    fh.close()
+
+    if proc is not None and proc.wait() != 0:
+        raise RuntimeError("Error, decompressing {} failed with ret {}".format(fq_filename, proc.returncode))
+
+
+def get_read_chunks(left_fq, right_fq):
+    """
+    yields lists of (left_record, right_record) 4-line fastq record tuples
+    """
+
+    left_fh, left_proc = open_fastq(left_fq)
+    right_fh, right_proc = open_fastq(right_fq) if right_fq else (None, None)
+
+    chunk = list()
+    while True:
+        left_record = "".join(itertools.islice(left_fh, 4))
+        if not left_record:
+            break
+        right_record = "".join(itertools.islice(right_fh, 4)) if right_fh else None
+        if right_fh and not right_record:
+            raise RuntimeError("Error, {} has fewer reads than {}".format(right_fq, left_fq))
+
+        chunk.append((left_record, right_record))
+        if len(chunk) >= RECORDS_PER_CHUNK:
+            yield chunk
+            chunk = list()
+
+    if chunk:
+        yield chunk
+
+    if right_fh and "".join(itertools.islice(right_fh, 4)):
+        raise RuntimeError("Error, {} has more reads than {}".format(right_fq, left_fq))
+
+    close_fastq(left_fq, left_fh, left_proc)
+    if right_fh:
+        close_fastq(right_fq, right_fh, right_proc)
+
+
+def get_reads_with_target_kmer(records):
+    """
+    returns a numpy bool array flagging the fastq records sharing a queried k-mer with the TARGET_KMERS.
+    Each read's k-mers at every STRIDE'th position (and its last) are queried, those of all the records at once.
+    """
+
+    seqs = [ record.split("\n", 2)[1] for record in records ]
+    seq_lengths = numpy.array([ len(seq) for seq in seqs ], dtype=numpy.int64)
+    seq_starts = numpy.cumsum(seq_lengths) - seq_lengths
+
+    found = numpy.zeros(len(seqs), dtype=bool)
+
+    last_kmer_starts = seq_lengths - KMER_SIZE
+    num_kmers = numpy.where(last_kmer_starts >= 0, last_kmer_starts // STRIDE + 1 + (last_kmer_starts % STRIDE != 0), 0)
+    total_kmers = int(num_kmers.sum())
+    if total_kmers == 0 or len(TARGET_KMERS) == 0:
+        return found
+
+    ## the queried k-mer positions:  read_idx gives each k-mer's read, and the last one is clamped to its read's last k-mer
+    read_idx = numpy.repeat(numpy.arange(len(seqs)), num_kmers)
+    kmer_idx = numpy.arange(total_kmers) - numpy.repeat(numpy.cumsum(num_kmers) - num_kmers, num_kmers)
+    kmer_positions = seq_starts[read_idx] + numpy.minimum(kmer_idx * STRIDE, last_kmer_starts[read_idx])
+
+    kmers, has_N = get_canonical_kmers(encode_seqs(seqs), kmer_positions, KMER_SIZE)
+
+    ## only the few k-mers whose hash bits are set are looked up in the array
+    candidates = numpy.flatnonzero(is_in_kmer_hash_bitmap(kmers, TARGET_KMER_HASHES) & ~has_N)
+    target_idx = numpy.minimum(numpy.searchsorted(TARGET_KMERS, kmers[candidates]), len(TARGET_KMERS) - 1)
+    is_target = (TARGET_KMERS[target_idx] == kmers[candidates])
+
+    found[read_idx[candidates[is_target]]] = True
+
+    return found
+
+
+def screen_chunk(chunk):
+
+    kept_left = list()
+    kept_right = list()
+
+    found = get_reads_with_target_kmer([ left_record for (left_record, right_record) in chunk ])
+    if chunk[0][1] is not None:
+        found |= get_reads_with_target_kmer([ right_record for (left_record, right_record) in chunk ])
+
+    for (left_record, right_record), is_kept in zip(chunk, found):
+        if is_kept:
+            kept_left.append(left_record)
+            if right_record:
+                kept_right.append(right_record)
+
+    return ("".join(kept_left), "".join(kept_right), len(chunk), len(kept_left))
+
+
+if __name__=='__main__':
+    main()
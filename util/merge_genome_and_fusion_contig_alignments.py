@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import os, sys, re
+import logging
+import argparse
+import pysam
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s : %(levelname)s : %(message)s',
+                    datefmt='%H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="merges the per-read hits from separate genome and fusion contig alignments, "
+                                     + "reporting the fusion contig alignments with the multimapping (NH) info they'd have from a combined index",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--fusion_contig_bam", dest="fusion_contig_bam", required=True, type=str,
+                        help="alignments to the fusion contigs index (ie. minimap2 --sam-hit-only), held in memory")
+
+    parser.add_argument("--genome_bam", dest="genome_bam", required=True, type=str,
+                        help="alignments to the genome index for the same reads (ie. minimap2 --sam-hit-only), streamed once, in any order.  Use '-' for a sam or bam stream on stdin")
+
+    parser.add_argument("--output_bam", "-o", dest="output_bam", default="-", type=str,
+                        help="output uncompressed bam of the fusion contig alignments")
+
+    parser.add_argument("--pri_ratio", dest="pri_ratio", type=float, default=0.8,
+                        help="alignments scoring below this fraction of the read's best score are not reported (as minimap2 -p)")
+
+    parser.add_argument("--CPU", dest="CPU", type=int, default=1,
+                        help="bgzf decompression threads")
+
+    args = parser.parse_args()
+
+    num_cpu = max(1, args.CPU)
+
+    contig_bamreader = pysam.AlignmentFile(args.fusion_contig_bam, "rb", threads=num_cpu)
+
+    ## only the few reads hitting the fusion contigs matter, so just they are kept, keyed by read name
+    read_name_to_contig_reads = dict()
+    for read in contig_bamreader.fetch(until_eof=True):
+        if read.is_unmapped:
+            continue
+        read_name_to_contig_reads.setdefault(read.query_name, list()).append(read)
+
+    logger.info("-{} reads align to the fusion contigs".format(len(read_name_to_contig_reads)))
+
+    read_name_to_genome_reads = dict()
+
+    genome_bamreader = pysam.AlignmentFile(args.genome_bam, "r", threads=num_cpu)
+    for read in genome_bamreader.fetch(until_eof=True):
+        if read.query_name in read_name_to_contig_reads:
+            read_name_to_genome_reads.setdefault(read.query_name, list()).append(read)
+    genome_bamreader.close()
+
+    bamwriter = pysam.AlignmentFile(args.output_bam, "wbu", template=contig_bamreader)
+
+    for read_name, contig_reads in read_name_to_contig_reads.items():
+        genome_reads = read_name_to_genome_reads.get(read_name, list())
+        for read in merge_read_alignments(contig_reads, genome_reads, args.pri_ratio):
+            bamwriter.write(read)
+
+    bamwriter.close()
+    contig_bamreader.close()
+
+    logger.info("-merged {} reads aligned to fusion contigs, {} of which also align to the genome".format(len(read_name_to_contig_reads), len(read_name_to_genome_reads)))
+
+    sys.exit(0)
+
+
+def get_mate_key(read):
+    if read.is_read1:
+        return 1
+    elif read.is_read2:
+        return 2
+    else:
+        return 0
+
+
+def merge_read_alignments(contig_reads, genome_reads, pri_ratio):
+    """
+    yields the fusion contig alignments of a read, each mate scored against all of its alignments as a combined index would:
+    alignments well below the best score are dropped, contig alignments outscored by the genome are secondary,
+    and NH counts the reported alignments to both the genome and the fusion contigs.
+    """
+
+    def get_best_scores(reads):
+        best_scores = dict()
+        for read in reads:
+            if read.is_unmapped or read.is_supplementary:
+                continue
+            mate_key = get_mate_key(read)
+            score = read.get_tag("AS")
+            if score > best_scores.get(mate_key, score - 1):
+                best_scores[mate_key] = score
+        return best_scores
+
+    contig_best_scores = get_best_scores(contig_reads)
+    genome_best_scores = get_best_scores(genome_reads)
+
+    min_scores = dict()
+    for mate_key, contig_best_score in contig_best_scores.items():
+        best_score = max(contig_best_score, genome_best_scores.get(mate_key, contig_best_score))
+        min_scores[mate_key] = pri_ratio * best_score
+
+    num_hits = dict()
+    for read in contig_reads + genome_reads:
+        if read.is_unmapped or read.is_supplementary:
+            continue
+        mate_key = get_mate_key(read)
+        if mate_key in min_scores and read.get_tag("AS") >= min_scores[mate_key]:
+            num_hits[mate_key] = num_hits.get(mate_key, 0) + 1
+
+    for read in contig_reads:
+        mate_key = get_mate_key(read)
+
+        if not read.is_supplementary:
+            if read.get_tag("AS") < min_scores[mate_key]:
+                continue
+            if genome_best_scores.get(mate_key, -1) > contig_best_scores[mate_key]:
+                read.is_secondary = True
+
+        read.set_tag("NH", num_hits.get(mate_key, 1), value_type="i")
+
+        yield read
+
+
+if __name__=='__main__':
+    main()
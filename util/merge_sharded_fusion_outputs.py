@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import logging
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="merges the per-shard FusionInspector.fusions.tsv outputs from a --shard_fusions run into a single table, ordered independently of the sharding", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--shard_output_dirs", type=str, required=True, help="per-shard FusionInspector output directories, comma-delimited")
+    parser.add_argument("--out_prefix", type=str, default="finspector", help="FusionInspector output filename prefix used for each shard")
+    parser.add_argument("--output", type=str, required=True, help="output merged fusions table")
+
+    args = parser.parse_args()
+
+    header = None
+    rows = list()
+
+    for shard_output_dir in args.shard_output_dirs.split(","):
+
+        FI_output_file = os.path.join(shard_output_dir, args.out_prefix + ".FusionInspector.fusions.tsv")
+
+        if not os.path.exists(FI_output_file):
+            raise RuntimeError("Error, missing expected output file: {}".format(FI_output_file))
+
+        logger.info("-processing {}".format(FI_output_file))
+
+        with open(FI_output_file, 'rt') as fh:
+            shard_header = next(fh).rstrip("\n").split("\t")
+            if header is None:
+                header = shard_header
+            elif shard_header != header:
+                raise RuntimeError("Error, {} has different columns from the other shards".format(FI_output_file))
+
+            for line in fh:
+                rows.append(line.rstrip("\n").split("\t"))
+
+    fusion_name_idx = header.index("#FusionName")
+    left_brkpt_idx = header.index("LeftBreakpoint")
+    right_brkpt_idx = header.index("RightBreakpoint")
+
+    rows = sorted(rows, key=lambda vals: (vals[fusion_name_idx], vals[left_brkpt_idx], vals[right_brkpt_idx]))
+
+    with open(args.output, 'wt') as ofh:
+        ofh.write("\t".join(header) + "\n")
+        for vals in rows:
+            ofh.write("\t".join(vals) + "\n")
+
+    logger.info("-done.  Wrote {} fusions to merged table: {}".format(len(rows), args.output))
+
+    sys.exit(0)
+
+
+if __name__=='__main__':
+    main()
@@ -43,7 +43,8 @@ main: {
 
     foreach my $bam_file (split(/,/, $bam_file_listing) ) {
         
-        my $sam_reader = new SAM_reader($bam_file);
+        # tokens are fusion_contig|read_name
+        my $sam_reader = SAM_reader->new_for_read_names($bam_file, [ map { (split(/\|/, $_, 2))[1] } keys %reads_want ]);
         while (my $sam_entry = $sam_reader->get_next()) {
            
             my $line = $sam_entry->get_original_line();
@@ -79,5 +80,3 @@ main: {
     
     exit(0);
 }
-
-
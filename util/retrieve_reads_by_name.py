@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import logging
+
+sys.path.insert(0, os.path.sep.join([os.path.dirname(os.path.realpath(__file__)), "../PyLib"]))
+from BamReadNameIndex import fetch_reads_by_name, get_index_filename
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="writes the sam records (headerless) of the named reads, seeking via the bam read-name index", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--bam", type=str, required=True, help="input bam file, indexed by index_bam_read_names.py")
+    parser.add_argument("--read_names", type=str, required=True, help="file listing read names, one per line")
+    parser.add_argument("--index", type=str, default=None, help="read-name index file (default: bam.rni)")
+
+    args = parser.parse_args()
+
+    index_filename = args.index if args.index else get_index_filename(args.bam)
+
+    with open(args.read_names, "rt") as fh:
+        read_names = [ line.strip() for line in fh if line.strip() ]
+
+    num_records = 0
+    for read in fetch_reads_by_name(args.bam, read_names, index_filename):
+        print(read.to_string())
+        num_records += 1
+
+    logger.info("-retrieved {} alignment records for {} read names".format(num_records, len(read_names)))
+
+    sys.exit(0)
+
+
+if __name__=='__main__':
+    main()
@@ -6,8 +6,10 @@ use warnings;
 use FindBin;
 use lib("$FindBin::RealBin/../PerlLib");
 use Pipeliner;
+use Checkpoint_stamp;
 use File::Basename;
 use Cwd;
+use Fcntl qw(:flock);
 
 use Carp;
 use Getopt::Long qw(:config no_ignore_case bundling pass_through);
@@ -35,13 +37,22 @@ my $usage = <<__EOUSAGE__;
 #  --CPU <int>                 number of threads (default: 2)
 #  --out_prefix <string>       output prefix (default: star)
 #  --out_dir <string>          output directory (default: current working directory)
+#  --checkpoint_dir <string>   directory for the checkpoints of the alignment steps (default: --out_dir)
 #  --star_path <string>        full path to the STAR program to use.
 #  --prep_reference_only       build the genome index and then stop.
+#  --index <string>            STAR genome index directory to use, built there (including the --patch contigs) if missing,
+#                              or rebuilt if built from a different --genome, --patch, or -G.
+#                              Lets multiple samples share a single index build.
+#  --genome_load <string>      STAR --genomeLoad setting for aligning against an --index kept in shared memory (ie. LoadAndKeep).
+#                              The index must already include the --patch contigs and -G annotations.
 #  --capture_genome_alignments reports alignments to the reference genome in addition to the fusion contigs. (for debugging)
 #  --chim_search               include Chimeric.junction outputs
 #  --max_mate_dist <int>       maximum distance between mates (and individual introns) allowed (default: $max_mate_dist)
 #  --no_splice_score_boost     do not augment alignment score for spliced alignments 
 #  --STAR_xtra_params <string>   extra parameters to pass on to the STAR aligner. Be sure to embed parameters in quotes.
+#  --remove_dups               remove duplicate alignments as STAR streams out the sorted alignments (via bam_mark_duplicates.py)
+#  --parallel_dedup            with --remove_dups, write and index the sorted bam, then deduplicate it per contig in --CPU workers
+#                              instead of streaming it through the dedup.
 #
 #################################################################################################
 
@@ -60,6 +71,7 @@ my $help_flag;
 my $out_prefix = "star";
 my $gtf_file;
 my $out_dir;
+my $checkpoint_dir;
 my $ADV = 0;
 
 my $star_path = "STAR";
@@ -70,6 +82,10 @@ my $chim_search;
 my $samples_file;
 my $no_splice_score_boost = 0;
 my $STAR_xtra_params = "";
+my $star_index;
+my $genome_load;
+my $remove_dups = 0;
+my $parallel_dedup = 0;
 
 &GetOptions( 'h' => \$help_flag,
              'genome=s' => \$genome,
@@ -82,6 +98,7 @@ my $STAR_xtra_params = "";
              'out_prefix=s' => \$out_prefix,
              'G=s' => \$gtf_file,
              'out_dir=s' => \$out_dir,
+             'checkpoint_dir=s' => \$checkpoint_dir,
              'ADV' => \$ADV,
              'star_path=s' => \$star_path,
              'prep_reference_only' => \$prep_reference_only,
@@ -94,10 +111,16 @@ my $STAR_xtra_params = "";
 
              'STAR_xtra_params=s' => \$STAR_xtra_params,
 
+             'index=s' => \$star_index,
+             'genome_load=s' => \$genome_load,
+
+             'remove_dups' => \$remove_dups,
+             'parallel_dedup' => \$parallel_dedup,
+
     );
 
 
-unless ($genome && ($reads || $samples_file) ) {
+unless ($genome && ($reads || $samples_file || $prep_reference_only) ) {
     die $usage;
 }
 
@@ -116,6 +139,10 @@ unless ($star_prog =~ /\w/) {
     die "Error, cannot locate STAR program. Be sure it's in your PATH setting.  ";
 }
 
+if ($genome_load && ! $star_index) {
+    die "Error, --genome_load requires the --index loaded into shared memory";
+}
+
 if ($samples_file && $reads) {
     die "Error, must specify --reads or --samples_file, not both";
 }
@@ -126,10 +153,16 @@ main: {
     ## ensure all full paths
     $genome = &Pipeliner::ensure_full_path($genome);
     $gtf_file = &Pipeliner::ensure_full_path($gtf_file) if $gtf_file;
+    $patch = &Pipeliner::ensure_full_path($patch) if $patch;
+    $checkpoint_dir = &Pipeliner::ensure_full_path($checkpoint_dir) if $checkpoint_dir;
+    $star_index = &Pipeliner::ensure_full_path($star_index) if $star_index;
 
     my $read_group_ids = "";
     
-    if ($reads) {
+    if ($prep_reference_only) {
+        # no reads to prep
+    }
+    elsif ($reads) {
         my @read_files = split(/\s+/, $reads);
         foreach my $read_file (@read_files) {
             if ($read_file) {
@@ -177,48 +210,76 @@ main: {
         chdir $out_dir or die "Error, cannot cd to $out_dir";
     }
 
+    if ($checkpoint_dir && ! -d $checkpoint_dir) {
+        mkdir $checkpoint_dir or die "Error, cannot mkdir $checkpoint_dir";
+    }
+
     my $MIN_RAM = 1024**3; # 1G
     my $genome_size = -s $genome;
+
+    # when a shared index is requested, the patch contigs are built into it rather than inserted on the fly for each run.
+    my $patch_in_index = ($star_index && $patch) ? 1 : 0;
+    if ($patch_in_index) {
+        $genome_size += -s $patch;
+    }
+    
     my $estimated_ram = $genome_size * 15;
     
     if ($estimated_ram < $MIN_RAM) {
         $estimated_ram = $MIN_RAM;
     }
     
-    my $star_index = "$genome.star.idx";
-    if (! -d $star_index) {
-        
-        ## build star index
-        unless (-d $star_index) {
-            mkdir($star_index) or die "Error, cannot mkdir $star_index";
+    # what the index is built from, so that a changed genome, contig set, or annotation doesn't reuse a stale index
+    my $index_signature = &Checkpoint_stamp::get_build_signature([$genome], [ (($patch_in_index) ? $patch : undef), $gtf_file ]);
+
+    unless ($star_index) {
+        $star_index = "$genome.$index_signature.star.idx";
+    }
+    if (&Checkpoint_stamp::get_recorded_build_signature("$star_index/build.ok") ne $index_signature) {
+
+        if ($genome_load) {
+            die "Error, the --index $star_index loaded in shared memory wasn't built from this --genome, --patch and -G";
         }
 
-        # from Alex D.:
-        # scale down the --genomeSAindexNbases parameter as log2(GenomeLength)/2 - 1
-        
-    
-        my $genomeSAindexNbases = int(log($genome_size) / log(2) / 2); # close enough.
-    
+        # concurrent runs wait on the one build
+        open(my $lock_fh, ">", "$star_index.lock") or die "Error, cannot write to $star_index.lock";
+        flock($lock_fh, LOCK_EX) or die "Error, cannot lock $star_index.lock";
 
-    
-        my $cmd = "$star_prog --runThreadN $CPU --runMode genomeGenerate --genomeDir $star_index "
-            . " --genomeFastaFiles $genome "
-            . " --genomeSAindexNbases $genomeSAindexNbases"
-            . " --limitGenomeGenerateRAM $estimated_ram "; #40419136213 ";
-        if ($gtf_file) {
-            $cmd .= " --sjdbGTFfile $gtf_file "
-                . " --sjdbOverhang 150 ";
-            
+        if (&Checkpoint_stamp::get_recorded_build_signature("$star_index/build.ok") ne $index_signature) {
+
+            ## build star index
+            unless (-d $star_index) {
+                mkdir($star_index) or die "Error, cannot mkdir $star_index";
+            }
+            unlink("$star_index/build.ok");
+
+            # from Alex D.:
+            # scale down the --genomeSAindexNbases parameter as log2(GenomeLength)/2 - 1
+
+            my $genomeSAindexNbases = int(log($genome_size) / log(2) / 2); # close enough.
+
+            my $cmd = "$star_prog --runThreadN $CPU --runMode genomeGenerate --genomeDir $star_index "
+                . " --genomeFastaFiles $genome " . (($patch_in_index) ? " $patch " : "")
+                . " --genomeSAindexNbases $genomeSAindexNbases"
+                . " --limitGenomeGenerateRAM $estimated_ram "; #40419136213 ";
+            if ($gtf_file) {
+                $cmd .= " --sjdbGTFfile $gtf_file "
+                    . " --sjdbOverhang 150 ";
+
+            }
+
+            &process_cmd($cmd);
+
+            # only written once the build completes, so an interrupted build is redone
+            &Checkpoint_stamp::write_build_signature("$star_index/build.ok", $index_signature);
         }
+
+        close $lock_fh;
+    }
     
-        &process_cmd($cmd);
-        
-        &process_cmd("touch $star_index/build.ok");
-        
-        if ($prep_reference_only) {
-            print STDERR "done building genome index.  stopping here.\n";
-            exit(0);
-        }
+    if ($prep_reference_only) {
+        print STDERR "done building genome index.  stopping here.\n";
+        exit(0);
     }
 
         
@@ -226,6 +287,7 @@ main: {
         my @tmpfiles;
     
     my $pipeliner = new Pipeliner(-verbose => 2);
+    $pipeliner->set_checkpoint_dir($checkpoint_dir) if $checkpoint_dir;
     
     my $cmd = "$star_prog "
         . " --runThreadN $CPU "
@@ -266,23 +328,29 @@ main: {
     
     if ($patch) {
 
-        $cmd .= " --genomeFastaFiles $patch ";
+        $cmd .= " --genomeFastaFiles $patch " unless $patch_in_index;
 
         if ($capture_genome_alignments_flag) {
             # Keep all alignments (genome + fusion contigs) for debugging
             # No filter needed - STAR default reports all alignments
         }
-        else {
+        elsif (! $patch_in_index) {
             ## ** the FusionInspector default setting **
             # Keep only alignments to fusion contigs (not genome alignments)
             $cmd .= " --outSAMfilter KeepOnlyAddedReferences ";
         }
+        # otherwise, the contigs aren't 'added' references, so the reads are filtered likewise after alignment below.
     }
     
-    if ($gtf_file) {
+    if ($gtf_file && ! ($patch_in_index || $genome_load)) {
         $cmd .= " --sjdbGTFfile $gtf_file ";
     }
 
+    if ($genome_load) {
+        # shared memory genomes cannot have splice junctions or sequences inserted on the fly
+        $cmd .= " --genomeLoad $genome_load ";
+    }
+
     if ($no_splice_score_boost) {
         $cmd .= " --alignSJstitchMismatchNmax 5 5 5 5 "; # same for all breakpoints
         $cmd .= " --scoreGapGCAG -8 "; # match the other dinuc pair penalties.
@@ -306,15 +374,53 @@ main: {
         $cmd .= " --limitBAMsortRAM $estimated_ram ";  #20000000000";
     }
     
-    $pipeliner->add_commands( new Command($cmd, "star_align.ok") );
-    
-    
     my $bam_outfile = "Aligned.sortedByCoord.out.bam";
     my $renamed_bam_outfile = "$out_prefix.sortedByCoord.out.bam";
-    $pipeliner->add_commands( new Command("mv $bam_outfile $renamed_bam_outfile", "$renamed_bam_outfile.ok") );
-    
+
+    my $streaming_dedup = ($remove_dups && ! $parallel_dedup);
+    my $filter_added_refs = ($patch_in_index && ! $capture_genome_alignments_flag);
+
+    if ($filter_added_refs) {
+        ## the contigs built into the index aren't 'added' references for KeepOnlyAddedReferences, so the same filter is applied
+        ## to STAR's unsorted output, in which each read's alignments are together.  Only the few reads kept are then sorted.
+        $cmd =~ s/--outSAMtype BAM SortedByCoordinate/--outSAMtype BAM Unsorted/;
+        $cmd .= " --outStd BAM_Unsorted "
+            . " | $FindBin::RealBin/keep_only_added_reference_reads.py --contigs_fa $patch -i - -o - "
+            . " | samtools sort -@ $CPU -o " . (($streaming_dedup) ? "-" : $bam_outfile) . " - ";
+    }
+    elsif ($streaming_dedup) {
+        $cmd .= " --outStd BAM_SortedByCoordinate ";
+    }
+
+    if ($streaming_dedup) {
+        ## dedup consumes the sorted alignments as they're streamed out, writing the bam and its index in one pass
+        $cmd .= " | $FindBin::RealBin/bam_mark_duplicates.py -i - -o $bam_outfile --remove_dups --CPU $CPU ";
+    }
+
+    if ($filter_added_refs || $streaming_dedup) {
+        $cmd =~ s/([\"\$`])/\\$1/g;
+        $cmd = "bash -c \"set -eo pipefail; $cmd\"";
+    }
+
+    $pipeliner->add_commands( new Command($cmd, "star_align.ok") );
+
+    if ($streaming_dedup) {
+        # already indexed, along with the duplicate stats
+        $pipeliner->add_commands( new Command("mv $bam_outfile $renamed_bam_outfile && mv $bam_outfile.bai $renamed_bam_outfile.bai "
+                                              . " && mv $bam_outfile.dup_stats.tsv $renamed_bam_outfile.dup_stats.tsv", "$renamed_bam_outfile.ok") );
+    }
+    elsif ($remove_dups) {
+        ## the parallel dedup works from the indexed bam, writing the deduplicated bam with its index
+        $pipeliner->add_commands( new Command("samtools index $bam_outfile", "$bam_outfile.dedup_input.bai.ok") );
+
+        $pipeliner->add_commands( new Command("$FindBin::RealBin/bam_mark_duplicates.py -i $bam_outfile -o $renamed_bam_outfile --remove_dups --CPU $CPU "
+                                              . " && rm -f $bam_outfile $bam_outfile.bai", "$renamed_bam_outfile.ok") );
+    }
+    else {
+        $pipeliner->add_commands( new Command("mv $bam_outfile $renamed_bam_outfile", "$renamed_bam_outfile.ok") );
     
-    $pipeliner->add_commands( new Command("samtools index $renamed_bam_outfile", "$renamed_bam_outfile.bai.ok") );
+        $pipeliner->add_commands( new Command("samtools index $renamed_bam_outfile", "$renamed_bam_outfile.bai.ok") );
+    }
     
     
     $pipeliner->run();
@@ -6,8 +6,11 @@ use warnings;
 use FindBin;
 use lib("$FindBin::RealBin/../PerlLib");
 use Pipeliner;
+use Checkpoint_stamp;
+use Contigs_bed;
 use File::Basename;
 use Cwd;
+use Fcntl qw(:flock);
 
 use Carp;
 use Getopt::Long qw(:config no_ignore_case bundling pass_through);
@@ -35,11 +38,21 @@ my $usage = <<__EOUSAGE__;
 #  --CPU <int>                 number of threads (default: 2)
 #  --out_prefix <string>       output prefix (default: minimap2)
 #  --out_dir <string>          output directory (default: current working directory)
+#  --checkpoint_dir <string>   directory for the checkpoints of the alignment steps (default: --out_dir)
 #  --minimap2_path <string>    full path to the minimap2 program to use.
 #  --prep_reference_only       build the genome index and then stop.
+#  --index <string>            minimap2 index (.mmi) to use, built there (including the --patch contigs) if missing.
+#                              Lets multiple samples share a single index build.
+#  --genome_index <string>     genome-only minimap2 index (.mmi), built there once if missing and reused by every sample
+#                              (default: genome.mmi, alongside the genome, whose dir must then be writable for the build)
+#                              Without --index, the --patch contigs get their own small index and reads are aligned to each,
+#                              with the per-read hits merged for the multimapping (NH) info.
 #  --capture_genome_alignments reports alignments to the reference genome in addition to the fusion contigs. (for debugging)
 #  --max_mate_dist <int>       maximum distance between mates (and individual introns) allowed (default: $max_mate_dist)
 #  --minimap2_xtra_params <string>   extra parameters to pass on to the minimap2 aligner. Be sure to embed parameters in quotes.
+#  --remove_dups               remove duplicate alignments as the sorted alignments are streamed out (via bam_mark_duplicates.py)
+#  --parallel_dedup            with --remove_dups, write and index the sorted bam, then deduplicate it per contig in --CPU workers
+#                              instead of streaming it through the dedup.
 #
 #################################################################################################
 
@@ -58,6 +71,7 @@ my $help_flag;
 my $out_prefix = "minimap2";
 my $gtf_file;
 my $out_dir;
+my $checkpoint_dir;
 my $ADV = 0;
 
 my $minimap2_path = "minimap2";
@@ -66,6 +80,10 @@ my $prep_reference_only = 0;
 my $capture_genome_alignments_flag = 0;
 my $samples_file;
 my $minimap2_xtra_params = "";
+my $mm2_index;
+my $genome_index;
+my $remove_dups = 0;
+my $parallel_dedup = 0;
 
 &GetOptions( 'h' => \$help_flag,
              'genome=s' => \$genome,
@@ -78,6 +96,7 @@ my $minimap2_xtra_params = "";
              'out_prefix=s' => \$out_prefix,
              'G=s' => \$gtf_file,
              'out_dir=s' => \$out_dir,
+             'checkpoint_dir=s' => \$checkpoint_dir,
              'ADV' => \$ADV,
              'minimap2_path=s' => \$minimap2_path,
              'prep_reference_only' => \$prep_reference_only,
@@ -87,10 +106,16 @@ my $minimap2_xtra_params = "";
 
              'minimap2_xtra_params=s' => \$minimap2_xtra_params,
 
+             'index=s' => \$mm2_index,
+             'genome_index=s' => \$genome_index,
+
+             'remove_dups' => \$remove_dups,
+             'parallel_dedup' => \$parallel_dedup,
+
     );
 
 
-unless ($genome && ($reads || $samples_file) ) {
+unless ($genome && ($reads || $samples_file || $prep_reference_only) ) {
     die $usage;
 }
 
@@ -119,10 +144,17 @@ main: {
     ## ensure all full paths
     $genome = &Pipeliner::ensure_full_path($genome);
     $gtf_file = &Pipeliner::ensure_full_path($gtf_file) if $gtf_file;
+    $patch = &Pipeliner::ensure_full_path($patch) if $patch;
+    $checkpoint_dir = &Pipeliner::ensure_full_path($checkpoint_dir) if $checkpoint_dir;
+    $mm2_index = &Pipeliner::ensure_full_path($mm2_index) if $mm2_index;
+    $genome_index = &Pipeliner::ensure_full_path($genome_index) if $genome_index;
 
     my @read_group_samples = ();
 
-    if ($reads) {
+    if ($prep_reference_only) {
+        # no reads to prep
+    }
+    elsif ($reads) {
         my @read_files = split(/\s+/, $reads);
         foreach my $read_file (@read_files) {
             if ($read_file) {
@@ -168,15 +200,47 @@ main: {
         chdir $out_dir or die "Error, cannot cd to $out_dir";
     }
 
+    if ($checkpoint_dir && ! -d $checkpoint_dir) {
+        mkdir $checkpoint_dir or die "Error, cannot mkdir $checkpoint_dir";
+    }
+
 
     my $combined_genome = $genome;
     my $combined_gtf = $gtf_file;
 
+    # what a genome (and contigs) index is built from, recorded in its build.ok, so that it's rebuilt once they change
+    my $index_signature = &Checkpoint_stamp::get_build_signature([$genome], [ ($patch) ? $patch : () ]);
+
+    my $index_shared = ($mm2_index) ? 1 : 0;
+    my $index_prebuilt = ($index_shared && &Checkpoint_stamp::get_recorded_build_signature("$mm2_index.build.ok") eq $index_signature) ? 1 : 0;
+
+    # Without a shared patched index, the genome-wide index is built just once and the
+    # fusion contigs are aligned to separately, rather than re-indexing the whole genome per sample.
+    my $split_index_mode = ($patch && ! $index_shared && ! $capture_genome_alignments_flag) ? 1 : 0;
+
+    my $fusion_contigs_index;
+    my $fusion_contigs_bed;
+
     # Handle genome patching: concatenate reference genome + fusion contigs
     if ($patch) {
-        $combined_genome = "genome_w_fusion_contigs.fa";
-        my $cmd = "cat $genome $patch > $combined_genome";
-        &process_cmd($cmd);
+        $combined_genome = ($mm2_index) ? "$mm2_index.genome_w_fusion_contigs.fa" : "genome_w_fusion_contigs.fa";
+        if ($split_index_mode) {
+            unless ($genome_index) {
+                $genome_index = "$genome.mmi";
+                if (&Checkpoint_stamp::get_recorded_build_signature("$genome_index.build.ok") ne &Checkpoint_stamp::get_build_signature([$genome], [])
+                    && ! -w dirname($genome)) {
+                    # rather than rebuilding the whole genome index for every sample
+                    die "Error, the genome minimap2 index $genome_index needs building, but the genome's directory is read-only. "
+                        . "Give a writable --genome_index location to be shared by all samples (FusionInspector --minimap2_genome_index), "
+                        . "or build it there with --prep_reference_only as the owner of the genome lib.\n";
+                }
+            }
+            $fusion_contigs_index = "fusion_contigs.mmi";
+        }
+        elsif (! $index_prebuilt) {
+            my $cmd = "cat $genome $patch > $combined_genome";
+            &process_cmd($cmd);
+        }
 
         # Also combine GTF annotations if provided
         if ($gtf_file) {
@@ -186,7 +250,7 @@ main: {
 
             if (-e $patch_gtf) {
                 $combined_gtf = "annots_w_fusion_contigs.gtf";
-                $cmd = "cat $gtf_file $patch_gtf > $combined_gtf";
+                my $cmd = "cat $gtf_file $patch_gtf > $combined_gtf";
                 &process_cmd($cmd);
             }
         }
@@ -194,32 +258,61 @@ main: {
 
 
     # Build minimap2 index
-    my $mm2_index = "$combined_genome.mmi";
+    if ($split_index_mode) {
+        &build_shared_index($genome, $genome_index);
+
+        # rebuilt once the contigs change
+        my $contigs_signature = &Checkpoint_stamp::get_build_signature([], [$patch]);
+        unless (&Checkpoint_stamp::get_recorded_build_signature("$fusion_contigs_index.build.ok") eq $contigs_signature) {
+            &process_cmd("$minimap2_prog -d $fusion_contigs_index.tmp $patch");
+            rename("$fusion_contigs_index.tmp", $fusion_contigs_index) or die "Error, cannot rename $fusion_contigs_index.tmp to $fusion_contigs_index";
+            &Checkpoint_stamp::write_build_signature("$fusion_contigs_index.build.ok", $contigs_signature);
+        }
+    }
+    else {
+        unless ($mm2_index) {
+            $mm2_index = "$combined_genome.mmi";
+        }
 
-    unless (-e "$mm2_index.build.ok") {
+        unless (&Checkpoint_stamp::get_recorded_build_signature("$mm2_index.build.ok") eq $index_signature) {
 
-        my $cmd = "$minimap2_prog -d $mm2_index $combined_genome";
-        &process_cmd($cmd);
+            my $cmd = "$minimap2_prog -d $mm2_index $combined_genome";
+            &process_cmd($cmd);
 
-        &process_cmd("touch $mm2_index.build.ok");
+            &Checkpoint_stamp::write_build_signature("$mm2_index.build.ok", $index_signature);
 
-        if ($prep_reference_only) {
-            print STDERR "done building genome index.  stopping here.\n";
-            exit(0);
+            if ($index_shared && $combined_genome ne $genome) {
+                # only needed to build the index
+                unlink($combined_genome);
+            }
+        }
+
+        if ($patch && ! $capture_genome_alignments_flag) {
+            # regions for filtering the combined alignments down to the fusion contigs
+            $fusion_contigs_bed = "fusion_contigs.bed";
+            &Contigs_bed::write_contigs_bed($patch, $fusion_contigs_bed);
         }
     }
 
+    if ($prep_reference_only) {
+        print STDERR "done building genome index.  stopping here.\n";
+        exit(0);
+    }
+
     # Convert GTF to junction BED for minimap2
     my $splice_bed = "";
     if ($combined_gtf) {
         $splice_bed = "$combined_gtf.splice.bed";
 
-        unless (-e "$splice_bed.ok") {
+        # kept with the alignment checkpoints, so it's rebuilt along with them
+        my $splice_bed_ok = ($checkpoint_dir) ? "$checkpoint_dir/" . basename($splice_bed) . ".ok" : "$splice_bed.ok";
+
+        unless (-e $splice_bed_ok) {
             # Use paftools.js bundled in util/ alongside this script
             my $paftools = "k8 $FindBin::RealBin/paftools.js";
             my $cmd = "$paftools gff2bed $combined_gtf > $splice_bed";
             &process_cmd($cmd);
-            &process_cmd("touch $splice_bed.ok");
+            &process_cmd("touch $splice_bed_ok");
         }
     }
 
@@ -227,6 +320,7 @@ main: {
     ## run minimap2
 
     my $pipeliner = new Pipeliner(-verbose => 2);
+    $pipeliner->set_checkpoint_dir($checkpoint_dir) if $checkpoint_dir;
 
     # Parse read files
     my @read_files = split(/\s+/, $reads);
@@ -236,49 +330,90 @@ main: {
     # Build minimap2 command
     # Note: Allow secondary alignments (default) so reads can align to both genome and fusion contigs
     # The -N parameter controls max secondary alignments (default: 5)
-    my $cmd = "$minimap2_prog -ax splice -t $CPU -G $max_mate_dist -uf --MD -L ";
+    my $mm2_params = "-ax splice -t $CPU -G $max_mate_dist -uf --MD -L ";
 
     if ($splice_bed && -s $splice_bed) {
-        $cmd .= " --junc-bed $splice_bed ";
+        $mm2_params .= " --junc-bed $splice_bed ";
     }
 
     if ($minimap2_xtra_params) {
-        $cmd .= " $minimap2_xtra_params ";
+        $mm2_params .= " $minimap2_xtra_params ";
     }
 
-    $cmd .= " $mm2_index $left_fq ";
+    my $reads_params = " $left_fq ";
 
     if ($right_fq) {
-        $cmd .= " $right_fq ";
+        $reads_params .= " $right_fq ";
     }
 
     # Pipe to samtools for BAM conversion and sorting
     my $output_bam = "$out_prefix.sortedByCoord.out.bam";
     my $temp_bam = "Aligned.sortedByCoord.out.bam";
 
-    # Filter to only fusion contig alignments before sorting (unless debugging)
-    # Fusion contigs contain "--" in their reference names
-    # This dramatically reduces sorting time since genome >> fusion contigs
-    if ($patch && !$capture_genome_alignments_flag) {
-        $cmd .= " | awk 'BEGIN{OFS=\"\\t\"} /^\@/ {print; next} \$3 ~ /--/ {print}' ";
-    }
+    my $cmd;
+    my @intermediate_bams;
 
-    $cmd .= " | samtools sort -@ $CPU -m 4G -o $temp_bam - ";
+    if ($split_index_mode) {
+        # same reads aligned to each index, reporting only the reads with hits.
+        # The few reads hitting the fusion contigs are held in memory while the genome alignments stream past them once.
+        my $fusion_contigs_aln_bam = "$out_prefix.fusion_contigs.aln.bam";
+        @intermediate_bams = ($fusion_contigs_aln_bam);
 
-    $pipeliner->add_commands( new Command($cmd, "minimap2_align.ok") );
+        my $contigs_aln_cmd = "$minimap2_prog $mm2_params --sam-hit-only $fusion_contigs_index $reads_params | samtools view -@ $CPU -b -o $fusion_contigs_aln_bam - ";
+        $contigs_aln_cmd =~ s/([\"\$`])/\\$1/g;
+        $pipeliner->add_commands( new Command("bash -c \"set -eo pipefail; $contigs_aln_cmd\"", "minimap2_align_fusion_contigs.ok") );
 
+        # reports only the fusion contig alignments, with secondary flags and NH as from a combined index
+        $cmd = "$minimap2_prog $mm2_params --sam-hit-only $genome_index $reads_params "
+            . " | $FindBin::RealBin/merge_genome_and_fusion_contig_alignments.py --fusion_contig_bam $fusion_contigs_aln_bam --genome_bam - --CPU $CPU -o - ";
+    }
+    else {
+        $cmd = "$minimap2_prog $mm2_params $mm2_index $reads_params";
 
-    # Handle read groups if samples file was provided
-    if (@read_group_samples) {
-        # Need to add read groups to the BAM file
-        my $rg_added_bam = "$temp_bam.rg.bam";
+        # Filter to only fusion contig alignments before sorting (unless debugging)
+        # This dramatically reduces sorting time since genome >> fusion contigs
+        if ($fusion_contigs_bed) {
+            $cmd .= " | samtools view -@ $CPU -u -L $fusion_contigs_bed - ";
+        }
+    }
 
-        # Build read group string
+    my $rg_string = "";
+    if (@read_group_samples) {
         my @rg_lines;
         foreach my $sample (@read_group_samples) {
             push @rg_lines, "-r '\@RG\\tID:$sample\\tSM:$sample'";
         }
-        my $rg_string = join(" ", @rg_lines);
+        $rg_string = join(" ", @rg_lines);
+    }
+
+    my $streaming_dedup = ($remove_dups && ! $parallel_dedup);
+
+    if ($streaming_dedup) {
+        # dedup consumes the sorted records as they're streamed out, writing the bam and its index in one pass
+        $cmd .= " | samtools sort -@ $CPU -m 4G -o - - ";
+        if ($rg_string) {
+            $cmd .= " | samtools addreplacerg $rg_string -O BAM -o - - ";
+        }
+        $cmd .= " | $FindBin::RealBin/bam_mark_duplicates.py -i - -o $temp_bam --remove_dups --CPU $CPU ";
+    }
+    else {
+        $cmd .= " | samtools sort -@ $CPU -m 4G -o $temp_bam - ";
+    }
+
+    $cmd =~ s/([\"\$`])/\\$1/g;
+    $cmd = "bash -c \"set -eo pipefail; $cmd\"";
+
+    $pipeliner->add_commands( new Command($cmd, "minimap2_align.ok") );
+
+    if (@intermediate_bams) {
+        $pipeliner->add_commands( new Command("rm -f @intermediate_bams", "rm_intermediate_alignments.ok") );
+    }
+
+
+    # Handle read groups if samples file was provided
+    if (@read_group_samples && ! $streaming_dedup) {
+        # Need to add read groups to the BAM file
+        my $rg_added_bam = "$temp_bam.rg.bam";
 
         $cmd = "samtools addreplacerg $rg_string -o $rg_added_bam $temp_bam";
         $pipeliner->add_commands( new Command($cmd, "add_read_groups.ok") );
@@ -293,10 +428,23 @@ main: {
 
 
     # Rename to final output name
-    $pipeliner->add_commands( new Command("mv $temp_bam $output_bam", "$output_bam.ok") );
+    if ($streaming_dedup) {
+        # already indexed, along with the duplicate stats
+        $pipeliner->add_commands( new Command("mv $temp_bam $output_bam && mv $temp_bam.bai $output_bam.bai && mv $temp_bam.dup_stats.tsv $output_bam.dup_stats.tsv", "$output_bam.ok") );
+    }
+    elsif ($remove_dups) {
+        # the parallel dedup works from the indexed bam, writing the deduplicated bam with its index
+        $pipeliner->add_commands( new Command("samtools index $temp_bam", "$temp_bam.dedup_input.bai.ok") );
 
-    # Index the BAM file
-    $pipeliner->add_commands( new Command("samtools index $output_bam", "$output_bam.bai.ok") );
+        $pipeliner->add_commands( new Command("$FindBin::RealBin/bam_mark_duplicates.py -i $temp_bam -o $output_bam --remove_dups --CPU $CPU "
+                                              . " && rm -f $temp_bam $temp_bam.bai", "$output_bam.ok") );
+    }
+    else {
+        $pipeliner->add_commands( new Command("mv $temp_bam $output_bam", "$output_bam.ok") );
+
+        # Index the BAM file
+        $pipeliner->add_commands( new Command("samtools index $output_bam", "$output_bam.bai.ok") );
+    }
 
 
     $pipeliner->run();
@@ -307,6 +455,32 @@ main: {
 
 
 
+####
+sub build_shared_index {
+    my ($fasta_file, $index_file) = @_;
+
+    my $index_signature = &Checkpoint_stamp::get_build_signature([$fasta_file], []);
+
+    if (&Checkpoint_stamp::get_recorded_build_signature("$index_file.build.ok") eq $index_signature) {
+        return;
+    }
+
+    # concurrent samples wait on the one build
+    open(my $lock_fh, ">", "$index_file.lock") or die "Error, cannot write to $index_file.lock";
+    flock($lock_fh, LOCK_EX) or die "Error, cannot lock $index_file.lock";
+
+    unless (&Checkpoint_stamp::get_recorded_build_signature("$index_file.build.ok") eq $index_signature) {
+        &process_cmd("$minimap2_prog -d $index_file.tmp $fasta_file");
+        rename("$index_file.tmp", $index_file) or die "Error, cannot rename $index_file.tmp to $index_file";
+        &Checkpoint_stamp::write_build_signature("$index_file.build.ok", $index_signature);
+    }
+
+    close $lock_fh;
+
+    return;
+}
+
+
 ####
 sub process_cmd {
 	my ($cmd) = @_;
@@ -34,7 +34,6 @@ def main():
                       " --samples_file {} ".format(batch) +
                       " --fusions {}".format(fusions_file) +
                       " --max_sensitivity " +
-                      " --no_FFPM " +
                       " --output_dir {} ".format(output_dir) +
                       " ".join(unknown_args) )
 
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import sys, os, re
+import argparse
+import gzip
+import logging
+
+sys.path.insert(0, os.path.sep.join([os.path.dirname(os.path.realpath(__file__)), "../PyLib"]))
+from FusionGroups import split_fusion_pair, get_gene_connected_fusion_groups
+
+
+logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="splits the fusion targets into shards balanced by total gene length, keeping fusions that share a gene in the same shard", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--fusions", type=str, required=True, help="fusion target list files (geneA--geneB format), comma-delimited")
+    parser.add_argument("--gtf", type=str, required=True, help="reference annotation gtf (ie. ref_annot.gtf) from which gene lengths are taken")
+    parser.add_argument("--num_shards", type=int, required=True, help="number of shards")
+    parser.add_argument("--out_prefix", type=str, required=True, help="writes out_prefix.shard_{1..num_shards}.txt")
+
+    args = parser.parse_args()
+
+    fusion_pairs = get_fusion_pairs(args.fusions.split(","))
+
+    components = get_gene_connected_fusion_groups(fusion_pairs)
+
+    logger.info("-{} fusion targets in {} groups of fusions sharing genes".format(len(fusion_pairs), len(components)))
+
+    num_shards = min(args.num_shards, len(components))
+
+    gene_lengths = get_gene_lengths(args.gtf, get_target_genes(fusion_pairs))
+
+    shards = assign_shards(components, gene_lengths, num_shards)
+
+    for i, shard in enumerate(shards):
+        shard_file = "{}.shard_{}.txt".format(args.out_prefix, i + 1)
+        with open(shard_file, "wt") as ofh:
+            for fusion_pair in shard["fusions"]:
+                print(fusion_pair, file=ofh)
+
+        logger.info("-wrote {}: {} fusions, {} bp of genes".format(shard_file, len(shard["fusions"]), shard["length"]))
+
+    sys.exit(0)
+
+
+def get_fusion_pairs(fusion_files):
+    """
+    distinct fusion pairs in order of first appearance
+    """
+
+    fusion_pairs = list()
+    seen = set()
+
+    for fusion_file in fusion_files:
+        if re.search("\\.gz$", fusion_file):
+            fh = gzip.open(fusion_file, "rt")
+        else:
+            fh = open(fusion_file, "rt")
+
+        for line in fh:
+            if line.startswith("#") or not line.strip():
+                continue
+            fusion_pair = line.split()[0]
+            if fusion_pair not in seen:
+                seen.add(fusion_pair)
+                fusion_pairs.append(fusion_pair)
+
+        fh.close()
+
+    return fusion_pairs
+
+
+def get_target_genes(fusion_pairs):
+
+    genes = set()
+    for fusion_pair in fusion_pairs:
+        for gene in split_fusion_pair(fusion_pair):
+            genes.add(gene)
+            # readthru genes are split into their parts by fusion_pair_to_mini_genome_join.pl
+            genes.update(gene.split("-"))
+
+    return genes
+
+
+def get_gene_lengths(gtf_file, genes_want):
+
+    gene_bounds = dict()
+
+    with open(gtf_file, "rt") as fh:
+        for line in fh:
+            if line.startswith("#"):
+                continue
+            vals = line.split("\t")
+            if len(vals) < 9 or vals[2] != "exon":
+                continue
+
+            for attr in ("gene_name", "gene_id"):
+                m = re.search(attr + ' "([^"]+)"', vals[8])
+                if m and m.group(1) in genes_want:
+                    gene = m.group(1)
+                    lend, rend = int(vals[3]), int(vals[4])
+                    if gene in gene_bounds:
+                        lend = min(lend, gene_bounds[gene][0])
+                        rend = max(rend, gene_bounds[gene][1])
+                    gene_bounds[gene] = (lend, rend)
+
+    return { gene: rend - lend + 1 for (gene, (lend, rend)) in gene_bounds.items() }
+
+
+def get_fusion_pair_length(fusion_pair, gene_lengths):
+
+    length = 0
+    for gene in split_fusion_pair(fusion_pair):
+        if gene in gene_lengths:
+            length += gene_lengths[gene]
+        else:
+            length += sum([ gene_lengths.get(gene_part, 0) for gene_part in gene.split("-") ])
+
+    return length
+
+
+def assign_shards(components, gene_lengths, num_shards):
+    """
+    longest-processing-time-first: largest groups first, each to the currently smallest shard.
+    Ties are broken by input order, so the assignment is deterministic.
+    """
+
+    group_lengths = list()
+    for i, component in enumerate(components):
+        # each gene's sequence is included in the contig of every fusion it's in
+        length = sum([ get_fusion_pair_length(fusion_pair, gene_lengths) for fusion_pair in component ])
+        group_lengths.append( (length, i) )
+
+    shards = [ { "length": 0, "groups": list() } for i in range(num_shards) ]
+
+    for length, i in sorted(group_lengths, key=lambda x: (-x[0], x[1])):
+        shard = min(shards, key=lambda s: s["length"])
+        shard["length"] += length
+        shard["groups"].append(i)
+
+    # fusions written in input order within each shard
+    for shard in shards:
+        shard["fusions"] = [ fusion_pair for i in sorted(shard["groups"]) for fusion_pair in components[i] ]
+
+    return shards
+
+
+if __name__=='__main__':
+    main()